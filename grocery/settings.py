@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import os
 import dj_database_url
+from corsheaders.defaults import default_headers
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -53,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.request_metrics.RequestMetricsMiddleware',
+    'shop.routers.ReplicaPinMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -94,6 +97,125 @@ DATABASES = {
     )
 }
 
+# Read replicas for the catalog endpoints (shop/routers.py): comma-separated
+# database URLs, one alias each. Clients that wrote, and every client right
+# after a catalog change, read the primary for REPLICA_LAG_SECONDS.
+DATABASE_REPLICAS = []
+for number, url in enumerate(filter(None, os.environ.get('REPLICA_DATABASE_URLS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = dj_database_url.parse(url.strip(), conn_max_age=600)
+    DATABASES[f'replica{number}']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['shop.routers.ReplicaRouter']
+REPLICA_LAG_SECONDS = 5
+
+for database in DATABASES.values():
+    if database['ENGINE'] == 'django.db.backends.sqlite3':
+        # WAL lets readers run alongside the writer; IMMEDIATE takes the write
+        # lock when a transaction starts, so concurrent checkouts queue on the
+        # busy timeout instead of failing with "database is locked" mid-way.
+        database.setdefault('OPTIONS', {}).update({
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        })
+
+
+# Cache
+# The catalog, stock and pricing versions live here, so when several
+# processes run (gunicorn workers, the Procfile worker, management commands
+# such as import_catalog next to the web process) they must share it: set
+# REDIS_URL. Without it each process gets its own LocMemCache, which is
+# fine for a single process; gunicorn.conf.py refuses to fork several
+# workers on it and `manage.py check --deploy` warns (shop/checks.py).
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'kapzar-default',
+        }
+    }
+
+# Catalog cache (shop/catalog_cache.py)
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', '300'))
+# Stock moves refresh cached listings and ETags at most once per this many
+# seconds (the most their stock figures can lag); 0 refreshes on every move
+CATALOG_STOCK_INTERVAL = int(os.environ.get('CATALOG_STOCK_INTERVAL', '5'))
+
+# Product search (shop/search.py) and typeahead index (shop/suggest.py)
+SUGGEST_MAX_PRODUCTS = int(os.environ.get('SUGGEST_MAX_PRODUCTS', '50000'))
+SUGGEST_REFRESH_SECONDS = 2
+
+# Catalog delta sync (shop/changes.py)
+CATALOG_CHANGES_PAGE_SIZE = 500
+CATALOG_CHANGES_LAG = 5
+CATALOG_TOMBSTONE_DAYS = 30
+
+# Stock reservations (shop/inventory.py): unpaid orders hold stock this long
+INVENTORY_RESERVATION_TTL = int(os.environ.get('INVENTORY_RESERVATION_TTL', '900'))
+
+# Idempotency-Key on the order and payment POSTs (shop/idempotency.py):
+# keys are stored in the database and replayed for this many seconds
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+
+# Signed cart tokens (shop/cart.py SignedCart, /api/cart/)
+CART_MAX_ITEMS = 50
+CART_MAX_QUANTITY = 20
+CART_TOKEN_MAX_LENGTH = 2048
+CART_TOKEN_MAX_AGE = 60 * 60 * 24 * 30
+
+# Token -> user cache in front of TokenAuthentication (shop/authentication.py)
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', '60'))
+AUTH_CACHE_MAX_ENTRIES = 10000
+AUTH_CACHE_REFRESH_SECONDS = 2
+
+# Password hashing pool (shop/hashing.py): processes per web worker,
+# requests allowed to wait per web worker, seconds before giving up (503)
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', '4'))
+PASSWORD_HASH_TIMEOUT = 5
+
+AUTHENTICATION_BACKENDS = ['shop.backends.PooledModelBackend']
+
+# Product/category thumbnails (shop/images.py): widths in pixels, WebP/JPEG
+# quality, rendering processes per web worker (0 renders inline)
+IMAGE_THUMBNAIL_WIDTHS = [160, 320, 640]
+IMAGE_THUMBNAIL_QUALITY = 80
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '1'))
+
+# Async catalog/checkout views (shop/async_endpoints.py), served by the ASGI
+# worker that gunicorn.conf.py selects from the same environment variable
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
+# Request instrumentation (shop/request_metrics.py)
+REQUEST_QUERY_BUDGET = int(os.environ.get('REQUEST_QUERY_BUDGET', '20'))
+REQUEST_LATENCY_BUDGET_MS = int(os.environ.get('REQUEST_LATENCY_BUDGET_MS', '500'))
+REQUEST_METRICS_SAMPLES = 1000
+# Only over-budget requests are logged by default; REQUEST_LOG_LEVEL=INFO logs every request
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'shop.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -142,6 +264,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Media serving (shop/media.py): cache lifetime of media without an upload
+# token in the name, and optional hand-off to the front proxy:
+# 'x-accel-redirect' (nginx, internal location at MEDIA_ACCEL_PREFIX) or
+# 'x-sendfile' (Apache, lighttpd)
+MEDIA_CACHE_SECONDS = 3600
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL', '')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
 # Add at the bottom of settings.py
 
 # Authentication Settings (add these at the bottom)
@@ -152,12 +282,13 @@ LOGOUT_REDIRECT_URL = '/'
 
 # CORS Settings - Allow all for Demo
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 # CORS_ALLOWED_ORIGINS = [ ... ]
 
 # DRF Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'shop.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -1,21 +1,20 @@
 # Filename: grocery/urls.py
 from django.contrib import admin
 from django.urls import path, include, re_path
-from django.views.static import serve
 from django.conf import settings
 from django.conf.urls.static import static
 
+from shop import media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('shop.urls')),
 ]
 
-# Serve media and static files
+# Media: caching headers, byte ranges, sendfile or proxy hand-off (shop/media.py)
+urlpatterns += [
+    re_path(r'^media/(?P<path>.*)$', media.serve, name='media'),
+]
+
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-else:
-    # Production media serving (for demo purposes)
-    urlpatterns += [
-        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
-    ]
\ No newline at end of file
+    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
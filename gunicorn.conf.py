@@ -0,0 +1,70 @@
+# gunicorn settings (read automatically from the working directory)
+import os
+
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+
+# ASYNC_VIEWS=True (see grocery/settings.py) serves the ASGI app from
+# uvicorn workers so the async views run on an event loop
+if os.environ.get('ASYNC_VIEWS', 'False') == 'True':
+    wsgi_app = 'grocery.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'grocery.wsgi:application'
+
+
+def on_starting(server):
+    """
+    Refuse to fork several workers on a per-process cache (LocMemCache, the
+    default without REDIS_URL): each would keep its own catalog and pricing
+    versions and serve the others' stale data. Set REDIS_URL, or
+    WEB_CONCURRENCY=1.
+    """
+    if server.cfg.workers < 2:
+        return
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'grocery.settings')
+    import django
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.core.exceptions import ImproperlyConfigured
+
+    django.setup()
+    from shop.catalog_cache import process_local
+
+    local = [alias for alias in settings.CACHES if process_local(caches[alias])]
+    if local:
+        raise ImproperlyConfigured(f"{server.cfg.workers} workers cannot share the per-process cache "
+                                   f"{', '.join(local)}: set REDIS_URL, or WEB_CONCURRENCY=1.")
+
+
+def when_ready(server):
+    """
+    Runs once in the master after the app is preloaded: build the product
+    typeahead index here so every forked worker shares it copy-on-write
+    instead of loading it separately.
+    """
+    from django.db import connections
+    from shop.suggest import index
+
+    try:
+        index.build()
+    except Exception as exc:  # e.g. migrations not applied yet; workers build lazily
+        server.log.warning("Suggest index preload skipped: %s", exc)
+    finally:
+        connections.close_all()
+
+
+def post_worker_init(worker):
+    """Start the worker's password hashing pool (shop/hashing.py) before it takes requests."""
+    from shop.hashing import pool
+
+    pool.warm()
+
+
+def worker_exit(server, worker):
+    """Stop the worker's password hashing and thumbnail pools (shop/hashing.py, shop/images.py) with it."""
+    from shop import images
+    from shop.hashing import pool
+
+    pool.shutdown()
+    images.shutdown()
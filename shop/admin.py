@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product
+from .models import Category, DeliveryRule, Discount, Product
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -12,3 +12,15 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ("available", "category")
     search_fields = ("name", "description")
     prepopulated_fields = {"slug": ("name",)}
+
+@admin.register(DeliveryRule)
+class DeliveryRuleAdmin(admin.ModelAdmin):
+    list_display = ("min_subtotal", "charge", "active")
+    list_filter = ("active",)
+
+@admin.register(Discount)
+class DiscountAdmin(admin.ModelAdmin):
+    list_display = ("name", "code", "category", "percent_off", "amount_off", "min_subtotal",
+                    "active", "starts_at", "ends_at")
+    list_filter = ("active", "category")
+    search_fields = ("name", "code")
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from . import checks  # noqa: F401  (registers the system checks)
+        from . import signals  # noqa: F401  (connects catalog receivers)
@@ -0,0 +1,199 @@
+# Filename: shop/async_endpoints.py
+"""
+Async versions of the catalog list/detail, order creation, register and
+login endpoints, used instead of the DRF views in shop/endpoints.py when
+ASYNC_VIEWS is on (served by the ASGI worker configured in gunicorn.conf.py).
+
+Responses are the same bytes as the DRF views, and the catalog views share
+their cache entries and ETags. Catalog cache hits and conditional GETs
+never leave the event loop; misses read through the async ORM. Search
+and cursor pages (?q=, ?cursor=, ?page_size=) are handed to the DRF view
+in a worker thread, as is the order transaction itself: the async ORM
+cannot run transaction.atomic(), so place_order() stays synchronous.
+Register and login await the password hashing pool (shop/hashing.py)
+instead of holding a thread. Catalog misses may read from a replica
+(shop/routers.py), like the DRF views. Order creation honours
+Idempotency-Key (shop/idempotency.py). These POST endpoints accept JSON
+bodies only.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib import auth
+from django.http import Http404, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.serializers import AuthTokenSerializer
+from rest_framework.renderers import JSONRenderer
+
+from . import catalog_cache, hashing, idempotency
+from .authentication import aauthenticate
+from .conditional import catalog_validators, not_modified_response, set_validators
+from .endpoints import ProductListAPI
+from .fast_serializers import parse_fields, product_values, serialize_products
+from .models import Product
+from .orders import OrderError, place_order
+from .routers import replica_reads
+from .serializers import OrderCreateSerializer, OrderSerializer, RegisterSerializer, UserSerializer
+
+PRODUCT_LIST_PARAMS = ProductListAPI.conditional_params
+SYNC_ONLY_PARAMS = ('q', 'cursor', 'page_size')
+
+sync_product_list = sync_to_async(ProductListAPI.as_view())
+
+
+def json_response(data, status: int = 200) -> HttpResponse:
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def json_body(request):
+    """(parsed body, None) or (None, 400 response)."""
+    try:
+        return json.loads(request.body or b'{}'), None
+    except ValueError as exc:
+        return None, json_response({'detail': f'JSON parse error - {exc}'}, status=400)
+
+
+def api_exception_response(exc: exceptions.APIException) -> HttpResponse:
+    """What DRF's exception handler would send for exc."""
+    response = json_response({'detail': exc.detail}, status=exc.status_code)
+    if getattr(exc, 'wait', None):
+        response['Retry-After'] = str(exc.wait)
+    return response
+
+
+class LoginFields(AuthTokenSerializer):
+    """AuthTokenSerializer's field checks only; the credentials are checked by the view."""
+
+    def validate(self, attrs):
+        return attrs
+
+
+async def _catalog_response(request, view_name, param_names, extra, namespace, build):
+    versions = await catalog_cache.acurrent()
+    etag, last_modified = catalog_validators(view_name, versions, request, param_names, extra)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    params = catalog_cache.request_params(request, param_names)
+    params.update(extra)
+    try:
+        with replica_reads():
+            data = await catalog_cache.aget_or_build(namespace, params, build)
+    except Http404:
+        return json_response({'detail': 'Not found.'}, status=404)
+    response = json_response(data)
+    set_validators(response, etag, last_modified)
+    return response
+
+
+@require_GET
+async def product_list(request):
+    if any(name in request.GET for name in SYNC_ONLY_PARAMS):
+        return await sync_product_list(request)
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except exceptions.ValidationError as exc:
+        return json_response(exc.detail, status=400)
+
+    async def build():
+        queryset = Product.objects.filter(available=True)
+        if request.GET.get('category'):
+            queryset = queryset.filter(category__slug=request.GET['category'])
+        rows = [row async for row in product_values(queryset, fields)]
+        return serialize_products(rows, request, fields)
+
+    return await _catalog_response(request, 'ProductListAPI', PRODUCT_LIST_PARAMS, {}, 'products', build)
+
+
+@require_GET
+async def product_detail(request, id):
+    async def build():
+        rows = [row async for row in product_values(Product.objects.filter(available=True, id=id))]
+        data = serialize_products(rows, request)
+        if not data:
+            raise Http404
+        return data[0]
+
+    return await _catalog_response(request, 'ProductDetailAPI', (), {'id': id}, 'product', build)
+
+
+def _place_order(data, user):
+    order = place_order(data, user=user)
+    return OrderSerializer(order).data
+
+
+@csrf_exempt
+@require_POST
+async def order_create(request):
+    try:
+        auth = await aauthenticate(request)
+    except exceptions.AuthenticationFailed as exc:
+        response = json_response({'detail': exc.detail}, status=401)
+        response['WWW-Authenticate'] = 'Token'
+        return response
+    data, error = json_body(request)
+    if error is not None:
+        return error
+
+    def work():
+        serializer = OrderCreateSerializer(data=data)
+        if not serializer.is_valid():
+            return 400, serializer.errors, {}
+        try:
+            return 201, _place_order(serializer.validated_data, auth[0] if auth else None), {}
+        except OrderError as exc:
+            return 400, {"error": str(exc)}, {}
+
+    try:
+        status, payload, headers, replayed = await idempotency.arun(request, auth[0] if auth else None, work)
+    except exceptions.APIException as exc:
+        return api_exception_response(exc)
+    response = json_response(payload, status=status)
+    for name, value in headers.items():
+        response[name] = value
+    if replayed:
+        response[idempotency.REPLAYED_HEADER] = 'true'
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def register(request):
+    data, error = json_body(request)
+    if error is not None:
+        return error
+    serializer = RegisterSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():  # the unique username check queries
+        return json_response(serializer.errors, status=400)
+    try:
+        password_hash = await hashing.ahash_password(serializer.validated_data['password'])
+    except hashing.PoolSaturated as exc:
+        return api_exception_response(exc)
+    user = RegisterSerializer.build_user(serializer.validated_data, password_hash)
+    await user.asave()
+    token, created = await Token.objects.aget_or_create(user=user)
+    return json_response({'user': UserSerializer(user).data, 'token': token.key}, status=201)
+
+
+@csrf_exempt
+@require_POST
+async def login(request):
+    data, error = json_body(request)
+    if error is not None:
+        return error
+    fields = LoginFields(data=data)
+    if not fields.is_valid():
+        return json_response(fields.errors, status=400)
+    try:
+        user = await auth.aauthenticate(request, username=fields.validated_data['username'],
+                                        password=fields.validated_data['password'])
+    except hashing.PoolSaturated as exc:
+        return api_exception_response(exc)
+    if user is None:
+        return json_response({'non_field_errors': ['Unable to log in with provided credentials.']}, status=400)
+    token, created = await Token.objects.aget_or_create(user=user)
+    return json_response({'token': token.key, 'user': UserSerializer(user).data})
@@ -0,0 +1,178 @@
+# Filename: shop/authentication.py
+"""
+Token authentication with an in-process token -> user cache.
+
+DRF's TokenAuthentication reads the Token and its User on every
+authenticated request. CachedTokenAuthentication keeps the result for
+AUTH_CACHE_TTL seconds in a per-process LRU of at most
+AUTH_CACHE_MAX_ENTRIES tokens, so a warm request runs no auth query.
+
+Deleting or rotating a token, and saving or deleting a user (deactivation,
+password or staff changes), drop the affected entries in this process and
+bump a shared revision in the default cache; other processes notice it
+within AUTH_CACHE_REFRESH_SECONDS and clear their cache. The TTL bounds
+staleness when the cache backend is not shared (LocMemCache).
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+REVISION_KEY = 'auth:revision'
+
+
+def _shared_revision() -> int:
+    return caches['default'].get(REVISION_KEY) or 0
+
+
+class TokenUserCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, Tuple[float, Any, Any]]' = OrderedDict()  # key -> (expires, user, token)
+        self.revision: Optional[int] = None
+        self.checked_at = 0.0
+        self.counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    @property
+    def ttl(self) -> float:
+        return getattr(settings, 'AUTH_CACHE_TTL', 60)
+
+    @property
+    def max_entries(self) -> int:
+        return getattr(settings, 'AUTH_CACHE_MAX_ENTRIES', 10000)
+
+    def ensure_current(self) -> None:
+        now = time.monotonic()
+        if self.revision is not None and now - self.checked_at < getattr(settings, 'AUTH_CACHE_REFRESH_SECONDS', 2):
+            return
+        revision = _shared_revision()
+        with self.lock:
+            if revision != self.revision:
+                self.counters['invalidations'] += len(self.entries)
+                self.entries.clear()
+                self.revision = revision
+            self.checked_at = now
+
+    def get(self, key: str) -> Optional[Tuple[Any, Any]]:
+        self.ensure_current()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            expires, user, token = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                self.counters['expired'] += 1
+                self.counters['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+        # a copy per request, so per-request state (permission caches) is not shared
+        return copy.copy(user), token
+
+    def put(self, key: str, user, token) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, user, token)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def discard(self, key: Optional[str] = None, user_id: Optional[int] = None) -> None:
+        with self.lock:
+            stale = [k for k, (_, user, _) in self.entries.items() if k == key or user.pk == user_id]
+            for k in stale:
+                del self.entries[k]
+            self.counters['invalidations'] += len(stale)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.revision = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            data = dict(self.counters)
+            data['size'] = len(self.entries)
+        lookups = data['hits'] + data['misses']
+        data['hit_rate'] = round(data['hits'] / lookups, 4) if lookups else 0.0
+        return data
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            for name in self.counters:
+                self.counters[name] = 0
+
+
+token_cache = TokenUserCache()
+
+
+def revoke(key: Optional[str] = None, user_id: Optional[int] = None) -> None:
+    """
+    Forget a token (or every token of a user) here and in other processes.
+    Runs again after commit, in case a concurrent request cached the old
+    row before the write was visible.
+    """
+    def drop():
+        token_cache.discard(key=key, user_id=user_id)
+        previous = _shared_revision()
+        revision = max(int(time.time() * 1000), previous + 1)
+        caches['default'].set(REVISION_KEY, revision, timeout=None)
+        with token_cache.lock:
+            # this process is already up to date, unless another one bumped in between
+            if token_cache.revision == previous:
+                token_cache.revision = revision
+
+    drop()
+    transaction.on_commit(drop)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in replacement for rest_framework.authentication.TokenAuthentication."""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.put(key, user, token)
+        return user, token
+
+
+async def aauthenticate(request):
+    """
+    CachedTokenAuthentication for async views (plain HttpRequest): returns
+    (user, token), or None without a token header; raises AuthenticationFailed.
+    """
+    auth = get_authorization_header(request).split()
+    if not auth or auth[0].lower() != b'token':
+        return None
+    if len(auth) == 1:
+        raise exceptions.AuthenticationFailed('Invalid token header. No credentials provided.')
+    if len(auth) > 2:
+        raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain spaces.')
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+
+    cached = token_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        token = await Token.objects.select_related('user').aget(key=key)
+    except Token.DoesNotExist:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    token_cache.put(key, token.user, token)
+    return token.user, token
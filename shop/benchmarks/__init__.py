@@ -0,0 +1,77 @@
+# Filename: shop/benchmarks/__init__.py
+"""
+Benchmarks run through `python manage.py benchmark <name>`.
+
+Each module in this package exposes `run(options, out)` and returns a
+JSON-serializable dict of results. They run against a throwaway test
+database (see isolated_database), never against db.sqlite3. A module
+that sets ON_DISK = True gets a file-backed SQLite test database, so that
+several threads can share it with the production PRAGMAs (WAL) in effect.
+"""
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+from ..request_metrics import percentiles  # noqa: F401 (re-exported for benchmark modules)
+
+BENCHMARKS = {
+    'asgi': 'shop.benchmarks.asgi',
+    'endpoints': 'shop.benchmarks.endpoints',
+    'hashing': 'shop.benchmarks.hashing',
+    'inventory': 'shop.benchmarks.inventory',
+    'media': 'shop.benchmarks.media',
+    'payments': 'shop.benchmarks.payments',
+    'pricing': 'shop.benchmarks.pricing',
+    'search': 'shop.benchmarks.search',
+    'serializers': 'shop.benchmarks.serializers',
+}
+
+
+@contextmanager
+def isolated_database(verbosity: int = 0, on_disk: bool = False):
+    """Create the test databases, yield, then destroy them."""
+    from django.db import connection
+    from django.test.utils import setup_databases, teardown_databases
+
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_name = test_settings.get('NAME')
+    if on_disk and connection.vendor == 'sqlite' and not old_name:
+        test_settings['NAME'] = os.path.join(tempfile.mkdtemp(prefix='shop-bench-'), 'bench.sqlite3')
+    old_config = setup_databases(verbosity=verbosity, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=verbosity)
+        test_settings['NAME'] = old_name
+
+
+def count_queries(fn: Callable[[], object], using: str = 'default') -> int:
+    """Run fn() once and return how many SQL statements it executed."""
+    from django.db import connections
+
+    count = 0
+
+    def wrapper(execute, sql, params, many, context):
+        nonlocal count
+        count += 1
+        return execute(sql, params, many, context)
+
+    with connections[using].execute_wrapper(wrapper):
+        fn()
+    return count
+
+
+def measure(fn: Callable[[], object], repeat: int = 5) -> Dict[str, float]:
+    """Call fn() `repeat` times and return timing statistics in milliseconds."""
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'best_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+    }
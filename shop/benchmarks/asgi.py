@@ -0,0 +1,171 @@
+# Filename: shop/benchmarks/asgi.py
+"""
+Load test: the same traffic against gunicorn with sync WSGI workers and
+with uvicorn workers serving the async views (ASYNC_VIEWS=True), both
+using gunicorn.conf.py and the same file-backed test database.
+
+At each concurrency level, that many clients send requests back to back
+(one connection per request): a mix of product detail and category list
+reads and order creation. The last scenario repeats the lowest level
+while SLOW_CLIENTS other clients each take SLOW_CLIENT_SECONDS to send
+their request body (mobile uploads): a sync worker is held for the whole
+upload, an event loop is not. Reported per server and scenario:
+throughput, p50/p95/p99 latency and errors.
+
+On CPU-bound requests the sync workers are faster: Django's ASGI handler
+runs each MiddlewareMixin middleware in a worker thread, which costs more
+than a cached catalog read. The async path pays off when requests wait.
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db import connection
+
+from . import percentiles
+from .search import seed_products
+from ..models import Category, Product
+
+ON_DISK = True
+DEFAULT_ROWS = [10000]
+CONCURRENCY = [1, 8, 32, 128]
+REQUESTS_PER_LEVEL = 1000
+SLOW_CLIENTS = 8
+SLOW_CLIENT_SECONDS = 2.0
+WORKERS = 2
+HOST = '127.0.0.1'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(async_views: bool, port: int, **extra_env: str) -> subprocess.Popen:
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{connection.settings_dict['NAME']}",
+               ASYNC_VIEWS=str(async_views), WEB_CONCURRENCY=str(WORKERS),
+               DEBUG='False', REQUEST_LOG_LEVEL='ERROR', **extra_env)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'{HOST}:{port}', '--log-level', 'warning'],
+        cwd=settings.BASE_DIR, env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start listening')
+
+
+async def fetch(port: int, method: str, path: str, body: bytes = b'', delay: float = 0.0) -> int:
+    """Send one request (the body `delay` seconds after the headers) and return the status."""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    head = (f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n')
+    writer.write(head.encode())
+    await writer.drain()
+    if delay:
+        await asyncio.sleep(delay)
+    writer.write(body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+def traffic(product_ids: List[int], category_slugs: List[str], rng: random.Random) -> Tuple[str, str, bytes]:
+    roll = rng.random()
+    if roll < 0.6:
+        return 'GET', f'/api/products/{rng.choice(product_ids)}/', b''
+    if roll < 0.9:
+        return 'GET', f'/api/products/?category={rng.choice(category_slugs)}&fields=id,name,price', b''
+    basket = {'full_name': 'Load', 'phone': '9999999999', 'address': 'MG Road',
+              'items': [{'product_id': rng.choice(product_ids), 'quantity': 1}]}
+    return 'POST', '/api/orders/create/', json.dumps(basket).encode()
+
+
+async def load(port: int, concurrency: int, total: int, product_ids, category_slugs, slow_clients: int = 0) -> Dict:
+    rng = random.Random(concurrency)
+    remaining = total
+    timings: List[float] = []
+    errors = 0
+    done = asyncio.Event()
+
+    async def slow_client():
+        basket = json.dumps({'full_name': 'Slow', 'phone': '9999999999', 'address': 'MG Road',
+                             'items': [{'product_id': product_ids[0], 'quantity': 1}]}).encode()
+        while not done.is_set():
+            try:
+                await fetch(port, 'POST', '/api/orders/create/', basket, delay=SLOW_CLIENT_SECONDS)
+            except OSError:
+                pass
+
+    async def client():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, path, body = traffic(product_ids, category_slugs, rng)
+            start = time.perf_counter()
+            try:
+                status = await fetch(port, method, path, body)
+            except (OSError, IndexError, ValueError):
+                status = 0
+            timings.append((time.perf_counter() - start) * 1000)
+            if not 200 <= status < 300:
+                errors += 1
+
+    slow = [asyncio.create_task(slow_client()) for _ in range(slow_clients)]
+    if slow:
+        await asyncio.sleep(0.5)  # let them occupy the workers first
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await asyncio.gather(*slow)
+    return {'requests': total, 'errors': errors, 'requests_per_sec': round(total / elapsed, 1), **percentiles(timings)}
+
+
+def run(options, out):
+    results = []
+    for rows in options.get('rows') or DEFAULT_ROWS:
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        seed_products(rows)
+        Product.objects.update(stock=10 ** 6)
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        category_slugs = list(Category.objects.values_list('slug', flat=True))
+        connection.close()
+
+        for mode, async_views in (('wsgi', False), ('asgi', True)):
+            port = free_port()
+            server = start_server(async_views, port)
+            try:
+                scenarios = [(c, 0, REQUESTS_PER_LEVEL) for c in CONCURRENCY]
+                scenarios.append((CONCURRENCY[0], SLOW_CLIENTS, REQUESTS_PER_LEVEL // 10))
+                for concurrency, slow_clients, total in scenarios:
+                    result = asyncio.run(load(port, concurrency, total, product_ids, category_slugs, slow_clients))
+                    result.update({'rows': rows, 'server': mode, 'concurrency': concurrency,
+                                   'slow_clients': slow_clients})
+                    results.append(result)
+                    label = f'c={concurrency}' + (f'+{slow_clients} slow' if slow_clients else '')
+                    out.write(f"{mode}  {label:<12} {result['requests_per_sec']:>8.1f} req/s  "
+                              f"p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  "
+                              f"p99 {result['p99_ms']:>8.2f} ms  errors {result['errors']}")
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    return {'workers': WORKERS, 'results': results}
@@ -0,0 +1,260 @@
+# Filename: shop/benchmarks/endpoints.py
+"""
+Every route in shop/urls.py driven through the test client against a
+seeded catalog (--rows products, default 10000) and --orders orders
+(default 100000).
+
+Each case is requested once cold and then --repeat times (at least 20)
+warm; the report has p50/p95/p99 latency and the queries per request.
+Streamed responses (the order export) are read to the end inside the
+timing.
+Cases are checked against the budgets in budgets.json (max queries on any
+request, cold or warm, and warm p95); going over a budget, or a route with
+no case, is a failure.
+"""
+import gc
+import json
+import logging
+import os
+import time
+from decimal import Decimal
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import percentiles
+from .payments import seed_orders as seed_unpaid_orders, settlement_file
+from .search import seed_products
+from .. import catalog_cache, changes, pricing, urls
+from ..cart import SignedCart
+from ..models import Category, Order, OrderItem, Product
+from ..orders import place_order
+
+DEFAULT_ROWS = [10000]
+DEFAULT_ORDERS = 100000
+MIN_SAMPLES = 20
+EXPORT_ORDERS = 1000  # the order export case covers the newest this many orders
+SETTLEMENT_ORDERS = 100  # orders in each settlement file the reconcile case posts
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), 'budgets.json')
+
+# (method, url, payload) or (method, url, payload, format) for one request;
+# built fresh for every request. The format defaults to json.
+Request = Tuple
+
+
+def seed_orders(count: int, users: List[User], product_ids: List[int]) -> None:
+    batch_size = 5000
+    for start in range(0, count, batch_size):
+        orders = Order.objects.bulk_create([
+            Order(user=users[i % len(users)], full_name=f'Customer {i}', phone='9999999999',
+                  address='MG Road', subtotal=Decimal('240.00'), delivery_charge=Decimal('40.00'),
+                  total=Decimal('280.00'), is_paid=i % 3 != 0)
+            for i in range(start, min(count, start + batch_size))
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_name=f'Product {product_ids[(order.pk + n) % len(product_ids)]}',
+                      price=Decimal('120.00'), quantity=1)
+            for order in orders for n in range(2)
+        ])
+
+
+class Fixture:
+    def __init__(self, rows: int, orders: int):
+        Order.objects.all().delete()
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        seed_products(rows)
+        Product.objects.update(stock=10 ** 6)
+        self.product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        self.category = Category.objects.order_by('id').first()
+
+        self.password = 'bench-password'
+        self.staff = User.objects.create_user('bench-staff', password=self.password, is_staff=True)
+        customers = User.objects.bulk_create([User(username=f'bench-customer-{i}') for i in range(999)])
+        self.customer = customers[0]
+        seed_orders(orders, [self.staff] + customers, self.product_ids)
+        self.order_id = Order.objects.filter(user=self.staff).order_by('-id').values_list('id', flat=True)[0]
+        self.export_after = Order.objects.order_by('-created_at', '-id').values_list(
+            'created_at', flat=True)[min(orders, EXPORT_ORDERS) - 1]
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.staff).key}')
+        self.anonymous = APIClient()
+        self.sequence = 0
+        self.sync_token = changes.changes_since(None)['token']
+        cart = SignedCart()
+        for pk in self.product_ids[:10]:
+            cart.add(pk, 2)
+        self.cart_token = cart.token
+        pricing.rules()  # compiled once per rules version, not part of any one request
+
+    def next(self) -> int:
+        self.sequence += 1
+        return self.sequence
+
+    def settlement(self) -> SimpleUploadedFile:
+        """A settlement file for SETTLEMENT_ORDERS new unpaid orders, a few records of it mismatched."""
+        product = Product.objects.get(pk=self.product_ids[0])
+        text = settlement_file(seed_unpaid_orders(SETTLEMENT_ORDERS, product))
+        return SimpleUploadedFile('settlement.csv', text.encode(), content_type='text/csv')
+
+    def basket(self) -> Dict:
+        return {
+            'full_name': 'Bench', 'phone': '9999999999', 'address': 'MG Road',
+            'items': [{'product_id': pk, 'quantity': 1} for pk in self.product_ids[:3]],
+        }
+
+
+def cases(f: Fixture) -> List[Tuple[str, str, bool, Callable[[], Request]]]:
+    """(case name, url name, authenticated, request builder)."""
+    def url(name, **kwargs):
+        return reverse(f'shop:{name}', kwargs=kwargs)
+
+    def new_category():
+        n = f.next()
+        return Category.objects.create(name=f'Bench {n}', slug=f'bench-new-{n}')
+
+    def new_product():
+        n = f.next()
+        return Product.objects.create(category=f.category, name=f'Bench {n}', slug=f'bench-new-{n}',
+                                      price=Decimal('10.00'))
+
+    return [
+        ('home', 'home', False, lambda: ('get', url('home'), None)),
+        ('api_register', 'api_register', False, lambda: ('post', url('api_register'), {
+            'username': f'bench-user-{f.next()}', 'password': f.password})),
+        ('api_login', 'api_login', False, lambda: ('post', url('api_login'), {
+            'username': f.staff.username, 'password': f.password})),
+        ('api_auth_cache_stats', 'api_auth_cache_stats', True, lambda: ('get', url('api_auth_cache_stats'), None)),
+        ('api_categories', 'api_categories', False, lambda: ('get', url('api_categories'), None)),
+        ('api_category_create', 'api_category_create', True, lambda: ('post', url('api_category_create'), {
+            'name': 'Bench', 'slug': f'bench-created-{f.next()}'})),
+        ('api_category_delete', 'api_category_delete', True, lambda: (
+            'delete', url('api_category_delete', pk=new_category().pk), None)),
+        ('api_products', 'api_products', False, lambda: ('get', url('api_products'), None)),
+        ('api_products?page_size', 'api_products', False, lambda: ('get', url('api_products') + '?page_size=50', None)),
+        ('api_products?category', 'api_products', False, lambda: (
+            'get', url('api_products') + f'?category={f.category.slug}', None)),
+        ('api_products?q', 'api_products', False, lambda: ('get', url('api_products') + '?q=organic+mango', None)),
+        ('api_product_suggest', 'api_product_suggest', False, lambda: (
+            'get', url('api_product_suggest') + '?q=man', None)),
+        ('api_product_changes', 'api_product_changes', False, lambda: (
+            'get', url('api_product_changes') + f'?since={f.sync_token}', None)),
+        ('api_product_create', 'api_product_create', True, lambda: ('post', url('api_product_create'), {
+            'category': f.category.pk, 'name': 'Bench', 'slug': f'bench-created-{f.next()}', 'price': '10.00'})),
+        ('api_product_delete', 'api_product_delete', True, lambda: (
+            'delete', url('api_product_delete', pk=new_product().pk), None)),
+        ('api_product_detail', 'api_product_detail', False, lambda: (
+            'get', url('api_product_detail', id=f.product_ids[len(f.product_ids) // 2]), None)),
+        ('api_catalog_cache_stats', 'api_catalog_cache_stats', True, lambda: (
+            'get', url('api_catalog_cache_stats'), None)),
+        ('api_request_metrics', 'api_request_metrics', True, lambda: ('get', url('api_request_metrics'), None)),
+        ('api_hashing_metrics', 'api_hashing_metrics', True, lambda: ('get', url('api_hashing_metrics'), None)),
+        ('api_cart', 'api_cart', False, lambda: ('get', url('api_cart') + f'?token={f.cart_token}', None)),
+        ('api_cart?add', 'api_cart', False, lambda: ('post', url('api_cart'), {
+            'token': f.cart_token, 'product_id': f.product_ids[-1], 'quantity': 1})),
+        ('api_cart_quote', 'api_cart_quote', False, lambda: ('post', url('api_cart_quote'), {
+            'items': [{'product_id': pk, 'quantity': 2} for pk in f.product_ids[:20]]})),
+        ('api_orders', 'api_orders', True, lambda: ('get', url('api_orders'), None)),
+        ('api_orders?status', 'api_orders', True, lambda: ('get', url('api_orders') + '?status=unpaid', None)),
+        ('api_orders?user', 'api_orders', True, lambda: (
+            'get', url('api_orders') + f'?user={f.customer.pk}', None)),
+        ('api_order_export', 'api_order_export', True, lambda: ('get', url('api_order_export') + '?' + urlencode({
+            'output': 'csv', 'created_after': f.export_after.isoformat()}), None)),
+        ('api_payment_reconcile', 'api_payment_reconcile', True, lambda: (
+            'post', url('api_payment_reconcile'), {'file': f.settlement()}, 'multipart')),
+        ('api_order_create', 'api_order_create', True, lambda: ('post', url('api_order_create'), f.basket())),
+        ('api_order_detail', 'api_order_detail', True, lambda: ('get', url('api_order_detail', id=f.order_id), None)),
+        ('api_order_pay', 'api_order_pay', True, lambda: (
+            'post', url('api_order_pay', order_id=place_order(f.basket(), f.staff).pk), {'txn_id': f'T{f.next()}'})),
+    ]
+
+
+def timed_request(client: APIClient, request: Request) -> Tuple[float, int, int]:
+    """(milliseconds, queries, status) for one request."""
+    method, path, payload, *rest = request
+    fmt = rest[0] if rest else 'json'
+    queries = 0
+
+    def wrapper(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        start = time.perf_counter()
+        response = getattr(client, method)(path, payload, format=fmt) if payload is not None \
+            else getattr(client, method)(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, queries, response.status_code
+
+
+def load_budgets() -> Dict[str, Dict[str, float]]:
+    with open(BUDGETS_PATH) as fh:
+        return json.load(fh)
+
+
+@override_settings(DEBUG=False)
+def run(options, out):
+    budgets = load_budgets()
+    logging.getLogger('shop.requests').disabled = True  # one line per request would drown the report
+    samples = max(options.get('repeat', 5), MIN_SAMPLES)
+    results, failures = [], []
+
+    for rows in options.get('rows') or DEFAULT_ROWS:
+        orders = options.get('orders') or DEFAULT_ORDERS
+        seeded = time.perf_counter()
+        fixture = Fixture(rows, orders)
+        out.write(f"Seeded {rows} products and {orders} orders in {time.perf_counter() - seeded:.1f} s")
+
+        all_cases = cases(fixture)
+        covered = {url_name for _, url_name, _, _ in all_cases}
+        for pattern in urls.urlpatterns:
+            if pattern.name not in covered:
+                failures.append(f'{pattern.name}: no benchmark case')
+
+        for name, url_name, authenticated, build in all_cases:
+            client = fixture.client if authenticated else fixture.anonymous
+            catalog_cache.bump_version()  # every case starts with a cold catalog cache
+            gc.collect()  # a full collection owed to earlier cases would land in this one
+            cold_ms, cold_queries, status = timed_request(client, build())
+            timings, queries = [], []
+            for _ in range(samples):
+                ms, count, status = timed_request(client, build())
+                timings.append(ms)
+                queries.append(count)
+            result = {
+                'rows': rows, 'orders': orders, 'case': name, 'url_name': url_name, 'status': status,
+                'cold_ms': round(cold_ms, 3), 'cold_queries': cold_queries,
+                'queries': max(queries), **percentiles(timings),
+            }
+            results.append(result)
+
+            budget = budgets.get(name)
+            if budget is None:
+                failures.append(f'{name}: no budget in budgets.json')
+            else:
+                if max(cold_queries, result['queries']) > budget['queries']:
+                    failures.append(f"{name}: {max(cold_queries, result['queries'])} queries, "
+                                    f"budget {budget['queries']}")
+                if result['p95_ms'] > budget['p95_ms']:
+                    failures.append(f"{name}: p95 {result['p95_ms']} ms, budget {budget['p95_ms']} ms")
+            if status >= 400:
+                failures.append(f'{name}: HTTP {status}')
+            out.write(f"{name:<26} {status}  p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  "
+                      f"p99 {result['p99_ms']:>8.2f} ms  queries {cold_queries:>3} cold / {result['queries']:>3} warm")
+
+    for failure in failures:
+        out.write(f'FAIL {failure}')
+    return {'samples': samples, 'results': results, 'failures': failures,
+            'finished_at': timezone.now().isoformat()}
@@ -0,0 +1,106 @@
+# Filename: shop/benchmarks/hashing.py
+"""
+Catalog latency during a login spike: for SECONDS, CATALOG_CLIENTS clients
+read product detail pages while LOGIN_CLIENTS clients log in back to back,
+against gunicorn (see asgi.py) with the password hashing pool off
+(PASSWORD_HASH_WORKERS=0, hashing inline in the web worker) and on.
+
+Runs with sync WSGI workers and with the async views, where login awaits
+the pool instead of holding a thread. Reported per server and pool size:
+catalog throughput and p50/p95/p99, logins per second, and how many logins
+were turned away with a 503 because the pool was saturated (those clients
+wait out the Retry-After before trying again).
+"""
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from . import percentiles
+from .asgi import fetch, free_port, start_server
+from .search import seed_products
+from ..models import Category, Product
+
+ON_DISK = True
+DEFAULT_ROWS = [10000]
+CATALOG_CLIENTS = 8
+LOGIN_CLIENTS = 16
+SECONDS = 20
+POOL_SIZES = [0, 2]
+PASSWORD = 'bench-password'
+
+
+async def spike(port: int, product_ids: List[int]) -> Dict:
+    timings: List[float] = []
+    errors = 0
+    logins = {200: 0, 503: 0, 'other': 0}
+    done = asyncio.Event()
+    body = json.dumps({'username': 'bench-login', 'password': PASSWORD}).encode()
+
+    async def login_client():
+        while not done.is_set():
+            try:
+                status = await fetch(port, 'POST', '/api/login/', body)
+            except (OSError, IndexError, ValueError):
+                status = 0
+            logins[status if status in logins else 'other'] += 1
+            if status == 503:
+                await asyncio.sleep(1)  # Retry-After
+
+    async def catalog_client(n: int):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await fetch(port, 'GET', f'/api/products/{product_ids[(len(timings) * 7 + n) % len(product_ids)]}/')
+            except (OSError, IndexError, ValueError):
+                status = 0
+            timings.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors += 1
+
+    spikers = [asyncio.create_task(login_client()) for _ in range(LOGIN_CLIENTS)]
+    await asyncio.sleep(0.5)  # let the logins pile up first
+    started = time.perf_counter()
+    deadline = started + SECONDS
+    await asyncio.gather(*(catalog_client(n) for n in range(CATALOG_CLIENTS)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await asyncio.gather(*spikers)
+    return {
+        'catalog_requests': len(timings), 'catalog_errors': errors,
+        'catalog_per_sec': round(len(timings) / elapsed, 1), **percentiles(timings),
+        'logins_per_sec': round(logins[200] / elapsed, 1), 'logins_rejected': logins[503],
+        'login_errors': logins['other'],
+    }
+
+
+def run(options, out):
+    results = []
+    for rows in options.get('rows') or DEFAULT_ROWS:
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        seed_products(rows)
+        User.objects.filter(username='bench-login').delete()
+        User.objects.create_user('bench-login', password=PASSWORD)
+        product_ids = list(Product.objects.filter(available=True).values_list('id', flat=True))
+        connection.close()
+
+        for mode, async_views in (('wsgi', False), ('asgi', True)):
+            for pool_size in POOL_SIZES:
+                port = free_port()
+                server = start_server(async_views, port, PASSWORD_HASH_WORKERS=str(pool_size))
+                try:
+                    result = asyncio.run(spike(port, product_ids))
+                finally:
+                    server.terminate()
+                    server.wait(timeout=30)
+                result.update({'rows': rows, 'server': mode, 'hash_workers': pool_size})
+                results.append(result)
+                out.write(f"{mode}  hash workers {pool_size}  catalog {result['catalog_per_sec']:>7.1f} req/s  "
+                          f"p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  p99 {result['p99_ms']:>8.2f} ms  "
+                          f"logins {result['logins_per_sec']:>5.1f}/s  rejected {result['logins_rejected']}")
+    return {'catalog_clients': CATALOG_CLIENTS, 'login_clients': LOGIN_CLIENTS, 'results': results}
@@ -0,0 +1,85 @@
+# Filename: shop/benchmarks/inventory.py
+"""
+Concurrent checkout stress test: many threads race place_order() for a few
+scarce products. Passes only if no product is oversold and every unit
+taken from stock is accounted for by a reservation.
+"""
+import threading
+import time
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Sum
+
+from ..models import Category, Order, Product, StockReservation
+from ..orders import OrderError, place_order
+
+ON_DISK = True
+DEFAULT_ROWS = [5]
+THREADS = 16
+ORDERS_PER_THREAD = 25
+STOCK = 100
+
+
+def run(options, out):
+    results, failures = [], []
+    for product_count in options.get('rows') or DEFAULT_ROWS:
+        Order.objects.all().delete()
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        category = Category.objects.create(name='Flash sale', slug='flash-sale')
+        products = Product.objects.bulk_create([
+            Product(category=category, name=f'Deal {i}', slug=f'deal-{i}', price=Decimal('99.00'), stock=STOCK)
+            for i in range(product_count)
+        ])
+        ids = [p.id for p in products]
+        counts = {'placed': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start = threading.Barrier(THREADS)
+
+        def shopper(n):
+            try:
+                start.wait()
+                for i in range(ORDERS_PER_THREAD):
+                    # two products per basket, so baskets overlap and compete
+                    a, b = ids[(n + i) % len(ids)], ids[(n + i + 1) % len(ids)]
+                    items = [{'product_id': a, 'quantity': 2}, {'product_id': b, 'quantity': 1}]
+                    try:
+                        place_order({'full_name': 'Bench', 'phone': '0', 'address': '-', 'items': items})
+                        outcome = 'placed'
+                    except OrderError:
+                        outcome = 'rejected'
+                    except Exception:
+                        outcome = 'errors'
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=shopper, args=(n,)) for n in range(THREADS)]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        stock = dict(Product.objects.filter(id__in=ids).values_list('id', 'stock'))
+        held = dict(StockReservation.objects.values('product_id').annotate(total=Sum('quantity'))
+                    .values_list('product_id', 'total'))
+        oversold = sorted(pk for pk in ids if stock[pk] < 0)
+        unbalanced = sorted(pk for pk in ids if stock[pk] + held.get(pk, 0) != STOCK)
+
+        result = {
+            'products': product_count, 'threads': THREADS, 'attempts': THREADS * ORDERS_PER_THREAD,
+            **counts, 'oversold': oversold, 'unbalanced': unbalanced,
+            'seconds': round(elapsed, 3), 'orders_per_sec': round(counts['placed'] / elapsed, 1),
+        }
+        results.append(result)
+        out.write(f"{product_count:>4} products  {THREADS} threads  placed {counts['placed']:>4}  "
+                  f"rejected {counts['rejected']:>4}  errors {counts['errors']:>3}  "
+                  f"{result['orders_per_sec']:>8.1f} orders/s  oversold {len(oversold)}")
+        if oversold or unbalanced or counts['errors']:
+            failures.append(result)
+
+    return {'results': results, 'failures': failures}
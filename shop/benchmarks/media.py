@@ -0,0 +1,129 @@
+# Filename: shop/benchmarks/media.py
+"""
+Media serving: shop/media.py against django.views.static.serve, the view
+it replaced. --rows are file sizes in KB (a thumbnail, a photo, a
+supplier original).
+
+In process, per file and view, the median time to produce and drain the
+response and the bytes sent for: a plain GET; a revalidation by a client
+holding a copy (If-None-Match for the new view, If-Modified-Since, the
+only validator the old view gives, for the old one); and a RANGE_BYTES
+range request, which the old view answers with the whole file.
+
+Then over gunicorn (sync workers, see asgi.py), CLIENTS clients fetch the
+largest file back to back for SECONDS, with sendfile and with
+GUNICORN_CMD_ARGS=--no-sendfile (the file copied through Python):
+throughput and latency.
+"""
+import asyncio
+import os
+import shutil
+import time
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import connection
+from django.test import RequestFactory
+from django.views.static import serve as static_serve
+
+from . import measure, percentiles
+from .asgi import fetch, free_port, start_server
+from .. import media
+
+ON_DISK = True
+DEFAULT_ROWS = [16, 256, 8192]
+RANGE_BYTES = 65536
+CLIENTS = 8
+SECONDS = 10
+DIRECTORY = 'benchmark-media'
+
+
+def drain(response) -> int:
+    """Bytes of the body, read the way a WSGI server without sendfile would."""
+    sent = sum(len(chunk) for chunk in response) if response.streaming else len(response.content)
+    response.close()
+    return sent
+
+
+async def download(port: int, path: str) -> Dict:
+    timings: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + SECONDS
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await fetch(port, 'GET', path)
+            except (OSError, IndexError, ValueError):
+                status = 0
+            timings.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(CLIENTS)))
+    elapsed = time.perf_counter() - started
+    return {'requests': len(timings), 'errors': errors, 'requests_per_sec': round(len(timings) / elapsed, 1),
+            **percentiles(timings)}
+
+
+def run(options, out):
+    repeat = max(options.get('repeat', 5), 20)
+    root = os.path.join(settings.MEDIA_ROOT, DIRECTORY)
+    os.makedirs(root, exist_ok=True)
+    factory = RequestFactory()
+    results, served = [], []
+    try:
+        for kb in options.get('rows') or DEFAULT_ROWS:
+            name = f'{DIRECTORY}/photo-{kb}k.{"0" * 12}.jpg'
+            with open(os.path.join(settings.MEDIA_ROOT, name), 'wb') as fh:
+                fh.write(os.urandom(kb * 1024))
+            served.append((kb, name))
+
+            fresh = media.serve(factory.get(f'/media/{name}'), name)
+            old = static_serve(factory.get(f'/media/{name}'), name, document_root=settings.MEDIA_ROOT)
+            cases = {
+                'get': ({}, {}),
+                'revalidate': ({'HTTP_IF_NONE_MATCH': fresh['ETag']},
+                               {'HTTP_IF_MODIFIED_SINCE': old['Last-Modified']}),
+                'range': ({'HTTP_RANGE': f'bytes=0-{RANGE_BYTES - 1}'}, {'HTTP_RANGE': f'bytes=0-{RANGE_BYTES - 1}'}),
+            }
+            drain(fresh), drain(old)
+            for case, (new_headers, old_headers) in cases.items():
+                views = {
+                    'media.serve': lambda: media.serve(factory.get(f'/media/{name}', **new_headers), name),
+                    'static.serve': lambda: static_serve(factory.get(f'/media/{name}', **old_headers), name,
+                                                         document_root=settings.MEDIA_ROOT),
+                }
+                for view, call in views.items():
+                    response = call()
+                    result = {'kb': kb, 'case': case, 'view': view, 'status': response.status_code,
+                              'bytes': drain(response), 'cache_control': response.get('Cache-Control', ''),
+                              **measure(lambda: drain(call()), repeat)}
+                    results.append(result)
+                    out.write(f"{kb:>6} KB  {case:<10} {view:<12} {result['status']}  "
+                              f"median {result['median_ms']:>8.3f} ms  {result['bytes']:>9} bytes  "
+                              f"Cache-Control: {result['cache_control'] or '-'}")
+
+        kb, name = served[-1]
+        connection.close()
+        transfers = []
+        for label, extra in (('sendfile', {}), ('no sendfile', {'GUNICORN_CMD_ARGS': '--no-sendfile'})):
+            port = free_port()
+            server = start_server(False, port, **extra)
+            try:
+                result = asyncio.run(download(port, f'/media/{name}'))
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+            result.update({'kb': kb, 'mode': label,
+                           'mb_per_sec': round(result['requests_per_sec'] * kb / 1024, 1)})
+            transfers.append(result)
+            out.write(f"gunicorn {label:<12} {kb} KB  {result['requests_per_sec']:>7.1f} req/s "
+                      f"({result['mb_per_sec']} MB/s)  p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f} ms  "
+                      f"errors {result['errors']}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return {'results': results, 'gunicorn': transfers}
@@ -0,0 +1,108 @@
+# Filename: shop/benchmarks/payments.py
+"""
+Settlement file reconciliation (shop/payments.py) on --rows records.
+
+Seeds as many unpaid orders, each with a line item and a stock hold, and
+a CSV settlement file for them in which MISMATCH_EVERY-th records carry a
+wrong amount, an unknown order or a repeated order. Reports the rows/sec
+of Reconciler over the parsed file and the queries it ran, and the rows/sec
+of the per-order path ConfirmPaymentAPI takes (consume() then a full
+order.save()) on BASELINE_ROWS other orders. A run fails unless exactly
+the well-formed records were paid.
+"""
+import io
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import count_queries
+from .. import inventory
+from ..models import Category, Order, OrderItem, Product, StockReservation
+from ..payments import Reconciler
+from ..streaming import batches, encode, read_rows
+
+ON_DISK = True
+DEFAULT_ROWS = [100000]
+BASELINE_ROWS = 2000
+MISMATCH_EVERY = 50
+
+
+def seed_orders(count: int, product: Product) -> list:
+    """`count` unpaid orders with one item and one held reservation each; returns (id, total) pairs."""
+    expires_at = timezone.now() + timedelta(days=1)
+    orders = []
+    for batch in batches(range(count), 5000):
+        with transaction.atomic():
+            created = Order.objects.bulk_create([
+                Order(full_name='Bench', phone='0', address='-', subtotal=Decimal(100 + n % 400),
+                      total=Decimal(100 + n % 400)) for n in batch
+            ])
+            OrderItem.objects.bulk_create([OrderItem(order=order, product_name=product.name, price=order.total,
+                                                     quantity=1) for order in created])
+            StockReservation.objects.bulk_create([StockReservation(order=order, product=product, quantity=1,
+                                                                   expires_at=expires_at) for order in created])
+        orders += [(order.id, order.total) for order in created]
+    return orders
+
+
+def settlement_file(orders: list) -> str:
+    rows = []
+    for n, (order_id, total) in enumerate(orders):
+        kind = n % MISMATCH_EVERY
+        if kind == 1:
+            total += 1
+        elif kind == 2:
+            order_id += 10 ** 9
+        rows.append((order_id, f'UPI{n:012d}', total))
+        if kind == 3:
+            rows.append((order_id, f'UPI{n:012d}R', total))
+    return ''.join(encode('csv', ['order_id', 'txn_id', 'amount'], rows))
+
+
+def run(options, out):
+    results, failures = [], []
+    for rows in options.get('rows') or DEFAULT_ROWS:
+        Order.objects.all().delete()
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        category = Category.objects.create(name='Bench', slug='bench')
+        product = Product.objects.create(category=category, name='Bench', slug='bench',
+                                         price=Decimal('100.00'), stock=10 ** 9)
+        orders = seed_orders(rows, product)
+        baseline = seed_orders(BASELINE_ROWS, product)
+        text = settlement_file(orders)
+
+        reconciler = Reconciler()
+        records = list(read_rows(io.StringIO(text), 'csv'))
+        queries = count_queries(lambda: reconciler.run(records))
+        stats = reconciler.stats
+
+        began = time.perf_counter()
+        for n, (order_id, _) in enumerate(baseline):
+            order = Order.objects.get(id=order_id)
+            with transaction.atomic():
+                inventory.consume(order)
+                order.is_paid = True
+                order.payment_txn_id = f'BASE{n:012d}'
+                order.save()
+        baseline_seconds = time.perf_counter() - began
+
+        expected = sum(1 for n in range(rows) if n % MISMATCH_EVERY not in (1, 2))
+        paid = Order.objects.filter(is_paid=True, id__lte=orders[-1][0])
+        repeats_paid = paid.filter(payment_txn_id__endswith='R').count()
+        result = {
+            'rows': len(records), 'orders': rows, 'paid': stats['paid'], 'mismatched': stats['mismatched'],
+            'reasons': {reason: count for reason, count in stats['reasons'].items() if count},
+            'queries': queries, 'seconds': stats['seconds'], 'rows_per_sec': stats['rows_per_sec'],
+            'baseline_rows': BASELINE_ROWS, 'baseline_rows_per_sec': round(BASELINE_ROWS / baseline_seconds, 1),
+        }
+        results.append(result)
+        out.write(f"{len(records):>7} records  paid {stats['paid']:>7}  mismatched {stats['mismatched']:>5}  "
+                  f"{queries} queries  {stats['seconds']:>7.2f}s  {stats['rows_per_sec']:>9.1f} rows/s  "
+                  f"(per-order confirm: {result['baseline_rows_per_sec']:.1f} rows/s)")
+        if not paid.count() == stats['paid'] == expected or repeats_paid:
+            failures.append(result)
+    return {'results': results, 'failures': failures}
@@ -0,0 +1,73 @@
+# Filename: shop/benchmarks/pricing.py
+"""
+Basket pricing throughput (shop/pricing.py) on large baskets.
+
+For each basket size: RuleTable.price() on the compiled table, the same
+with the rules compiled for every basket (what reading the rules per
+request would cost), and the full cart.quote() with its catalog query.
+Seeded with --rows products over 20 categories, a category discount on
+half of them, three basket-wide discounts and RULE_COUPONS coupons.
+"""
+from decimal import Decimal
+
+from django.test.utils import override_settings
+
+from . import count_queries, measure
+from .serializers import seed_products
+from .. import cart, pricing
+from ..models import Category, Discount, Product
+
+DEFAULT_ROWS = [10000]
+BASKET_SIZES = [10, 100, 1000, 10000]
+RULE_COUPONS = 1000
+
+
+def seed_rules() -> None:
+    categories = list(Category.objects.order_by('id').values_list('id', flat=True))
+    Discount.objects.bulk_create(
+        [Discount(name=f'Category {pk}', category_id=pk, percent_off=Decimal(5 + i % 20))
+         for i, pk in enumerate(categories[::2])]
+        + [Discount(name=f'Basket {n}', min_subtotal=Decimal(500 * n), percent_off=Decimal(n))
+           for n in (1, 2, 3)]
+        + [Discount(name=f'Coupon {n}', code=f'BENCH{n}', amount_off=Decimal(50)) for n in range(RULE_COUPONS)]
+    )
+    pricing.bump_version()
+
+
+def run(options, out):
+    results = []
+    repeat = options.get('repeat', 5)
+    for rows in options.get('rows') or DEFAULT_ROWS:
+        Discount.objects.all().delete()
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        seed_products(rows)
+        seed_rules()
+        products = list(Product.objects.order_by('id').values_list('id', 'category_id', 'price'))
+        compile_stats = measure(lambda: pricing.compile_rules(0), repeat)
+        table = pricing.rules()
+
+        for size in BASKET_SIZES:
+            if size > len(products):
+                continue
+            basket = products[:size]
+            lines = [(category_id, price, 1 + pk % 3) for pk, category_id, price in basket]
+            quantities = {pk: 1 + pk % 3 for pk, _, _ in basket}
+
+            compiled = measure(lambda: table.price(lines, coupon='BENCH7'), repeat)
+            uncompiled = measure(lambda: pricing.compile_rules(0).price(lines, coupon='BENCH7'), repeat)
+            with override_settings(CART_MAX_ITEMS=size):
+                quote = measure(lambda: cart.quote(quantities, coupon='BENCH7'), repeat)
+                queries = count_queries(lambda: cart.quote(quantities, coupon='BENCH7'))
+            result = {
+                'rows': rows, 'basket_lines': size,
+                'compiled': compiled, 'compiled_per_request': uncompiled, 'quote': quote, 'quote_queries': queries,
+                'compiled_lines_per_sec': round(size / (compiled['median_ms'] / 1000)),
+                'quotes_per_sec': round(1000 / quote['median_ms'], 1),
+            }
+            results.append(result)
+            out.write(f"{size:>6} lines  compiled {compiled['median_ms']:>8.3f} ms "
+                      f"({result['compiled_lines_per_sec']:,} lines/s)  "
+                      f"compiled per request {uncompiled['median_ms']:>8.3f} ms  "
+                      f"quote {quote['median_ms']:>8.3f} ms, {queries} query")
+    return {'compile': compile_stats, 'coupons': RULE_COUPONS, 'results': results}
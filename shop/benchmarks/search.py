@@ -0,0 +1,71 @@
+# Filename: shop/benchmarks/search.py
+"""
+Ranked full-text search (shop/search.py) against the old name__icontains filter.
+"""
+import random
+from decimal import Decimal
+
+from . import measure
+from .. import search
+from ..models import Category, Product
+
+DEFAULT_ROWS = [100000]
+PAGE_SIZE = 50
+
+ADJECTIVES = ['fresh', 'organic', 'green', 'red', 'farm', 'baby', 'premium', 'local', 'dried', 'frozen']
+NOUNS = ['apple', 'banana', 'mango', 'spinach', 'paneer', 'milk', 'bread', 'rice', 'tomato', 'onion',
+         'potato', 'almond', 'cashew', 'yogurt', 'butter', 'cheese', 'coffee', 'tea', 'honey', 'lentil']
+QUERIES = ['mango', 'organic spinach', 'kapizor', 'alm', 'paner', 'zzz']
+
+
+def brand_names(rng, count=2000):
+    """Pronounceable made-up brand names, so most terms are as selective as in a real catalog."""
+    syllables = ['ka', 'pi', 'zor', 'ven', 'lu', 'ma', 'dri', 'so', 'ta', 'ri', 'nex', 'bo', 'gu', 'la']
+    return sorted({''.join(rng.choice(syllables) for _ in range(3)) for _ in range(count)})
+
+
+def seed_products(count: int) -> None:
+    rng = random.Random(42)
+    categories = Category.objects.bulk_create([
+        Category(name=f'Category {i}', slug=f'bench-category-{i}') for i in range(20)
+    ])
+    brands = brand_names(rng)
+    batch = []
+    for i in range(count):
+        brand, adjective, noun = rng.choice(brands), rng.choice(ADJECTIVES), rng.choice(NOUNS)
+        batch.append(Product(
+            category=categories[i % len(categories)],
+            name=f'{brand} {adjective} {noun} {rng.choice(brands)}'.title(), slug=f'bench-product-{i}',
+            description=' '.join(rng.choice(brands + NOUNS) for _ in range(12)),
+            price=Decimal(10 + i % 500), stock=i % 100,
+        ))
+        if len(batch) == 5000:
+            Product.objects.bulk_create(batch)
+            batch = []
+    Product.objects.bulk_create(batch)
+    search.reindex_all()
+
+
+def run(options, out):
+    results = []
+    base = Product.objects.filter(available=True)
+    for rows in options.get('rows') or DEFAULT_ROWS:
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        seed_products(rows)
+        for query in QUERIES:
+            # the old endpoint returned every icontains match, unranked
+            icontains = measure(lambda: list(base.filter(name__icontains=query).values_list('id')),
+                                repeat=options.get('repeat', 5))
+            fts = measure(lambda: search.ranked_rows(base.values_list('id'), query),
+                          repeat=options.get('repeat', 5))
+            # the first ?q=&page_size=50 page
+            fts_page = measure(lambda: search.ranked_rows(base.values_list('id'), query, limit=PAGE_SIZE),
+                               repeat=options.get('repeat', 5))
+            hits = len(search.ranked_rows(base.values_list('id'), query).rows)
+            results.append({'rows': rows, 'query': query, 'hits': hits, 'icontains': icontains, 'fts': fts,
+                            'fts_page': fts_page})
+            out.write(f"{rows:>7} rows  {query!r:<24} icontains {icontains['median_ms']:>8.2f} ms   "
+                      f"fts {fts['median_ms']:>8.2f} ms   first page {fts_page['median_ms']:>8.2f} ms   "
+                      f"({hits} hits)")
+    return {'results': results}
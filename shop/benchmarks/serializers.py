@@ -0,0 +1,65 @@
+# Filename: shop/benchmarks/serializers.py
+"""
+ProductSerializer (DRF) against the fast_serializers path.
+"""
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from . import count_queries, measure
+from ..fast_serializers import product_values, serialize_products
+from ..models import Category, Product
+from ..serializers import ProductSerializer
+
+DEFAULT_ROWS = [1000, 10000]
+
+
+def seed_products(count: int) -> None:
+    categories = Category.objects.bulk_create([
+        Category(name=f'Category {i}', slug=f'bench-category-{i}') for i in range(20)
+    ])
+    Product.objects.bulk_create([
+        Product(
+            category=categories[i % len(categories)],
+            name=f'Product {i}', slug=f'bench-product-{i}',
+            description='Farm fresh, handpicked and delivered the same day. ' * 3,
+            price=Decimal(10 + i % 500) + Decimal('0.50'), stock=i % 100,
+            image=f'products/bench-{i}.jpg',
+        )
+        for i in range(count)
+    ], batch_size=2000)
+
+
+def run(options, out):
+    renderer = JSONRenderer()
+    request = APIRequestFactory().get('/api/products/')
+    drf_request = Request(request)
+    results = []
+
+    for rows in options.get('rows') or DEFAULT_ROWS:
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        seed_products(rows)
+        queryset = Product.objects.filter(available=True).order_by('id')
+
+        def drf():
+            return renderer.render(ProductSerializer(queryset.all(), many=True, context={'request': drf_request}).data)
+
+        def drf_select_related():
+            qs = queryset.select_related('category')
+            return renderer.render(ProductSerializer(qs, many=True, context={'request': drf_request}).data)
+
+        def fast():
+            return renderer.render(serialize_products(product_values(queryset.all()), request))
+
+        assert drf() == fast(), 'fast path output differs from ProductSerializer'
+
+        for name, fn in (('drf', drf), ('drf_select_related', drf_select_related), ('fast', fast)):
+            queries = count_queries(fn)
+            timing = measure(fn, repeat=options.get('repeat', 5))
+            results.append({'rows': rows, 'path': name, 'queries': queries, **timing})
+            out.write(f"{rows:>7} rows  {name:<20} {timing['median_ms']:>10.1f} ms  {queries:>6} queries")
+
+    return {'results': results}
@@ -1,7 +1,11 @@
 # Filename: shop/cart.py
 from decimal import Decimal, InvalidOperation
-from typing import Dict, Iterator, Any
+from typing import Dict, Iterator, Any, Optional
 from django.conf import settings
+from django.core import signing
+
+from . import pricing
+from .models import Product
 
 # Single session key constant (change if you prefer a different key)
 SESSION_KEY = getattr(settings, 'CART_SESSION_ID', 'cart')
@@ -18,6 +22,7 @@ class Cart:
           'image_url': str (optional)
       }
     All arithmetic converts price back to Decimal to avoid float errors.
+    Every change writes the session; API clients use SignedCart (below).
     """
     def __init__(self, request):
         self.session = request.session
@@ -157,6 +162,19 @@ class Cart:
             total += price * qty
         return total
 
+    def quote(self) -> Dict[str, Any]:
+        """
+        The cart at current catalog prices, availability and stock (see
+        quote() below), rather than the prices stored when items were added.
+        """
+        quantities = {}
+        for pid, item in self.cart.items():
+            try:
+                quantities[int(pid)] = int(item.get('quantity', 0))
+            except (AttributeError, TypeError, ValueError):
+                continue
+        return quote({pid: qty for pid, qty in quantities.items() if qty > 0})
+
     def merge_session_cart(self, other_cart: Dict[str, Dict[str, Any]]) -> None:
         """
         Merge another session-style cart dict into this cart.
@@ -188,3 +206,143 @@ class Cart:
                     'image_url': item.get('image_url', '')
                 }
         self.save()
+
+
+# Signed cart tokens: a stateless cart carried by the client
+CART_TOKEN_SALT = 'shop.cart'
+CART_TOKEN_VERSION = 1
+
+
+class CartError(Exception):
+    """Raised for an unusable cart token or change; the message is safe to return to the client."""
+
+
+def dump_token(items: Dict[int, int]) -> str:
+    """
+    Sign {product_id: quantity} as a compact token: a compressed JSON list
+    [version, id, qty, id, qty, ...] with a timestamp (django.core.signing).
+    """
+    payload = [CART_TOKEN_VERSION]
+    for product_id, quantity in items.items():
+        payload += [product_id, quantity]
+    return signing.dumps(payload, salt=CART_TOKEN_SALT, compress=True)
+
+
+def load_token(token: str) -> Dict[int, int]:
+    """Verify a token from dump_token() and return {product_id: quantity}; raises CartError."""
+    if len(token) > settings.CART_TOKEN_MAX_LENGTH:
+        raise CartError("Cart token too long")
+    try:
+        payload = signing.loads(token, salt=CART_TOKEN_SALT, max_age=settings.CART_TOKEN_MAX_AGE)
+    except signing.SignatureExpired:
+        raise CartError("Cart token expired")
+    except signing.BadSignature:
+        raise CartError("Invalid cart token")
+    if not isinstance(payload, list) or not payload or payload[0] != CART_TOKEN_VERSION or len(payload) % 2 != 1:
+        raise CartError("Unsupported cart token version")
+    items = dict(zip(payload[1::2], payload[2::2]))
+    _check_limits(items)
+    return items
+
+
+def _check_limits(items: Dict[int, int]) -> None:
+    if len(items) > settings.CART_MAX_ITEMS:
+        raise CartError(f"A cart can hold at most {settings.CART_MAX_ITEMS} products")
+    for product_id, quantity in items.items():
+        if not isinstance(product_id, int) or not isinstance(quantity, int) or product_id <= 0 or quantity <= 0:
+            raise CartError("Invalid cart token")
+        if quantity > settings.CART_MAX_QUANTITY:
+            raise CartError(f"At most {settings.CART_MAX_QUANTITY} of product {product_id} per cart")
+
+
+class SignedCart:
+    """
+    Stateless cart: only {product_id: quantity}, kept by the client as a
+    signed token (see dump_token) instead of in the session, so changing it
+    writes nothing to the database. Names and prices are never stored;
+    priced() reads them from the catalog in one query.
+    """
+    def __init__(self, token: Optional[str] = None):
+        self.items: Dict[int, int] = load_token(token) if token else {}
+
+    @property
+    def token(self) -> str:
+        return dump_token(self.items)
+
+    def add(self, product_id, quantity=1, override_quantity: bool = False) -> None:
+        """Add to (or, with override_quantity, set) a line; a resulting quantity <= 0 removes it."""
+        try:
+            product_id, quantity = int(product_id), int(quantity)
+        except (TypeError, ValueError):
+            raise CartError("product_id and quantity must be integers")
+        if product_id <= 0:
+            raise CartError(f"Invalid product {product_id}")
+        if not override_quantity:
+            quantity += self.items.get(product_id, 0)
+        if quantity <= 0:
+            self.remove(product_id)
+            return
+        items = dict(self.items)
+        items[product_id] = quantity
+        _check_limits(items)
+        self.items = items
+
+    def update(self, product_id, quantity) -> None:
+        self.add(product_id, quantity, override_quantity=True)
+
+    def remove(self, product_id) -> None:
+        self.items.pop(int(product_id), None)
+
+    def clear(self) -> None:
+        self.items = {}
+
+    def priced(self) -> Dict[str, Any]:
+        """The cart at current catalog prices (see quote()) with its token."""
+        return {'token': self.token, **quote(self.items)}
+
+
+def quote(quantities: Dict[int, int], coupon: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Price {product_id: quantity} against the catalog in one query: per line
+    the current price, availability, stock shortfall, line total and
+    discount, then subtotal, discount, delivery charge and total as
+    checkout would compute them (shop/pricing.py). Missing or unavailable
+    products are left out of the totals; `orderable` says whether checkout
+    would accept the basket as it is. The signed-cart size limits do not
+    apply here, as checkout does not apply them either. Raises CartError
+    for a bad coupon.
+    """
+    products = {
+        row[0]: row for row in
+        Product.objects.filter(id__in=quantities).values_list('id', 'name', 'price', 'stock', 'available',
+                                                              'category_id')
+    }
+    lines = []
+    priced = []  # (line, (category_id, price, quantity)) for the pricing engine
+    orderable = bool(quantities)
+    for product_id, quantity in quantities.items():
+        row = products.get(product_id)
+        if row is None or not row[4]:
+            orderable = False
+            lines.append({'product_id': product_id, 'name': row[1] if row else None, 'price': None,
+                          'quantity': quantity, 'line_total': None, 'discount': None,
+                          'available': False, 'shortfall': 0})
+            continue
+        _, name, price, stock, _, category_id = row
+        shortfall = max(0, quantity - stock)
+        orderable = orderable and not shortfall
+        line = {'product_id': product_id, 'name': name, 'price': str(price), 'quantity': quantity,
+                'line_total': str(price * quantity), 'discount': '0.00', 'available': True,
+                'shortfall': shortfall}
+        lines.append(line)
+        priced.append((line, (category_id, price, quantity)))
+
+    try:
+        result = pricing.rules().price([args for _, args in priced], coupon=coupon)
+    except pricing.PricingError as exc:
+        raise CartError(str(exc)) from exc
+    for (line, _), discount in zip(priced, result.line_discounts):
+        line['discount'] = str(discount)
+    return {'items': lines, 'subtotal': str(result.subtotal), 'discount': str(result.discount),
+            'coupon': result.coupon, 'delivery_charge': str(result.delivery_charge),
+            'total': str(result.total), 'orderable': orderable}
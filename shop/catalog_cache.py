@@ -0,0 +1,258 @@
+# Filename: shop/catalog_cache.py
+"""
+Versioned read-through cache for the public catalog endpoints.
+
+Serialized payloads are stored under a key derived from the endpoint
+namespace and its query parameters. Each entry remembers the catalog and
+stock versions it was built against; any write to Product or Category
+bumps the catalog version (see shop/signals.py) and any stock movement the
+stock version (shop/inventory.py), so older entries are treated as stale
+on the next read and rebuilt.
+
+Stock moves with every order, so they are coalesced: a move sets the stock
+version to the end of the current CATALOG_STOCK_INTERVAL window, and
+readers only act on it once that moment has passed. Cached payloads and
+catalog ETags therefore change about once per window however many orders
+come in, and the stock they show is at most CATALOG_STOCK_INTERVAL seconds
+behind. Checkout always reads the live figure (shop/inventory.py).
+
+Works with any Django cache backend - the alias is CATALOG_CACHE_ALIAS -
+but the version is only seen by every worker, by the Procfile worker and by
+management commands when the cache is shared (Redis or Memcached). A
+process-local cache (LocMemCache) only does for a single process; see
+shared(). The a-prefixed functions are the same for async views.
+"""
+import hashlib
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+VERSION_KEY = 'catalog:version'
+STOCK_VERSION_KEY = 'catalog:stock-version'
+KEY_PREFIX = 'catalog:payload'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _in_process(cache) -> bool:
+    # Django's a* cache methods run the sync ones in a worker thread; for an
+    # in-process cache that hop costs far more than the lookup itself
+    return isinstance(cache, LocMemCache)
+
+
+def process_local(cache) -> bool:
+    """Whether what is written to `cache` stays in this process, unseen by the others."""
+    return isinstance(cache, (LocMemCache, DummyCache))
+
+
+def shared() -> bool:
+    """
+    Whether the catalog version is shared by every process. Features that
+    must not act on another process's stale version (strong ETags, replica
+    reads) check this.
+    """
+    return not process_local(_cache())
+
+
+def _timeout() -> int:
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _stock_interval_ms() -> int:
+    return int(getattr(settings, 'CATALOG_STOCK_INTERVAL', 5) * 1000)
+
+
+def _read_version(cache, key: str) -> int:
+    version = cache.get(key)
+    if version is None:
+        version = _now_ms()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump(key: str) -> int:
+    cache = _cache()
+    current = cache.get(key) or 0
+    version = max(_now_ms(), current + 1)
+    cache.set(key, version, timeout=None)
+    return version
+
+
+def get_version() -> int:
+    """
+    Return the current catalog version.
+    Versions are millisecond timestamps, so if the version key itself is
+    evicted the fresh value is still newer than anything cached before it.
+    """
+    return _read_version(_cache(), VERSION_KEY)
+
+
+def bump_version() -> int:
+    """
+    Move the catalog to a new version, invalidating every cached payload.
+    """
+    return _bump(VERSION_KEY)
+
+
+def _effective_stock(version: int) -> int:
+    """The stock version readers act on: a window end set by bump_stock_version() counts once reached."""
+    interval = _stock_interval_ms()
+    if interval > 0 and version > _now_ms():
+        return version - interval
+    return version
+
+
+def get_stock_version() -> int:
+    return _effective_stock(_read_version(_cache(), STOCK_VERSION_KEY))
+
+
+def bump_stock_version() -> int:
+    """
+    Record a stock change (shop/inventory.py): the stock version becomes the
+    end of the current CATALOG_STOCK_INTERVAL window (immediately when the
+    interval is 0). Cached payloads carry stock, so they are invalidated as
+    by bump_version() once it is reached, but the typeahead index, which
+    only follows bump_version(), is not rebuilt.
+    """
+    interval = _stock_interval_ms()
+    if interval <= 0:
+        return _bump(STOCK_VERSION_KEY)
+    cache = _cache()
+    window_end = (_now_ms() // interval + 1) * interval
+    if (cache.get(STOCK_VERSION_KEY) or 0) < window_end:
+        cache.set(STOCK_VERSION_KEY, window_end, timeout=None)
+    return window_end
+
+
+def current() -> Tuple[int, int]:
+    """(catalog version, stock version): what cached payloads and catalog ETags depend on."""
+    cache = _cache()
+    found = cache.get_many([VERSION_KEY, STOCK_VERSION_KEY])
+    if len(found) == 2:
+        return found[VERSION_KEY], _effective_stock(found[STOCK_VERSION_KEY])
+    return _read_version(cache, VERSION_KEY), get_stock_version()
+
+
+async def _aread_version(cache, key: str) -> int:
+    version = await cache.aget(key)
+    if version is None:
+        version = _now_ms()
+        if not await cache.aadd(key, version, timeout=None):
+            version = await cache.aget(key, version)
+    return version
+
+
+async def acurrent() -> Tuple[int, int]:
+    cache = _cache()
+    if _in_process(cache):
+        return current()
+    found = await cache.aget_many([VERSION_KEY, STOCK_VERSION_KEY])
+    if len(found) == 2:
+        return found[VERSION_KEY], _effective_stock(found[STOCK_VERSION_KEY])
+    return await _aread_version(cache, VERSION_KEY), _effective_stock(await _aread_version(cache, STOCK_VERSION_KEY))
+
+
+def make_key(namespace: str, params: Dict[str, Any]) -> str:
+    """
+    Build a stable cache key from a namespace and a dict of parameters.
+    Parameter order does not matter; empty values are dropped.
+    """
+    parts = [f'{k}={params[k]}' for k in sorted(params) if params[k] not in (None, '')]
+    digest = hashlib.md5('&'.join(parts).encode('utf-8')).hexdigest()
+    return f'{KEY_PREFIX}:{namespace}:{digest}'
+
+
+def request_params(request, names: Iterable[str]) -> Dict[str, Any]:
+    """
+    Pick the given query parameters from a request, plus the scheme and host
+    (serialized image URLs are absolute, so they differ per host).
+    """
+    query = getattr(request, 'query_params', None) or request.GET
+    params = {name: query.get(name) for name in names}
+    params['_host'] = f'{request.scheme}://{request.get_host()}'
+    return params
+
+
+def get_or_build(namespace: str, params: Dict[str, Any], builder: Callable[[], Any]) -> Any:
+    """
+    Return the cached payload for (namespace, params), calling builder() to
+    produce and store it when missing or built against an older version.
+    """
+    cache = _cache()
+    key = make_key(namespace, params)
+    version = current()
+
+    entry: Optional[tuple] = cache.get(key)
+    if entry is not None:
+        entry_version, payload = entry
+        if entry_version == version:
+            _count('hits')
+            return payload
+        _count('evictions')
+    _count('misses')
+
+    payload = builder()
+    cache.set(key, (version, payload), timeout=_timeout())
+    return payload
+
+
+async def aget_or_build(namespace: str, params: Dict[str, Any], builder: Callable[[], Awaitable[Any]]) -> Any:
+    """get_or_build() for async views: builder is a coroutine function."""
+    cache = _cache()
+    key = make_key(namespace, params)
+    version = await acurrent()
+
+    entry: Optional[tuple] = cache.get(key) if _in_process(cache) else await cache.aget(key)
+    if entry is not None:
+        entry_version, payload = entry
+        if entry_version == version:
+            _count('hits')
+            return payload
+        _count('evictions')
+    _count('misses')
+
+    payload = await builder()
+    if _in_process(cache):
+        cache.set(key, (version, payload), timeout=_timeout())
+    else:
+        await cache.aset(key, (version, payload), timeout=_timeout())
+    return payload
+
+
+def stats() -> Dict[str, Any]:
+    """
+    Counters for this process: hits, misses, evictions (stale entries
+    replaced after a version bump) and the hit rate.
+    """
+    with _stats_lock:
+        data = dict(_stats)
+    lookups = data['hits'] + data['misses']
+    data['hit_rate'] = round(data['hits'] / lookups, 4) if lookups else 0.0
+    data['version'], data['stock_version'] = current()
+    return data
+
+
+def reset_stats() -> None:
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
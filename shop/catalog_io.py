@@ -0,0 +1,192 @@
+# Filename: shop/catalog_io.py
+"""
+Bulk catalog import/export (manage.py import_catalog / export_catalog).
+
+Import streams rows from CSV or JSONL and upserts Category and Product by
+slug, one transaction per batch: one lookup for existing categories, one
+for existing products, then a single INSERT ... ON CONFLICT (slug) DO
+UPDATE each for the categories and the products that are new or differ
+from what is stored. Unchanged rows are not written, so re-importing the
+same feed leaves updated_at (and so /api/products/changes/) alone. Bulk
+writes bypass model signals, so the search index is updated per batch and
+the catalog cache is invalidated once, at the end of an import that
+changed anything.
+
+The feed's stock is what is on hand. Units held by unpaid orders
+(shop/inventory.py) are subtracted from it, under a lock on the product
+rows, because release_expired() adds them back when the holds expire.
+"""
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalog_cache, inventory, search
+from .models import Category, Product
+from .streaming import batches, row_error
+
+COLUMNS = ['slug', 'name', 'category_slug', 'category_name', 'description',
+           'price', 'stock', 'image_url', 'available']
+UPDATE_FIELDS = ['category', 'name', 'description', 'price', 'stock', 'image_url', 'available', 'updated_at']
+# what a feed row sets; a row equal to the stored one on all of these is skipped
+COMPARED_FIELDS = ['category_id', 'name', 'description', 'price', 'stock', 'image_url', 'available']
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+PRICE_FIELD = Product._meta.get_field('price')
+MAX_PRICE = Decimal(10) ** (PRICE_FIELD.max_digits - PRICE_FIELD.decimal_places)
+
+
+class RowError(ValueError):
+    pass
+
+
+def _clean(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate and normalise one input row."""
+    error = row_error(raw)
+    if error:
+        raise RowError(error)
+    slug = (raw.get('slug') or '').strip()
+    category_slug = (raw.get('category_slug') or '').strip()
+    if not slug or not category_slug:
+        raise RowError("slug and category_slug are required")
+    try:
+        price = Decimal(str(raw.get('price', '')).strip())
+        stock = int(raw.get('stock') or 0)
+    except (InvalidOperation, ValueError):
+        raise RowError("invalid price or stock")
+    if not price.is_finite():
+        raise RowError("invalid price or stock")
+    if price < 0 or stock < 0:
+        raise RowError("price and stock must not be negative")
+    # checked here, not by the database, which would reject the whole batch
+    price = min(price, MAX_PRICE).quantize(Decimal('0.01'))
+    if price >= MAX_PRICE:
+        raise RowError(f"price must be below {MAX_PRICE}")
+    available = raw.get('available', True)
+    if isinstance(available, str):
+        available = available.strip().lower() in TRUE_VALUES
+    return {
+        'slug': slug,
+        'name': (raw.get('name') or slug).strip()[:200],
+        'category_slug': category_slug,
+        'category_name': (raw.get('category_name') or category_slug.replace('-', ' ').title()).strip()[:100],
+        'description': raw.get('description') or '',
+        'price': price,
+        'stock': stock,
+        'image_url': raw.get('image_url') or None,
+        'available': bool(available),
+    }
+
+
+class CatalogImporter:
+    def __init__(self, batch_size: int = 2000, progress: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.category_ids: Dict[str, int] = {}
+        self.category_names: Dict[str, str] = {}
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'categories_created': 0,
+                      'categories_updated': 0, 'errors': 0, 'error_samples': [], 'seconds': 0.0, 'rows_per_sec': 0.0}
+
+    def _resolve_categories(self, rows: List[Dict[str, Any]]) -> None:
+        wanted = {row['category_slug']: row['category_name'] for row in rows
+                  if self.category_names.get(row['category_slug']) != row['category_name']}
+        if not wanted:
+            return
+        existing = {slug: (pk, name) for slug, pk, name in
+                    Category.objects.filter(slug__in=wanted).values_list('slug', 'id', 'name')}
+        self.category_ids.update((slug, pk) for slug, (pk, _) in existing.items())
+        changed = [Category(slug=slug, name=name) for slug, name in wanted.items()
+                   if slug not in existing or existing[slug][1] != name]
+        if changed:
+            Category.objects.bulk_create(
+                changed, update_conflicts=True, unique_fields=['slug'], update_fields=['name', 'updated_at'],
+            )
+            created = [c.slug for c in changed if c.slug not in existing]
+            if created:
+                self.category_ids.update(Category.objects.filter(slug__in=created).values_list('slug', 'id'))
+            self.stats['categories_created'] += len(created)
+            self.stats['categories_updated'] += len(changed) - len(created)
+        self.category_names.update(wanted)
+
+    @transaction.atomic
+    def _import_batch(self, rows: List[Dict[str, Any]]) -> None:
+        rows = list({row['slug']: row for row in rows}.values())  # last row wins within a batch
+        self._resolve_categories(rows)
+        # locked so no checkout takes or returns stock between reading the holds and the upsert
+        existing = {
+            slug: (pk, values) for slug, pk, *values in Product.objects.select_for_update()
+            .filter(slug__in=[row['slug'] for row in rows]).values_list('slug', 'id', *COMPARED_FIELDS)
+        }
+        held = inventory.held_quantities(pk for pk, _ in existing.values())
+        now = timezone.now()
+        products = []
+        for row in rows:
+            pk, stored = existing.get(row['slug'], (None, None))
+            product = Product(
+                category_id=self.category_ids[row['category_slug']],
+                name=row['name'], slug=row['slug'], description=row['description'],
+                price=row['price'], stock=max(row['stock'] - held.get(pk, 0), 0), image_url=row['image_url'],
+                available=row['available'], updated_at=now,
+            )
+            if stored == [getattr(product, field) for field in COMPARED_FIELDS]:
+                self.stats['unchanged'] += 1
+            else:
+                products.append(product)
+        if not products:
+            return
+        # a single INSERT ... ON CONFLICT (slug) DO UPDATE per batch
+        Product.objects.bulk_create(
+            products, update_conflicts=True, unique_fields=['slug'], update_fields=UPDATE_FIELDS,
+        )
+        missing_ids = [p.slug for p in products if p.pk is None]
+        if missing_ids:
+            # backends that do not return ids for upserts
+            ids = dict(Product.objects.filter(slug__in=missing_ids).values_list('slug', 'id'))
+            for product in products:
+                if product.pk is None:
+                    product.pk = ids[product.slug]
+        search.index_products(products)
+        updated = sum(product.slug in existing for product in products)
+        self.stats['created'] += len(products) - updated
+        self.stats['updated'] += updated
+
+    def run(self, raw_rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            for batch in batches(enumerate(raw_rows, start=1), self.batch_size):
+                clean = []
+                for line, raw in batch:
+                    try:
+                        clean.append(_clean(raw))
+                    except RowError as exc:
+                        self.stats['errors'] += 1
+                        if len(self.stats['error_samples']) < 20:
+                            self.stats['error_samples'].append(f'row {line}: {exc}')
+                self.stats['rows'] += len(batch)
+                if clean:
+                    self._import_batch(clean)
+                self._update_rate(started)
+                if self.progress:
+                    self.progress(self.stats)
+        finally:
+            # one invalidation for the whole import instead of one per row
+            if any(self.stats[name] for name in ('created', 'updated', 'categories_created', 'categories_updated')):
+                catalog_cache.bump_version()
+        self._update_rate(started)
+        return self.stats
+
+    def _update_rate(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self.stats['seconds'] = round(elapsed, 3)
+        self.stats['rows_per_sec'] = round(self.stats['rows'] / elapsed, 1) if elapsed else 0.0
+
+
+def export_rows(queryset=None) -> Iterator[tuple]:
+    """Yield catalog rows (in COLUMNS order) with a server-side cursor."""
+    queryset = Product.objects.all() if queryset is None else queryset
+    yield from queryset.order_by('id').values_list(
+        'slug', 'name', 'category__slug', 'category__name', 'description',
+        'price', 'stock', 'image_url', 'available',
+    ).iterator(chunk_size=2000)
@@ -0,0 +1,26 @@
+# Filename: shop/checks.py
+"""
+System checks. `manage.py check --deploy` warns when the catalog cache is
+per-process: fine for a single web process, but with several (gunicorn
+workers, the Procfile worker, import_catalog) each keeps its own catalog,
+stock and pricing versions. gunicorn.conf.py enforces it for workers.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+from django.core.cache import caches
+
+from .catalog_cache import process_local
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    alias = getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+    if not process_local(caches[alias]):
+        return []
+    return [Warning(
+        f"The catalog cache '{alias}' is per-process, so the catalog, stock and pricing versions are not "
+        "shared between processes.",
+        hint="Set REDIS_URL when more than one process serves or writes the catalog (several gunicorn "
+             "workers, the release_reservations worker, import_catalog).",
+        id='shop.W001',
+    )]
@@ -0,0 +1,89 @@
+# Filename: shop/conditional.py
+"""
+Conditional GET support for DRF views (ETag / Last-Modified / 304).
+
+Views provide cheap validators through get_validators(); a matching
+If-None-Match or If-Modified-Since is answered with 304 before the
+queryset or serializer runs.
+"""
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+from typing import Optional, Tuple
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import catalog_cache
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from the given parts (quoted, as sent on the wire)."""
+    digest = hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()[:32]
+    return quote_etag(digest)
+
+
+def not_modified_response(request, etag: Optional[str], last_modified: Optional[datetime]):
+    """A 304 response if the request's preconditions match the validators, else None."""
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    if not (etag or timestamp):
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag: Optional[str], last_modified: Optional[datetime]) -> None:
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(int(last_modified.timestamp()))
+    response['Cache-Control'] = 'no-cache'  # may be stored, but always revalidated
+
+
+def catalog_validators(view_name: str, versions: Tuple[int, int], request, param_names,
+                       extra=None) -> Tuple[Optional[str], Optional[datetime]]:
+    """
+    Validators derived from the catalog and stock versions
+    (catalog_cache.current()): no query at all. Versions are millisecond
+    timestamps of the last write, so the later one doubles as Last-Modified.
+    None, None (no conditional handling) unless the versions are shared by
+    every process: a worker holding its own would keep answering 304 for
+    changes made elsewhere.
+    """
+    if not catalog_cache.shared():
+        return None, None
+    params = catalog_cache.request_params(request, param_names)
+    params.update(extra or {})
+    etag = make_etag(view_name, *versions, catalog_cache.make_key('', params))
+    return etag, datetime.fromtimestamp(max(versions) / 1000, tz=dt_timezone.utc)
+
+
+class ConditionalGetMixin:
+    """
+    Subclasses implement get_validators() returning (etag, last_modified)
+    where last_modified is an aware datetime or None. Returning (None, None)
+    skips conditional handling (e.g. the object does not exist).
+    """
+    def get_validators(self, request, *args, **kwargs) -> Tuple[Optional[str], Optional[datetime]]:
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request, *args, **kwargs)
+        not_modified = not_modified_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
+
+
+class CatalogConditionalMixin(ConditionalGetMixin):
+    """Validators from the catalog and stock versions, see catalog_validators()."""
+    conditional_params = ()
+
+    def get_validators(self, request, *args, **kwargs):
+        return catalog_validators(type(self).__name__, catalog_cache.current(), request,
+                                  self.conditional_params, kwargs)
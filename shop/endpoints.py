@@ -1,21 +1,33 @@
-from decimal import Decimal
-from rest_framework import generics, status, views, permissions
+import csv
+import io
+
+from rest_framework import generics, status, views, permissions, serializers
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Category, Product, Order, OrderItem
+from .models import Category, Product, Order
+from .cart import CartError, SignedCart, quote
+from . import (
+    authentication, catalog_cache, changes, hashing, inventory, order_export, payments, request_metrics, search,
+    streaming,
+)
+from .conditional import CatalogConditionalMixin, ConditionalGetMixin, make_etag
+from .idempotency import idempotent
+from .orders import OrderError, place_order
+from .pagination import OrderCursorPagination, ProductCursorPagination, SearchCursorPagination
+from .routers import ReplicaReadMixin
+from .fast_serializers import parse_fields, product_values, serialize_categories, serialize_products
+from .suggest import index as suggest_index
 from .serializers import (
     RegisterSerializer, UserSerializer, CategorySerializer, 
-    ProductSerializer, OrderSerializer, OrderCreateSerializer
+    ProductSerializer, OrderSerializer, OrderCreateSerializer, CartChangeSerializer,
+    CartQuoteSerializer
 )
 
-# Helper function
-def calc_delivery_charge(subtotal: Decimal) -> Decimal:
-    """Simple fallback: free delivery over 499, else flat 40."""
-    return Decimal('0.00') if subtotal >= Decimal('499.00') else Decimal('40.00')
-
 # Authentication APIs
 class RegisterAPI(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -44,11 +56,19 @@ class LoginAPI(ObtainAuthToken):
         })
 
 # Product APIs
-class CategoryListAPI(generics.ListAPIView):
+class CategoryListAPI(ReplicaReadMixin, CatalogConditionalMixin, generics.ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
 
+    def list(self, request, *args, **kwargs):
+        params = catalog_cache.request_params(request, ())
+        data = catalog_cache.get_or_build(
+            'categories', params,
+            lambda: serialize_categories(self.filter_queryset(self.get_queryset()), request)
+        )
+        return Response(data)
+
 class CategoryCreateAPI(generics.CreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -59,27 +79,60 @@ class CategoryDeleteAPI(generics.DestroyAPIView):
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAdminUser]
 
-class ProductListAPI(generics.ListAPIView):
-    queryset = Product.objects.filter(available=True)
+class ProductListAPI(ReplicaReadMixin, CatalogConditionalMixin, generics.ListAPIView):
+    queryset = Product.objects.filter(available=True).select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = ProductCursorPagination
+    conditional_params = ('category', 'q', 'fields', 'cursor', 'page_size')
+
+    def get_fields(self):
+        return parse_fields(self.request.query_params.get('fields'))
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_fields())
+        return super().get_serializer(*args, **kwargs)
 
     def get_queryset(self):
-        # raise Exception(f"DEBUG: Params: {self.request.query_params}")
         queryset = super().get_queryset()
         category_slug = self.request.query_params.get('category', None)
-        search_query = self.request.query_params.get('q', None)
-        
-        print(f"DEBUG: Params received - category: {category_slug}, search: {search_query}")
 
         if category_slug:
-            print(f"DEBUG: Filtering by category slug: {category_slug}")
             queryset = queryset.filter(category__slug=category_slug)
-        if search_query:
-            queryset = queryset.filter(name__icontains=search_query)
-            
+
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        params = catalog_cache.request_params(request, ('category', 'q', 'fields', 'cursor', 'page_size'))
+        data = catalog_cache.get_or_build('products', params, self.build_payload)
+        return Response(data)
+
+    def build_payload(self):
+        fields = self.get_fields()
+        rows = product_values(self.filter_queryset(self.get_queryset()), fields)
+        search_query = self.request.query_params.get('q', None)
+        if search_query:
+            payload = self.search_payload(rows, search_query, fields)
+            if payload is not None:
+                return payload
+            rows = rows.filter(name__icontains=search_query)  # no search index
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serialize_products(page, self.request, fields)).data
+        return serialize_products(rows, self.request, fields)
+
+    def search_payload(self, rows, search_query, fields):
+        """Every match in rank order, or one page of them; None when the search index is unavailable."""
+        paginator = SearchCursorPagination()
+        params = self.request.query_params
+        if paginator.cursor_query_param not in params and paginator.page_size_query_param not in params:
+            found = search.ranked_rows(rows, search_query)
+            return None if found is None else serialize_products(found.rows, self.request, fields)
+        page = paginator.paginate_search(rows, search_query, self.request)
+        if page is None:
+            return None
+        return paginator.get_paginated_response(serialize_products(page, self.request, fields)).data
+
 class ProductCreateAPI(generics.CreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
@@ -90,93 +143,263 @@ class ProductDeleteAPI(generics.DestroyAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAdminUser]
 
-class ProductDetailAPI(generics.RetrieveAPIView):
-    queryset = Product.objects.filter(available=True)
+class ProductDetailAPI(ReplicaReadMixin, CatalogConditionalMixin, generics.RetrieveAPIView):
+    queryset = Product.objects.filter(available=True).select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
     lookup_field = 'id'
 
+    def retrieve(self, request, *args, **kwargs):
+        params = catalog_cache.request_params(request, ())
+        params['id'] = kwargs[self.lookup_field]
+        data = catalog_cache.get_or_build('product', params, lambda: self.build_payload(params['id']))
+        return Response(data)
+
+    def build_payload(self, product_id):
+        rows = product_values(self.get_queryset().filter(id=product_id))
+        data = serialize_products(rows, self.request)
+        if not data:
+            raise Http404
+        return data[0]
+
+class ProductSuggestAPI(views.APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 8)), 20)
+        except ValueError:
+            limit = 8
+        return Response(suggest_index.lookup(request.query_params.get('q', ''), limit))
+
+class ProductChangesAPI(views.APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        try:
+            return Response(changes.changes_since(request.query_params.get('since'), request))
+        except changes.InvalidToken as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except changes.TokenExpired as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_410_GONE)
+
+class CatalogCacheStatsAPI(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(catalog_cache.stats())
+
+class AuthCacheStatsAPI(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(authentication.token_cache.stats())
+
+class RequestMetricsAPI(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(request_metrics.stats())
+
+class HashingMetricsAPI(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(hashing.pool.stats())
+
+# Cart APIs
+class CartAPI(views.APIView):
+    """
+    Stateless cart (SignedCart): nothing is stored server-side. Each
+    response carries the cart at current prices and a new token, which the
+    client sends back -- ?token= on GET, "token" in the body on POST.
+    POST adds `quantity` of a product, or sets it with override_quantity
+    (0 removes the line).
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        try:
+            cart = SignedCart(request.query_params.get('token'))
+        except CartError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response(cart.priced())
+
+    def post(self, request):
+        serializer = CartChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        change = serializer.validated_data
+        try:
+            cart = SignedCart(change.get('token'))
+            cart.add(change['product_id'], change['quantity'], override_quantity=change['override_quantity'])
+        except CartError as exc:
+            return Response({"error": str(exc)}, status=400)
+        data = cart.priced()
+        if any(line['product_id'] == change['product_id'] and not line['available'] for line in data['items']):
+            return Response({"error": f"Product {change['product_id']} not found or unavailable"}, status=400)
+        return Response(data)
+
+class CartQuoteAPI(views.APIView):
+    """
+    Validate a whole basket before checkout in one round trip and one query:
+    current prices, availability, stock shortfalls, line totals, discounts
+    (with an optional coupon), subtotal, delivery charge and total (see
+    cart.quote).
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        serializer = CartQuoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            return Response(quote(serializer.validated_data['items'], serializer.validated_data.get('coupon')))
+        except CartError as exc:
+            return Response({"error": str(exc)}, status=400)
+
 # Order APIs
+class OrderListAPI(generics.ListAPIView):
+    """
+    Order history, newest first: the user's own orders, or every order for
+    staff. Filters: ?status=paid|unpaid, ?created_after= / ?created_before=
+    (ISO date or datetime; a date covers the whole day), and ?user= for staff.
+    """
+    serializer_class = OrderSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderCursorPagination
+
+    def parse_bound(self, name, end_of_day=False):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return order_export.parse_moment(value, end_of_day)
+        except ValueError as exc:
+            raise serializers.ValidationError({name: str(exc)})
+
+    def parse_status(self):
+        order_status = self.request.query_params.get('status')
+        if order_status not in (None, '', *order_export.STATUSES):
+            raise serializers.ValidationError({'status': "Expected 'paid' or 'unpaid'"})
+        return order_status
+
+    def get_queryset(self):
+        user = self.request.user
+        params = self.request.query_params
+        queryset = Order.objects.all() if user.is_staff else Order.objects.filter(user=user)
+        if user.is_staff and params.get('user'):
+            if not params['user'].isdigit():
+                raise serializers.ValidationError({'user': "Expected a user id"})
+            queryset = queryset.filter(user_id=params['user'])
+
+        queryset = order_export.filter_orders(queryset, self.parse_status(), self.parse_bound('created_after'),
+                                              self.parse_bound('created_before', end_of_day=True))
+
+        # one query for the items of the whole page
+        return queryset.prefetch_related('items')
+
+class OrderExportAPI(OrderListAPI):
+    """
+    Every order and line item as a CSV (?output=csv, the default) or JSONL
+    (?output=jsonl) download for staff, streamed row by row
+    (shop/order_export.py). Takes the ?status= and ?created_after= /
+    ?created_before= filters of /api/orders/.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    pagination_class = None
+    content_types = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+
+    def get(self, request, *args, **kwargs):
+        fmt = request.query_params.get('output') or 'csv'
+        if fmt not in streaming.FORMATS:
+            raise serializers.ValidationError({'output': "Expected 'csv' or 'jsonl'"})
+        rows = order_export.export_rows(self.parse_status(), self.parse_bound('created_after'),
+                                        self.parse_bound('created_before', end_of_day=True))
+        response = StreamingHttpResponse(streaming.chunked(streaming.encode(fmt, order_export.COLUMNS, rows)),
+                                         content_type=self.content_types[fmt])
+        response['Content-Disposition'] = f'attachment; filename="orders.{fmt}"'
+        return response
+
 class OrderCreateAPI(views.APIView):
     permission_classes = [permissions.AllowAny]
 
+    @idempotent
     def post(self, request):
         serializer = OrderCreateSerializer(data=request.data)
         if serializer.is_valid():
-            data = serializer.validated_data
-            
-            subtotal = Decimal('0.00')
-            order_items_data = []
-            
-            for item in data['items']:
-                product_id = item.get('product_id')
-                quantity = item.get('quantity', 1)
-                
-                try:
-                    product = Product.objects.get(id=product_id, available=True)
-                except Product.DoesNotExist:
-                    return Response({"error": f"Product {product_id} not found or unavailable"}, status=400)
-                
-                line_total = product.price * quantity
-                subtotal += line_total
-                
-                order_items_data.append({
-                    'product': product,
-                    'quantity': quantity,
-                    'price': product.price
-                })
-            
-            delivery_charge = calc_delivery_charge(subtotal)
-            total = subtotal + delivery_charge
-            
             user = request.user if request.user.is_authenticated else None
-            
-            order = Order.objects.create(
-                user=user,
-                full_name=data['full_name'],
-                phone=data['phone'],
-                address=data['address'],
-                delivery_charge=delivery_charge,
-                subtotal=subtotal,
-                total=total,
-                is_paid=False,
-                payment_method="UPI"
-            )
-            
-            for item_data in order_items_data:
-                OrderItem.objects.create(
-                    order=order,
-                    product_name=item_data['product'].name,
-                    price=item_data['price'],
-                    quantity=item_data['quantity']
-                )
-            
+            try:
+                order = place_order(serializer.validated_data, user=user)
+            except OrderError as exc:
+                return Response({"error": str(exc)}, status=400)
             return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
             
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class OrderDetailAPI(generics.RetrieveUpdateAPIView):
+class OrderDetailAPI(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'id'
 
+    def get_validators(self, request, *args, **kwargs):
+        # Items never change after checkout, so the order row's updated_at covers the whole payload.
+        updated_at = self.get_queryset().filter(id=kwargs['id']).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return None, None
+        return make_etag('order', kwargs['id'], updated_at.isoformat()), updated_at
+
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
             return Order.objects.all()
         return Order.objects.filter(user=user)
 
+class PaymentReconcileAPI(views.APIView):
+    """
+    Reconcile a settlement file (shop/payments.py) for staff: a CSV or JSONL
+    upload in `file` (multipart; large files belong here, request bodies are
+    capped by DATA_UPLOAD_MAX_MEMORY_SIZE), or a JSON list of
+    {order_id, txn_id, amount} in `records`. Returns the counts and every
+    mismatch.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is not None:
+            fh = io.TextIOWrapper(upload, encoding='utf-8', newline='')
+            rows = streaming.read_rows(fh, streaming.guess_format(upload.name))
+        else:
+            rows = request.data if isinstance(request.data, list) else request.data.get('records')
+            if not isinstance(rows, list):
+                return Response({"error": "Upload a file or send a list of records"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        reconciler = payments.Reconciler()
+        try:
+            stats = reconciler.run(rows)
+        except (UnicodeDecodeError, ValueError, csv.Error) as exc:
+            # batches before the unreadable line are committed; report them
+            return Response({"error": f"Unreadable settlement file after row {reconciler.stats['rows']}: {exc}",
+                             **reconciler.stats}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(stats)
+
 class ConfirmPaymentAPI(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
     def post(self, request, order_id):
         order = get_object_or_404(Order, id=order_id, user=request.user)
         txn_id = request.data.get('txn_id')
         
         if txn_id:
-            order.is_paid = True
-            order.payment_txn_id = txn_id
-            order.save()
+            try:
+                with transaction.atomic():
+                    inventory.consume(order)
+                    order.is_paid = True
+                    order.payment_txn_id = txn_id
+                    order.save()
+            except inventory.OutOfStock as exc:
+                # the hold expired and the stock has since been sold
+                return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
             return Response({"status": "Payment confirmed"}, status=status.HTTP_200_OK)
         return Response({"error": "Transaction ID required"}, status=status.HTTP_400_BAD_REQUEST)
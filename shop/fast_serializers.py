@@ -0,0 +1,153 @@
+# Filename: shop/fast_serializers.py
+"""
+Read-only fast path for catalog serialization.
+
+Produces exactly the same data as ProductSerializer / CategorySerializer
+(same keys, order and value formatting, so the rendered JSON is
+byte-identical) but works on tuples from values_list(): the category join
+is done in SQL and no model instances or DRF field objects are created.
+"""
+import decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from rest_framework import serializers
+
+from .images import thumbnail_urls
+from .models import Category, Product
+from .request_metrics import timed
+from .serializers import CategorySerializer, ProductSerializer
+
+CENT = decimal.Decimal('.01')
+
+
+def _decimal(max_digits: int) -> Callable[[Any], str]:
+    """Mirror DRF's DecimalField: quantize to 2 places within max_digits, render as string."""
+    context = decimal.getcontext().copy()
+    context.prec = max_digits
+
+    def convert(value):
+        if value is None:
+            return ''
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return f'{value.quantize(CENT, context=context):f}'
+    return convert
+
+
+def _file_url(model, field_name: str, request) -> Callable[[Any], Optional[str]]:
+    """Mirror DRF's FileField/ImageField: absolute URL when a request is available."""
+    storage = model._meta.get_field(field_name).storage
+    build = request.build_absolute_uri if request is not None else None
+
+    def convert(name):
+        if not name:
+            return None
+        url = storage.url(name)
+        return build(url) if build else url
+    return convert
+
+
+def _thumbnails(request) -> Callable[[Any], Optional[Dict[str, Dict[str, str]]]]:
+    """Mirror ThumbnailsField."""
+    return thumbnail_urls(request.build_absolute_uri if request is not None else None)
+
+
+# serializer field name -> values_list() lookup
+PRODUCT_COLUMNS = {
+    'id': 'id',
+    'category': 'category_id',
+    'category_slug': 'category__slug',
+    'name': 'name',
+    'slug': 'slug',
+    'description': 'description',
+    'price': 'price',
+    'stock': 'stock',
+    'image_url': 'image_url',
+    'image': 'image',
+    'thumbnails': 'image_derivatives',
+    'available': 'available',
+}
+
+CATEGORY_COLUMNS = {
+    'id': 'id',
+    'name': 'name',
+    'slug': 'slug',
+    'image_url': 'image_url',
+    'image': 'image',
+    'thumbnails': 'image_derivatives',
+}
+
+
+def parse_fields(value: Optional[str]) -> Optional[List[str]]:
+    """Field projection from ?fields=id,name,price (None means all fields)."""
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = set(fields) - set(ProductSerializer.Meta.fields)
+    if unknown:
+        raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"})
+    return fields
+
+
+def _select_fields(all_fields: Sequence[str], fields: Optional[Iterable[str]]) -> List[str]:
+    if fields is None:
+        return list(all_fields)
+    wanted = set(fields)
+    return [name for name in all_fields if name in wanted]
+
+
+def product_values(queryset, fields: Optional[Iterable[str]] = None, extra: Sequence[str] = ()):
+    """
+    Turn a Product queryset into a values_list() queryset for the requested
+    fields. `id` is always the first column so cursor pagination can use it;
+    `extra` columns are appended after the serialized ones and ignored by
+    serialize_products().
+    """
+    names = _select_fields(ProductSerializer.Meta.fields, fields)
+    columns = ['id'] + [PRODUCT_COLUMNS[name] for name in names if name != 'id']
+    return queryset.values_list(*columns, *extra)
+
+
+def serialize_products(rows: Iterable[tuple], request=None, fields: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Build ProductSerializer-equivalent dicts from rows produced by product_values().
+    """
+    names = _select_fields(ProductSerializer.Meta.fields, fields)
+    converters: Dict[str, Callable] = {
+        'price': _decimal(Product._meta.get_field('price').max_digits),
+        'image': _file_url(Product, 'image', request),
+        'thumbnails': _thumbnails(request),
+    }
+    # position of each output field within the row (id is column 0)
+    positions = {'id': 0}
+    for index, name in enumerate(n for n in names if n != 'id'):
+        positions[name] = index + 1
+    plan = [(name, positions[name], converters.get(name)) for name in names]
+
+    data = []
+    rows = list(rows)  # run the query outside the serialize timer
+    with timed('serialize'):
+        for row in rows:
+            data.append({
+                name: convert(row[pos]) if convert else row[pos]
+                for name, pos, convert in plan
+            })
+    return data
+
+
+def serialize_categories(queryset, request=None) -> List[Dict[str, Any]]:
+    """
+    Build CategorySerializer-equivalent dicts for a Category queryset.
+    """
+    names = list(CategorySerializer.Meta.fields)
+    image = _file_url(Category, 'image', request)
+    thumbnails = _thumbnails(request)
+    data = []
+    rows = list(queryset.values_list(*[CATEGORY_COLUMNS[name] for name in names]))
+    with timed('serialize'):
+        for row in rows:
+            item = dict(zip(names, row))
+            item['image'] = image(item['image'])
+            item['thumbnails'] = thumbnails(item['thumbnails'])
+            data.append(item)
+    return data
@@ -0,0 +1,231 @@
+# Filename: shop/hashing.py
+"""
+Password hashing and verification in a bounded process pool.
+
+PBKDF2 is tens of milliseconds of pure CPU per call; run inline in the
+request worker, a login spike takes that CPU away from catalog requests.
+hash_password() and verify_password() send the work to a pool of
+PASSWORD_HASH_WORKERS processes and wait for the result. Each web worker
+starts its own pool after gunicorn forks it (gunicorn.conf.py), or on
+first use. A sync worker
+still waits for its result; the async login and register views
+(ASYNC_VIEWS) await it, so the event loop keeps serving other requests.
+
+At most PASSWORD_HASH_QUEUE calls may be queued or running per web worker.
+Past that, or when a result takes longer than PASSWORD_HASH_TIMEOUT
+seconds, they raise PoolSaturated, which DRF answers with a 503 and a
+Retry-After header instead of letting logins pile up.
+PASSWORD_HASH_WORKERS = 0 hashes inline, with the same queue limit.
+
+Login goes through PooledModelBackend (shop/backends.py), so DRF's
+AuthTokenSerializer and the admin login use the pool too. Time spent
+waiting for the pool shows up as `hash` in the request's Server-Timing
+header. Pool processes import this module before Django is set up, so it
+must not import models.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from rest_framework import exceptions
+
+from . import request_metrics
+from .request_metrics import percentiles
+
+
+class PoolSaturated(exceptions.APIException):
+    status_code = 503
+    default_detail = 'Too many sign-ins in progress, please retry shortly.'
+    default_code = 'hashing_saturated'
+    wait = 1  # seconds, sent as Retry-After by DRF's exception handler
+
+
+def _watch_parent(parent: int) -> None:
+    # a pool process blocks on its call queue and would outlive a killed web worker
+    while os.getppid() == parent:
+        time.sleep(1)
+    os._exit(0)
+
+
+def init_worker():
+    """Pool process initializer (here and in shop/images.py): set up Django, exit with the parent."""
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'grocery.settings')
+    django.setup()
+    threading.Thread(target=_watch_parent, args=(os.getppid(),), daemon=True).start()
+
+
+def _verify(password: str, encoded: str) -> Tuple[bool, Optional[str]]:
+    """(valid, new hash if the stored one should be upgraded) -- same rules as check_password()."""
+    if not check_password(password, encoded):
+        return False, None
+    preferred = get_hasher('default')
+    must_update = identify_hasher(encoded).algorithm != preferred.algorithm or preferred.must_update(encoded)
+    return True, make_password(password) if must_update else None
+
+
+class HashingPool:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.pid: Optional[int] = None
+        self.in_flight = 0
+        self.counters = {'completed': 0, 'rejected': 0, 'timeouts': 0, 'broken': 0}
+        self.samples: Deque[float] = deque(maxlen=1000)  # ms from submit to result
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        workers = getattr(settings, 'PASSWORD_HASH_WORKERS', 2)
+        if workers <= 0:
+            return None
+        if self.executor is None or self.pid != os.getpid():
+            # spawn, not fork: the web worker may already be running threads
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker,
+            )
+            self.pid = os.getpid()
+        return self.executor
+
+    def _acquire(self) -> Optional[ProcessPoolExecutor]:
+        with self.lock:
+            if self.in_flight >= getattr(settings, 'PASSWORD_HASH_QUEUE', 4):
+                self.counters['rejected'] += 1
+                raise PoolSaturated()
+            self.in_flight += 1
+            return self._executor()
+
+    def _release(self, *args) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+    def _submit(self, executor: ProcessPoolExecutor, fn, args) -> Future:
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._broken(executor)
+            raise PoolSaturated()
+        # the slot stays taken until the work is really done, even after a timeout
+        future.add_done_callback(self._release)
+        return future
+
+    def _broken(self, executor: ProcessPoolExecutor) -> None:
+        """A pool process died; start a fresh pool on the next call."""
+        with self.lock:
+            self.counters['broken'] += 1
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, name: str, start: Optional[float] = None) -> None:
+        with self.lock:
+            self.counters[name] += 1
+            if start is not None:
+                self.samples.append((time.perf_counter() - start) * 1000)
+
+    def run(self, fn, *args):
+        executor = self._acquire()
+        start = time.perf_counter()
+        with request_metrics.timed('hash'):
+            if executor is None:
+                try:
+                    result = fn(*args)
+                finally:
+                    self._release()
+            else:
+                future = self._submit(executor, fn, args)
+                try:
+                    result = future.result(timeout=getattr(settings, 'PASSWORD_HASH_TIMEOUT', 5))
+                except TimeoutError:
+                    future.cancel()
+                    self._count('timeouts')
+                    raise PoolSaturated()
+                except BrokenProcessPool:
+                    self._broken(executor)
+                    raise PoolSaturated()
+        self._count('completed', start)
+        return result
+
+    async def arun(self, fn, *args):
+        """run() for async views: the event loop keeps serving while the pool works."""
+        executor = self._acquire()
+        start = time.perf_counter()
+        with request_metrics.timed('hash'):
+            if executor is None:
+                try:
+                    result = await sync_to_async(fn, thread_sensitive=False)(*args)
+                finally:
+                    self._release()
+            else:
+                future = self._submit(executor, fn, args)
+                try:
+                    result = await asyncio.wait_for(asyncio.wrap_future(future),
+                                                    getattr(settings, 'PASSWORD_HASH_TIMEOUT', 5))
+                except TimeoutError:
+                    self._count('timeouts')
+                    raise PoolSaturated()
+                except BrokenProcessPool:
+                    self._broken(executor)
+                    raise PoolSaturated()
+        self._count('completed', start)
+        return result
+
+    def warm(self) -> None:
+        """Start the pool processes now rather than on the first login."""
+        with self.lock:
+            executor = self._executor()
+        if executor is not None:
+            futures = [executor.submit(os.getpid) for _ in range(getattr(settings, 'PASSWORD_HASH_WORKERS', 2))]
+            for future in futures:
+                future.result()
+
+    def shutdown(self) -> None:
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None and self.pid == os.getpid():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            data = dict(self.counters)
+            data['in_flight'] = self.in_flight
+            samples = list(self.samples)
+        data['workers'] = getattr(settings, 'PASSWORD_HASH_WORKERS', 2)
+        data['queue_limit'] = getattr(settings, 'PASSWORD_HASH_QUEUE', 4)
+        data.update(percentiles(samples))
+        return data
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            for name in self.counters:
+                self.counters[name] = 0
+            self.samples.clear()
+
+
+pool = HashingPool()
+
+
+def hash_password(password: str) -> str:
+    """make_password() in the pool."""
+    return pool.run(make_password, password)
+
+
+def verify_password(password: str, encoded: str) -> Tuple[bool, Optional[str]]:
+    """check_password() in the pool: (valid, upgraded hash to store or None)."""
+    return pool.run(_verify, password, encoded)
+
+
+async def ahash_password(password: str) -> str:
+    return await pool.arun(make_password, password)
+
+
+async def averify_password(password: str, encoded: str) -> Tuple[bool, Optional[str]]:
+    return await pool.arun(_verify, password, encoded)
@@ -0,0 +1,142 @@
+# Filename: shop/idempotency.py
+"""
+Idempotency-Key support for the order and payment POSTs.
+
+A client that sends `Idempotency-Key: <unique value>` may retry the request
+as often as it likes: only the first successful one places the order (or
+confirms the payment). Its status, body and headers (Location,
+Retry-After, ...) are stored in an IdempotencyKey row, unique per caller,
+path and key, and every retry within IDEMPOTENCY_TTL seconds is answered
+from there, with `Idempotent-Replayed: true`, in one query.
+
+The row is inserted before the work runs and in the same transaction, so
+it commits or rolls back with the order. A duplicate arriving while the
+first request runs blocks on the insert (the unique index on PostgreSQL,
+the write lock on SQLite) until that transaction ends, then replays its
+result, whichever worker it reached. Reusing a key with a different body
+is a 422. 4xx and 5xx results roll the whole transaction back, key
+included, so a retry runs again: an order refused for stock can go
+through once it is replenished. Rows older than IDEMPOTENCY_TTL are
+replaced on use and deleted by `manage.py purge_idempotency_keys`.
+"""
+import functools
+import hashlib
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+# (status, data, headers)
+Result = Tuple[int, Any, Dict[str, str]]
+# set on every response by Django and DRF, so not stored
+UNSTORED_HEADERS = {'content-type', 'content-length', 'vary', 'allow'}
+
+
+class InvalidKey(exceptions.APIException):
+    status_code = 400
+    default_detail = f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters.'
+    default_code = 'idempotency_key_invalid'
+
+
+class KeyReused(exceptions.APIException):
+    status_code = 422
+    default_detail = f'This {HEADER} was already used with a different request body.'
+    default_code = 'idempotency_key_reused'
+
+
+def _ttl() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_TTL', 86400))
+
+
+def _lookup(request, user) -> Optional[dict]:
+    """The IdempotencyKey fields identifying this request, or None without the header."""
+    key = request.headers.get(HEADER)
+    if key is None:
+        return None
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise InvalidKey()
+    return {'user': user if user is not None and user.is_authenticated else None,
+            'path': request.path, 'key': key}
+
+
+def _replay(record: IdempotencyKey, fingerprint: str) -> Result:
+    if record.fingerprint != fingerprint:
+        raise KeyReused()
+    return record.status_code, record.response, record.headers
+
+
+def _claim(lookup: dict, fingerprint: str) -> Tuple[IdempotencyKey, bool]:
+    """(record, created): a new row for this request, or the one a concurrent request committed first."""
+    try:
+        with transaction.atomic():  # a savepoint, so the outer transaction survives a duplicate
+            return IdempotencyKey.objects.create(fingerprint=fingerprint, **lookup), True
+    except IntegrityError:
+        return IdempotencyKey.objects.get(**lookup), False
+
+
+def run(request, user, work: Callable[[], Result]) -> Tuple[int, Any, Dict[str, str], bool]:
+    """
+    (status, data, headers, replayed): work()'s result, or the stored result
+    of the first successful request with the same Idempotency-Key.
+    """
+    lookup = _lookup(request, user)
+    if lookup is None:
+        return (*work(), False)
+    fingerprint = hashlib.sha256(request.body).hexdigest()
+    record = IdempotencyKey.objects.filter(**lookup).first()
+    expired = record is not None and record.created_at <= timezone.now() - _ttl()
+    if record is not None and not expired:
+        return (*_replay(record, fingerprint), True)
+
+    with transaction.atomic():
+        if expired:
+            record.delete()
+        record, created = _claim(lookup, fingerprint)
+        if not created:
+            return (*_replay(record, fingerprint), True)
+        status, data, headers = work()
+        if status >= 400:
+            transaction.set_rollback(True)
+        else:
+            record.status_code, record.response, record.headers = status, data, headers
+            record.save(update_fields=['status_code', 'response', 'headers'])
+    return status, data, headers, False
+
+
+async def arun(request, user, work: Callable[[], Result]) -> Tuple[int, Any, Dict[str, str], bool]:
+    """run() for async views: work is synchronous and runs, inside the key's transaction, in a thread."""
+    return await sync_to_async(run)(request, user, work)
+
+
+def purge_expired() -> int:
+    """Delete keys older than IDEMPOTENCY_TTL; returns how many."""
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lte=timezone.now() - _ttl()).delete()
+    return deleted
+
+
+def idempotent(handler):
+    """Decorator for a DRF view's post(): honour Idempotency-Key."""
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        def work():
+            response = handler(self, request, *args, **kwargs)
+            headers = {name: value for name, value in response.items() if name.lower() not in UNSTORED_HEADERS}
+            return response.status_code, response.data, headers
+
+        status, data, headers, replayed = run(request, request.user, work)
+        response = Response(data, status=status, headers=headers)
+        if replayed:
+            response[REPLAYED_HEADER] = 'true'
+        return response
+    return wrapper
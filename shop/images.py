@@ -0,0 +1,302 @@
+# Filename: shop/images.py
+"""
+Thumbnails of Product.image and Category.image for listing cards.
+
+Supplier photos are often several MB; a card needs a few hundred pixels.
+Every image gets a WebP and a JPEG copy at each of IMAGE_THUMBNAIL_WIDTHS
+(never upscaled), stored as
+derivatives/<image name without extension>.<token>-<width>w.<webp|jpg>.
+The token is the render version (a hash of the widths, quality and
+encoder options) followed by random hex, new on every rendering: media.py
+serves these files as immutable, so re-rendering (`generate_thumbnails
+--force`, other settings) must write new names, never new bytes under old
+ones. The previous files stay for pages that still link to them.
+image_derivatives holds the name without the width and format, so the
+serializers build the URLs without touching storage: `thumbnails` is
+{"webp": {"160": url, ...}, "jpeg": {...}}, or null until files of the
+current render version exist. This assumes path-like media URLs
+(FileSystemStorage, a CDN in front of MEDIA_URL), not signed per-file ones.
+
+Resizing is CPU work and stays off the request path: once a save with a
+new image commits (shop/signals.py), it is queued to a pool of
+IMAGE_WORKERS processes per web worker, started on the first upload.
+image_derivatives is cleared when the image changes and set, with
+updated_at and a new catalog version, once the thumbnails are written. Work queued in a web worker that exits is
+lost; `manage.py generate_thumbnails` picks it up and backfills existing
+media. IMAGE_WORKERS = 0 renders inline.
+"""
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils.encoding import filepath_to_uri
+
+from .hashing import init_worker
+
+logger = logging.getLogger('shop.images')
+
+DERIVATIVES_DIR = 'derivatives'
+# format -> (Pillow format, extension, save options)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'optimize': True, 'progressive': True}),
+}
+
+# (model label, pk, image name)
+Job = Tuple[str, int, str]
+
+
+# hex digits of the render version and of the random part of a token
+VERSION_CHARS = 6
+TOKEN_CHARS = 12
+
+
+def render_version() -> str:
+    """Changes with anything that changes the bytes of a thumbnail."""
+    params = (sorted(settings.IMAGE_THUMBNAIL_WIDTHS), settings.IMAGE_THUMBNAIL_QUALITY, sorted(FORMATS.items()))
+    return hashlib.sha256(repr(params).encode()).hexdigest()[:VERSION_CHARS]
+
+
+def derivatives_root(name: str) -> str:
+    """A new image_derivatives value for image `name`."""
+    token = render_version() + secrets.token_hex((TOKEN_CHARS - VERSION_CHARS) // 2)
+    return f'{os.path.splitext(name)[0]}.{token}'
+
+
+def made_from(name: str, derivatives: str) -> bool:
+    """Whether image_derivatives `derivatives` were rendered from image `name` (with any settings)."""
+    return bool(derivatives) and derivatives.rpartition('.')[0] == os.path.splitext(name)[0]
+
+
+def is_current(name: str, derivatives: str) -> bool:
+    """Whether they were, with the current settings."""
+    return made_from(name, derivatives) and derivatives.rpartition('.')[2][:VERSION_CHARS] == render_version()
+
+
+def derivative_name(derivatives: str, width: int, fmt: str) -> str:
+    return f'{DERIVATIVES_DIR}/{derivatives}-{width}w.{FORMATS[fmt][1]}'
+
+
+def thumbnail_urls(build: Optional[Callable[[str], str]] = None) -> Callable[[str], Optional[Dict[str, Dict[str, str]]]]:
+    """
+    A function from an image_derivatives value to the URLs of its
+    thumbnails by format and width, or None (also for ones of another
+    render version, which may lack some widths); `build` makes them
+    absolute. The storage URL is built once here, each image only appends
+    its path and suffixes.
+    """
+    prefix = default_storage.url(f'{DERIVATIVES_DIR}/')
+    if build is not None:
+        prefix = build(prefix)
+    version = render_version()
+    sizes = [(fmt, [(str(width), f'-{width}w.{ext}') for width in settings.IMAGE_THUMBNAIL_WIDTHS])
+             for fmt, (_, ext, _) in FORMATS.items()]
+
+    def urls(derivatives):
+        if not derivatives or derivatives.rpartition('.')[2][:VERSION_CHARS] != version:
+            return None
+        root = prefix + filepath_to_uri(derivatives)
+        return {fmt: {width: root + suffix for width, suffix in suffixes} for fmt, suffixes in sizes}
+    return urls
+
+
+def _flatten(image):
+    """JPEG has no alpha channel: composite on white."""
+    from PIL import Image
+
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render(name: str) -> str:
+    """Write every thumbnail of image `name` under new names; returns image_derivatives. Runs in a pool process."""
+    from PIL import Image, ImageOps
+
+    widths = sorted(settings.IMAGE_THUMBNAIL_WIDTHS, reverse=True)
+    quality = settings.IMAGE_THUMBNAIL_QUALITY
+    derivatives = derivatives_root(name)
+    with default_storage.open(name, 'rb') as fh, Image.open(fh) as original:
+        # JPEG: let the decoder scale down by up to 8x instead of decoding every pixel
+        original.draft('RGB', (widths[0], widths[0]))
+        image = ImageOps.exif_transpose(original)
+        alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if alpha else 'RGB')
+        for width in widths:
+            if image.width > width:
+                # each size from the previous, larger one
+                image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                     Image.Resampling.LANCZOS, reducing_gap=3.0)
+            for fmt, (pil_format, _, options) in FORMATS.items():
+                buffer = io.BytesIO()
+                out = _flatten(image) if pil_format == 'JPEG' and alpha else image
+                out.save(buffer, pil_format, quality=quality, **options)
+                target = derivative_name(derivatives, width, fmt)
+                if default_storage.save(target, ContentFile(buffer.getvalue())) != target:
+                    raise RuntimeError(f"{target} already exists")
+    return derivatives
+
+
+def mark_rendered(model, pk: int, name: str, derivatives: str) -> bool:
+    """Record the thumbnails of `name`, unless the row has moved on to another image."""
+    from django.utils import timezone
+
+    return bool(model.objects.filter(pk=pk, image=name).update(image_derivatives=derivatives,
+                                                               updated_at=timezone.now()))
+
+
+def _model(label: str):
+    from django.apps import apps
+
+    return apps.get_model(label)
+
+
+def _finish(job: Job, derivatives: str) -> None:
+    from . import catalog_cache
+
+    label, pk, name = job
+    if mark_rendered(_model(label), pk, name, derivatives):
+        catalog_cache.bump_version()
+
+
+_lock = threading.Lock()
+_processes: Optional[ProcessPoolExecutor] = None
+_threads: Optional[ThreadPoolExecutor] = None
+_pid: Optional[int] = None
+_pending: Set[Job] = set()
+
+
+def _pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    # spawn, not fork: the web worker may already be running threads
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=init_worker)
+
+
+def _executors() -> Tuple[ProcessPoolExecutor, ThreadPoolExecutor]:
+    global _processes, _threads, _pid
+    with _lock:
+        if _processes is None or _pid != os.getpid():
+            workers = settings.IMAGE_WORKERS
+            _processes = _pool(workers)
+            # one thread per process waits for its result and writes it back
+            _threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+            _pid = os.getpid()
+        return _processes, _threads
+
+
+def _run(processes: ProcessPoolExecutor, job: Job) -> None:
+    from django.db import connection
+
+    global _processes
+    try:
+        _finish(job, processes.submit(render, job[2]).result())
+    except BrokenProcessPool:
+        logger.error("Thumbnail pool died rendering %s; restarting it", job[2])
+        with _lock:
+            if _processes is processes:
+                _processes = None
+    except Exception:
+        logger.exception("Could not render thumbnails of %s", job[2])
+    finally:
+        with _lock:
+            _pending.discard(job)
+        connection.close()
+
+
+def schedule(instance) -> None:
+    """Render the thumbnails of instance.image (a Product or Category) in the background."""
+    job = (instance._meta.label, instance.pk, instance.image.name)
+    if settings.IMAGE_WORKERS <= 0:
+        try:
+            derivatives = render(job[2])
+        except Exception:
+            logger.exception("Could not render thumbnails of %s", job[2])
+        else:
+            _finish(job, derivatives)
+        return
+    with _lock:
+        if job in _pending:
+            return
+        _pending.add(job)
+    processes, threads = _executors()
+    threads.submit(_run, processes, job)
+
+
+def shutdown() -> None:
+    """Stop the pool, dropping queued work (generate_thumbnails catches up)."""
+    global _processes, _threads
+    with _lock:
+        processes, threads, _processes, _threads = _processes, _threads, None, None
+    if processes is not None and _pid == os.getpid():
+        processes.shutdown(wait=True, cancel_futures=True)
+        threads.shutdown(wait=True)
+
+
+def backfill(workers: Optional[int] = None, force: bool = False,
+             progress: Optional[Callable[[Dict[str, Any]], None]] = None, window: int = 4) -> Dict[str, Any]:
+    """
+    Render thumbnails for every image without ones of the current render
+    version (every image, under new names, with `force`) on `workers` processes (default: one per CPU), keeping
+    `window` images per process in flight. Rows are marked as they finish;
+    the catalog moves to a new version once, at the end.
+    """
+    from . import catalog_cache
+    from .models import Category, Product
+
+    started = time.perf_counter()
+    todo: List[Tuple[Any, int, str]] = []
+    for model in (Category, Product):
+        queryset = model.objects.exclude(image='').exclude(image__isnull=True).order_by('pk')
+        todo += [(model, pk, name) for pk, name, derivatives in queryset.values_list('pk', 'image', 'image_derivatives')
+                 if force or not is_current(name, derivatives)]
+
+    stats: Dict[str, Any] = {'images': len(todo), 'done': 0, 'rendered': 0, 'errors': 0, 'error_samples': []}
+
+    def report():
+        seconds = time.perf_counter() - started
+        stats['seconds'] = round(seconds, 2)
+        stats['images_per_sec'] = round(stats['done'] / seconds, 1) if seconds else 0.0
+        if progress is not None:
+            progress(stats)
+
+    workers = workers or os.cpu_count() or 1
+    with _pool(workers) as processes:
+        queue = iter(todo)
+        running = {}
+        while True:
+            for model, pk, name in queue:
+                running[processes.submit(render, name)] = (model, pk, name)
+                if len(running) >= workers * window:
+                    break
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                model, pk, name = running.pop(future)
+                stats['done'] += 1
+                try:
+                    derivatives = future.result()
+                except Exception as exc:
+                    stats['errors'] += 1
+                    if len(stats['error_samples']) < 10:
+                        stats['error_samples'].append(f'{model._meta.label} {pk} ({name}): {exc}')
+                else:
+                    if mark_rendered(model, pk, name, derivatives):
+                        stats['rendered'] += 1
+                if stats['done'] % 100 == 0:
+                    report()
+    if stats['rendered']:
+        catalog_cache.bump_version()
+    report()
+    return stats
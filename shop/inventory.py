@@ -0,0 +1,154 @@
+# Filename: shop/inventory.py
+"""
+Stock reservations for checkout.
+
+Stock is taken with a single conditional UPDATE for the whole basket
+(stock = stock - n WHERE stock >= n), never read-modify-write, so two
+concurrent checkouts cannot both take the last unit. If any line is short
+the UPDATE touches fewer rows than the basket has products and the
+surrounding transaction is rolled back.
+
+Each order's stock is held for INVENTORY_RESERVATION_TTL seconds. Paying
+consumes the hold; release_expired() (run by `manage.py
+release_reservations`) hands expired holds back to stock.
+
+Stock moves touch Product.updated_at, so delta sync sees them, and bump
+the catalog cache's stock version once they commit, so cached listings and
+their ETags follow stock, within CATALOG_STOCK_INTERVAL seconds and without
+rebuilding the typeahead index.
+"""
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from . import catalog_cache
+from .models import Order, Product, StockReservation
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids: List[int]):
+        self.product_ids = product_ids
+        super().__init__(f"Insufficient stock for product(s) {', '.join(map(str, product_ids))}")
+
+
+def _ttl() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'INVENTORY_RESERVATION_TTL', 900))
+
+
+def _per_product(quantities: Dict[int, int]) -> Case:
+    return Case(
+        *[When(id=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def take_stock(quantities: Dict[int, int]) -> None:
+    """
+    Atomically subtract {product_id: quantity} from stock, all or nothing.
+    Must run inside a transaction; raises OutOfStock if any product is short.
+    """
+    if not quantities:
+        return
+    amount = _per_product(quantities)
+    taken = Product.objects.filter(id__in=quantities.keys(), stock__gte=amount).update(
+        stock=F('stock') - amount, updated_at=timezone.now(),
+    )
+    if taken != len(quantities):
+        stock = dict(Product.objects.filter(id__in=quantities.keys()).values_list('id', 'stock'))
+        raise OutOfStock(sorted(pk for pk, qty in quantities.items() if stock.get(pk, 0) < qty))
+    transaction.on_commit(catalog_cache.bump_stock_version)
+
+
+def return_stock(quantities: Dict[int, int]) -> None:
+    if not quantities:
+        return
+    amount = _per_product(quantities)
+    Product.objects.filter(id__in=quantities.keys()).update(stock=F('stock') + amount, updated_at=timezone.now())
+    transaction.on_commit(catalog_cache.bump_stock_version)
+
+
+def held_quantities(product_ids: Iterable[int]) -> Dict[int, int]:
+    """{product_id: units held by unpaid orders}, for products with live holds."""
+    return dict(StockReservation.objects.filter(product_id__in=list(product_ids), status=StockReservation.HELD)
+                .values('product_id').annotate(held=Sum('quantity')).values_list('product_id', 'held'))
+
+
+def reserve(order: Order, lines: Iterable[Tuple[int, int]]) -> None:
+    """Take stock for the order's (product_id, quantity) lines and record the hold."""
+    quantities = Counter()
+    for product_id, quantity in lines:
+        quantities[product_id] += quantity
+    take_stock(quantities)
+    expires_at = timezone.now() + _ttl()
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=pk, quantity=qty, expires_at=expires_at)
+        for pk, qty in quantities.items()
+    ])
+
+
+@transaction.atomic
+def consume(order: Order) -> None:
+    """
+    Turn the order's holds into a sale. Holds that already expired and were
+    released are taken again if the stock is still there, else OutOfStock.
+    """
+    # lock the holds so the sweeper cannot release them underneath us
+    holds = list(order.reservations.select_for_update().values_list('product_id', 'quantity', 'status'))
+    quantities = Counter()
+    for product_id, quantity, status in holds:
+        if status == StockReservation.RELEASED:
+            quantities[product_id] += quantity
+    take_stock(quantities)
+    order.reservations.exclude(status=StockReservation.CONSUMED).update(status=StockReservation.CONSUMED)
+
+
+@transaction.atomic
+def consume_orders(order_ids: Iterable[int]) -> List[int]:
+    """
+    consume() for many orders at once: one locking read of their holds and
+    one UPDATE. Returns the orders whose released holds could not be taken
+    again; their holds are left as they were.
+    """
+    order_ids = set(order_ids)
+    holds = StockReservation.objects.select_for_update().filter(order_id__in=order_ids).exclude(
+        status=StockReservation.CONSUMED).values_list('order_id', 'product_id', 'quantity', 'status')
+    retake: Dict[int, Counter] = {}
+    for order_id, product_id, quantity, status in holds:
+        if status == StockReservation.RELEASED:
+            retake.setdefault(order_id, Counter())[product_id] += quantity
+    short = []
+    for order_id, quantities in retake.items():  # only orders paid after their hold expired
+        try:
+            with transaction.atomic():
+                take_stock(quantities)
+        except OutOfStock:
+            short.append(order_id)
+    StockReservation.objects.filter(order_id__in=order_ids.difference(short)).exclude(
+        status=StockReservation.CONSUMED).update(status=StockReservation.CONSUMED)
+    return short
+
+
+def release_expired(batch_size: int = 500) -> int:
+    """Return expired holds to stock, a batch per transaction. Returns the number released."""
+    released = 0
+    while True:
+        with transaction.atomic():
+            holds = StockReservation.objects.filter(
+                status=StockReservation.HELD, expires_at__lte=timezone.now(),
+            ).order_by('expires_at')
+            if connection.features.has_select_for_update_skip_locked:
+                holds = holds.select_for_update(skip_locked=True)
+            holds = list(holds.values_list('id', 'product_id', 'quantity')[:batch_size])
+            if not holds:
+                return released
+            StockReservation.objects.filter(id__in=[h[0] for h in holds]).update(status=StockReservation.RELEASED)
+            quantities = Counter()
+            for _, product_id, quantity in holds:
+                quantities[product_id] += quantity
+            return_stock(quantities)
+        released += len(holds)
@@ -0,0 +1,29 @@
+import importlib
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.benchmarks import BENCHMARKS, isolated_database
+
+
+class Command(BaseCommand):
+    help = "Run a benchmark from shop/benchmarks against a throwaway database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(BENCHMARKS))
+        parser.add_argument('--rows', type=int, nargs='+', help="Fixture sizes to run with.")
+        parser.add_argument('--orders', type=int, help="Orders to seed (endpoints benchmark).")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed repetitions per case.")
+        parser.add_argument('--json', dest='json_path', help="Write results to this JSON file.")
+
+    def handle(self, *args, **options):
+        module = importlib.import_module(BENCHMARKS[options['name']])
+        with isolated_database(verbosity=options['verbosity'] - 1, on_disk=getattr(module, 'ON_DISK', False)):
+            results = module.run(options, self.stdout)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump({'benchmark': options['name'], **results}, fh, indent=2)
+            self.stdout.write(f"Results written to {options['json_path']}")
+        if results.get('failures'):
+            raise CommandError(f"{len(results['failures'])} budget failure(s)")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from shop.catalog_io import COLUMNS, export_rows
+from shop.streaming import FORMATS, encode, guess_format
+
+
+class Command(BaseCommand):
+    help = "Stream every product as CSV or JSONL (the import_catalog format)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file (default: stdout).")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, else csv.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        if path == '-':
+            self.stdout.writelines(encode(fmt, COLUMNS, export_rows()))
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as fh:
+            fh.writelines(encode(fmt, COLUMNS, export_rows()))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.order_export import COLUMNS, STATUSES, export_rows, parse_moment
+from shop.streaming import FORMATS, encode, guess_format
+
+
+class Command(BaseCommand):
+    help = "Stream every order line item as CSV or JSONL for reconciliation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file (default: stdout).")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, else csv.")
+        parser.add_argument('--status', choices=STATUSES, help="Only paid or only unpaid orders.")
+        parser.add_argument('--created-after', help="ISO date or datetime (inclusive).")
+        parser.add_argument('--created-before', help="ISO date or datetime; a date includes that whole day.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        try:
+            created_after = options['created_after'] and parse_moment(options['created_after'])
+            created_before = options['created_before'] and parse_moment(options['created_before'], end_of_day=True)
+        except ValueError as exc:
+            raise CommandError(exc)
+        rows = export_rows(options['status'], created_after, created_before)
+        if path == '-':
+            self.stdout.writelines(encode(fmt, COLUMNS, rows))
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as fh:
+            fh.writelines(encode(fmt, COLUMNS, rows))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from shop.images import backfill
+
+
+class Command(BaseCommand):
+    help = "Render missing product and category thumbnails (shop/images.py) in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Rendering processes (default: one per CPU).")
+        parser.add_argument('--force', action='store_true', help="Re-render thumbnails that already exist.")
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            if options['verbosity'] > 0:
+                self.stdout.write(f"{stats['done']}/{stats['images']} images, {stats['images_per_sec']} images/sec")
+
+        stats = backfill(workers=options['workers'], force=options['force'], progress=progress)
+
+        for sample in stats['error_samples']:
+            self.stderr.write(sample)
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['images']} images in {stats['seconds']}s ({stats['images_per_sec']} images/sec): "
+            f"{stats['rendered']} rendered, {stats['errors']} failed"
+        ))
@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import CatalogImporter
+from shop.streaming import FORMATS, guess_format, read_rows
+
+
+class Command(BaseCommand):
+    help = "Upsert categories and products by slug from a CSV or JSONL feed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Feed file ('-' for stdin).")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, else csv.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+
+        def progress(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{stats['rows']} rows, {stats['rows_per_sec']} rows/sec")
+
+        importer = CatalogImporter(batch_size=options['batch_size'], progress=progress)
+        try:
+            if path == '-':
+                stats = importer.run(read_rows(sys.stdin, fmt))
+            else:
+                with open(path, newline='', encoding='utf-8') as fh:
+                    stats = importer.run(read_rows(fh, fmt))
+        except OSError as exc:
+            raise CommandError(exc)
+
+        for sample in stats['error_samples']:
+            self.stderr.write(sample)
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_sec']} rows/sec): "
+            f"{stats['created']} created, {stats['updated']} updated, "
+            f"{stats['categories_created']} categories created, {stats['categories_updated']} categories updated, "
+            f"{stats['errors']} skipped, "
+            f"{stats['unchanged']} unchanged"
+        ))
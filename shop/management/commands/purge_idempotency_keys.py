@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from shop.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Key records older than IDEMPOTENCY_TTL."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Purged {purge_expired()} idempotency key(s)")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from shop.changes import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete product tombstones older than CATALOG_TOMBSTONE_DAYS."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Purged {purge_tombstones()} tombstone(s)")
@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.payments import REPORT_COLUMNS, Reconciler, report_rows
+from shop.streaming import FORMATS, encode, guess_format, read_rows
+
+
+class Command(BaseCommand):
+    help = "Mark orders paid from a settlement file of (order_id, txn_id, amount) and report mismatches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Settlement file ('-' for stdin).")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, else csv.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--report', help="Write every mismatch to this CSV or JSONL file.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+
+        def progress(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{stats['rows']} rows, {stats['rows_per_sec']} rows/sec")
+
+        reconciler = Reconciler(batch_size=options['batch_size'], progress=progress)
+        try:
+            if path == '-':
+                stats = reconciler.run(read_rows(sys.stdin, fmt))
+            else:
+                with open(path, newline='', encoding='utf-8') as fh:
+                    stats = reconciler.run(read_rows(fh, fmt))
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"after row {reconciler.stats['rows']}: {exc}")
+
+        if options['report']:
+            with open(options['report'], 'w', newline='', encoding='utf-8') as fh:
+                fh.writelines(encode(guess_format(options['report']), REPORT_COLUMNS,
+                                     report_rows(stats['mismatches'])))
+        else:
+            for mismatch in stats['mismatches'][:20]:
+                self.stderr.write(f"row {mismatch['row']}: order {mismatch['order_id']} {mismatch['reason']} "
+                                  f"{mismatch['detail']}".rstrip())
+        reasons = ', '.join(f"{count} {reason}" for reason, count in stats['reasons'].items() if count)
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_sec']} rows/sec): "
+            f"{stats['paid']} paid, {stats['reconciled']} already reconciled, "
+            f"{stats['mismatched']} mismatched" + (f" ({reasons})" if reasons else "")
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shop.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = "Return stock held by expired, unpaid order reservations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep running, sweeping every N seconds (0 = sweep once and exit).")
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired()
+            if released or options['verbosity'] > 1:
+                self.stdout.write(f"Released {released} expired reservation(s)")
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,205 @@
+# Filename: shop/media.py
+"""
+Serving MEDIA_ROOT: product and category images and their thumbnails.
+
+django.views.static.serve sends every file with no cache lifetime, no
+ETag and no byte ranges. serve() here works from one stat() per request:
+- a strong ETag (mtime and size) and Last-Modified, so If-None-Match /
+  If-Modified-Since are answered with 304 without opening the file;
+- a single byte range (Range, honouring If-Range) as 206, or 416;
+- file names carrying a token (UniqueUploadTo, used by the image fields,
+  and the thumbnails, which get a new one per rendering) never change
+  content, so they are cached as immutable for a year. Anything else is cached for
+  MEDIA_CACHE_SECONDS and then revalidated;
+- a .br or .gz sibling of a compressible file (SVG, JSON, text; not
+  JPEG/WebP) is sent to clients that accept it. Create them with
+  `python -m whitenoise.compress <MEDIA_ROOT>`;
+- the open file goes to the WSGI server's file wrapper, so gunicorn sends
+  it with sendfile(2) rather than copying it through Python (a bounded
+  range is read through Python);
+- with MEDIA_ACCEL set, the view only runs the checks above and the front
+  proxy sends the file: 'x-accel-redirect' (nginx, an `internal` location
+  at MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT; use gzip_static there) or
+  'x-sendfile' (Apache mod_xsendfile, lighttpd; absolute path).
+"""
+import mimetypes
+import os
+import re
+import secrets
+import stat
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.deconstruct import deconstructible
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+TOKEN_BYTES = 6
+# <name>.<token> followed by the extension, a storage suffix or a thumbnail width
+UNIQUE_NAME = re.compile(r'\.[0-9a-f]{%d}(?=[._-])' % (TOKEN_BYTES * 2))
+RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+# Content-Encoding -> precompressed sibling, best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+
+@deconstructible
+class UniqueUploadTo:
+    """upload_to giving every upload a new name (<directory>/<name>.<token><ext>), so a URL never changes content."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def __call__(self, instance, filename: str) -> str:
+        root, ext = os.path.splitext(os.path.basename(filename))
+        return f'{self.directory}/{root}.{secrets.token_hex(TOKEN_BYTES)}{ext.lower()}'
+
+    def __eq__(self, other):
+        return isinstance(other, UniqueUploadTo) and self.directory == other.directory
+
+
+def cache_control(path: str) -> str:
+    if UNIQUE_NAME.search(os.path.basename(path)):
+        return IMMUTABLE
+    return f'public, max-age={settings.MEDIA_CACHE_SECONDS}'
+
+
+def byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (first, last) byte of a single `bytes=` range. None for anything else
+    (several ranges, bad syntax): the whole file is sent. ValueError if
+    the range lies outside the file.
+    """
+    match = RANGE.fullmatch(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    if size == 0:
+        raise ValueError(header)
+    first, last = match.groups()
+    if not first:
+        if int(last) == 0:
+            raise ValueError(header)
+        return max(0, size - int(last)), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise ValueError(header)
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+class _Slice:
+    """`length` bytes of an open file from its current position."""
+
+    def __init__(self, fh, length: int):
+        self.fh = fh
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.fh.read(size) if size > 0 else b''
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.fh.close()
+
+
+def _resolve(path: str) -> Tuple[str, os.stat_result]:
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404('Not found')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('Not found')
+    return fullpath, st
+
+
+def _precompressed(request, fullpath: str) -> Optional[Tuple[str, os.stat_result, str]]:
+    accepted = request.headers.get('Accept-Encoding', '')
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted:
+            try:
+                st = os.stat(fullpath + suffix)
+            except OSError:
+                continue
+            return fullpath + suffix, st, encoding
+    return None
+
+
+def _set_headers(response, etag: str, st: os.stat_result, path: str, vary: bool) -> None:
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(int(st.st_mtime))
+    response['Cache-Control'] = cache_control(path)
+    response['Accept-Ranges'] = 'bytes'
+    if vary:
+        patch_vary_headers(response, ['Accept-Encoding'])
+
+
+@require_safe
+def serve(request, path: str):
+    fullpath, st = _resolve(path)
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    accel = settings.MEDIA_ACCEL
+
+    send_path, content_encoding = fullpath, None
+    vary = not accel and encoding is None and content_type.startswith(COMPRESSIBLE)
+    if vary:
+        variant = _precompressed(request, fullpath)
+        if variant is not None:
+            send_path, st, content_encoding = variant
+    etag = quote_etag(f'{st.st_mtime_ns:x}-{st.st_size:x}' + (f'-{content_encoding}' if content_encoding else ''))
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if not_modified is not None:  # 304, or 412 for a failed If-Match
+        _set_headers(not_modified, etag, st, fullpath, vary)
+        return not_modified
+
+    if accel:
+        response = HttpResponse(content_type=content_type)
+        if accel == 'x-accel-redirect':
+            relative = os.path.relpath(send_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(relative)
+        else:
+            response['X-Sendfile'] = send_path
+        _set_headers(response, etag, st, fullpath, vary)
+        return response
+
+    size = st.st_size
+    requested = None
+    if 'Range' in request.headers:
+        if_range = request.headers.get('If-Range')
+        if if_range is None or if_range == etag or parse_http_date_safe(if_range) == int(st.st_mtime):
+            try:
+                requested = byte_range(request.headers['Range'], size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                _set_headers(response, etag, st, fullpath, vary)
+                return response
+
+    fh = open(send_path, 'rb')
+    filename = os.path.basename(fullpath)
+    if requested is None:
+        response = FileResponse(fh, content_type=content_type, filename=filename)
+    else:
+        first, last = requested
+        fh.seek(first)
+        length = last - first + 1
+        # to the end of the file: the server can still sendfile() from the offset
+        body = fh if last == size - 1 else _Slice(fh, length)
+        response = FileResponse(body, status=206, content_type=content_type, filename=filename)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    _set_headers(response, etag, st, fullpath, vary)
+    return response
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:20
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def seed_delivery_rules(apps, schema_editor):
+    # what checkout charged before the rules moved to the database:
+    # 40 below 499, free from 499
+    DeliveryRule = apps.get_model('shop', 'DeliveryRule')
+    DeliveryRule.objects.bulk_create([
+        DeliveryRule(min_subtotal=Decimal('0.00'), charge=Decimal('40.00')),
+        DeliveryRule(min_subtotal=Decimal('499.00'), charge=Decimal('0.00')),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_order_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_subtotal', models.DecimalField(decimal_places=2, max_digits=10, unique=True)),
+                ('charge', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='coupon_code',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='Discount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('code', models.CharField(blank=True, db_index=True, default='', max_length=40)),
+                ('percent_off', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('amount_off', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('min_subtotal', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('active', models.BooleanField(default=True)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='discounts', to='shop.category')),
+            ],
+        ),
+        migrations.RunPython(seed_delivery_rules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:35
+
+import shop.media
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=shop.media.UniqueUploadTo('categories')),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=shop.media.UniqueUploadTo('products')),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_idempotency_headers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='image_derivatives',
+            field=models.CharField(blank=True, default='', editable=False, max_length=120),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='image_derivatives',
+            field=models.CharField(blank=True, default='', editable=False, max_length=120),
+        ),
+    ]
@@ -3,6 +3,11 @@
 # shop/models.py
 from django.db import models
 from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils import timezone
+
+from .media import UniqueUploadTo
 
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
@@ -12,10 +17,21 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     delivery_charge = models.DecimalField(max_digits=8, decimal_places=2, default=0)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    coupon_code = models.CharField(max_length=40, blank=True, default='')
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     is_paid = models.BooleanField(default=False)
     payment_txn_id = models.CharField(max_length=200, blank=True, null=True)
     payment_method = models.CharField(max_length=50, default='UPI')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # order history: a user's orders, staff filtering by payment status, all orders
+            models.Index(fields=['user', 'created_at'], name='shop_order_user_created_idx'),
+            models.Index(fields=['is_paid', 'created_at'], name='shop_order_paid_created_idx'),
+            models.Index(fields=['created_at'], name='shop_order_created_idx'),
+        ]
 
     def __str__(self):
         return f'Order {self.id} - {self.full_name} - {"PAID" if self.is_paid else "UNPAID"}'
@@ -38,7 +54,10 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     image_url = models.URLField(blank=True, null=True)   # Keep for backward compatibility
-    image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    image = models.ImageField(upload_to=UniqueUploadTo('categories'), blank=True, null=True)
+    # name of the thumbnails of the image, by render (shop/images.py); '' until they exist
+    image_derivatives = models.CharField(max_length=120, blank=True, default='', editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -52,8 +71,125 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=8, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
     image_url = models.URLField(blank=True, null=True)
-    image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image = models.ImageField(upload_to=UniqueUploadTo('products'), blank=True, null=True)
+    image_derivatives = models.CharField(max_length=120, blank=True, default='', editable=False)
     available = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # keyset scans for /api/products/changes/
+            models.Index(fields=['updated_at', 'id'], name='shop_product_changes_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class ProductTombstone(models.Model):
+    """Records a deleted product so delta-sync clients can drop it."""
+    product_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='shop_tombstone_changes_idx'),
+        ]
+
+    def __str__(self):
+        return f'Deleted product {self.product_id}'
+
+
+class StockReservation(models.Model):
+    """
+    Stock held for an unpaid order. Created HELD at checkout, CONSUMED when
+    the payment is confirmed, RELEASED (stock returned) once it expires.
+    """
+    HELD = 'held'
+    CONSUMED = 'consumed'
+    RELEASED = 'released'
+    STATUS_CHOICES = [(HELD, 'Held'), (CONSUMED, 'Consumed'), (RELEASED, 'Released')]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # the sweeper scans HELD rows by expiry
+            models.Index(fields=['status', 'expires_at'], name='shop_reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x product {self.product_id} for order {self.order_id} ({self.status})'
+
+
+class DeliveryRule(models.Model):
+    """
+    Delivery charge for baskets worth at least min_subtotal after discounts;
+    the highest threshold a basket reaches applies (see shop/pricing.py).
+    """
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, unique=True)
+    charge = models.DecimalField(max_digits=8, decimal_places=2)
+    active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.charge} from {self.min_subtotal}'
+
+
+class Discount(models.Model):
+    """
+    A promotion (see shop/pricing.py). With a category, percent_off that
+    category's lines; without, percent_off or amount_off the basket once
+    its subtotal reaches min_subtotal. With a code it is a coupon and only
+    applies when the customer enters it. Runs between starts_at and ends_at
+    when those are set.
+    """
+    name = models.CharField(max_length=100)
+    code = models.CharField(max_length=40, blank=True, default='', db_index=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='discounts')
+    percent_off = models.DecimalField(max_digits=5, decimal_places=2, default=0,
+                                      validators=[MinValueValidator(0), MaxValueValidator(100)])
+    amount_off = models.DecimalField(max_digits=8, decimal_places=2, default=0, validators=[MinValueValidator(0)])
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0,
+                                       validators=[MinValueValidator(0)])
+    active = models.BooleanField(default=True)
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.code})' if self.code else self.name
+
+
+class IdempotencyKey(models.Model):
+    """
+    A request made with an Idempotency-Key header and the successful
+    response it got (see shop/idempotency.py), written in the same
+    transaction as the order or payment it made. status_code and response
+    are only null inside that transaction.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    path = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # sha256 of the request body
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=JSONEncoder)  # encoded as DRF renders it
+    headers = models.JSONField(default=dict)  # the ones the view set, e.g. Location
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'path', 'key'], name='shop_idempotency_key_unique'),
+            # NULLs never collide in the constraint above
+            models.UniqueConstraint(fields=['path', 'key'], condition=models.Q(user__isnull=True),
+                                    name='shop_idempotency_anonymous_key_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.key} for {self.path}'
@@ -0,0 +1,69 @@
+# Filename: shop/order_export.py
+"""
+Order export for reconciliation (GET /api/orders/export/ and manage.py
+export_orders).
+
+One row per line item, with its order's columns repeated, from a single
+LEFT JOIN of Order to OrderItem (an order without items gives one row with
+empty item columns). Rows come off a server-side cursor CHUNK_SIZE at a
+time (iterator()) and are encoded and sent as they are read, so memory
+does not grow with the number of orders. Filters are the ones
+/api/orders/ takes: paid or unpaid, and a created_at range.
+"""
+from datetime import datetime, time, timedelta
+from typing import Iterator, Optional
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Order
+
+COLUMNS = ['order_id', 'created_at', 'user_id', 'full_name', 'phone', 'is_paid', 'payment_method',
+           'payment_txn_id', 'coupon_code', 'subtotal', 'discount', 'delivery_charge', 'total',
+           'item_id', 'product_name', 'price', 'quantity']
+FIELDS = ['id', 'created_at', 'user_id', 'full_name', 'phone', 'is_paid', 'payment_method',
+          'payment_txn_id', 'coupon_code', 'subtotal', 'discount', 'delivery_charge', 'total',
+          'items__id', 'items__product_name', 'items__price', 'items__quantity']
+STATUSES = ('paid', 'unpaid')
+CHUNK_SIZE = 2000
+
+
+def parse_moment(value: str, end_of_day: bool = False) -> datetime:
+    """
+    An aware datetime from an ISO date or datetime; a date means its start,
+    or with `end_of_day` the start of the next day. ValueError otherwise.
+    """
+    try:
+        moment = parse_datetime(value)
+        day = None if moment else parse_date(value)
+    except ValueError:
+        moment = day = None
+    if day is not None:
+        moment = datetime.combine(day, time.min)
+        if end_of_day:
+            moment += timedelta(days=1)
+    if moment is None:
+        raise ValueError("Expected an ISO date or datetime")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_orders(queryset, status: Optional[str] = None, created_after: Optional[datetime] = None,
+                  created_before: Optional[datetime] = None):
+    if status:
+        # is_paid=False compiles to NOT is_paid, which cannot use the (is_paid, created_at) index
+        queryset = queryset.filter(is_paid__in=[status == 'paid'])
+    if created_after:
+        queryset = queryset.filter(created_at__gte=created_after)
+    if created_before:
+        queryset = queryset.filter(created_at__lt=created_before)
+    return queryset
+
+
+def export_rows(status: Optional[str] = None, created_after: Optional[datetime] = None,
+                created_before: Optional[datetime] = None) -> Iterator[tuple]:
+    """Yield order rows (in COLUMNS order), oldest order first, with a server-side cursor."""
+    queryset = filter_orders(Order.objects.all(), status, created_after, created_before)
+    yield from queryset.order_by('created_at', 'id', 'items__id').values_list(*FIELDS).iterator(
+        chunk_size=CHUNK_SIZE)
@@ -0,0 +1,90 @@
+# Filename: shop/orders.py
+"""
+Order placement.
+
+Checkout runs a fixed number of queries whatever the basket size: one
+lookup for every product in the basket (discounts and delivery come from
+the compiled rules in shop/pricing.py), one insert for the order, one
+conditional stock update (shop/inventory.py), one bulk insert each for the
+items and the stock reservations, all inside a single transaction.
+"""
+from typing import Any, Dict, List
+
+from django.db import transaction
+
+from . import inventory, pricing
+from .models import Order, OrderItem, Product
+
+
+class OrderError(Exception):
+    """Raised when an order cannot be placed; the message is safe to return to the client."""
+
+
+def parse_items(items: List[Dict[str, Any]]) -> List[tuple]:
+    """
+    Normalise raw line items to a list of (product_id, quantity) tuples.
+    """
+    lines = []
+    for item in items:
+        product_id = item.get('product_id')
+        try:
+            product_id = int(product_id)
+            quantity = int(item.get('quantity', 1))
+        except (TypeError, ValueError):
+            raise OrderError(f"Invalid line item for product {product_id}")
+        if quantity <= 0:
+            raise OrderError(f"Invalid quantity for product {product_id}")
+        lines.append((product_id, quantity))
+    if not lines:
+        raise OrderError("Order must contain at least one item")
+    return lines
+
+
+@transaction.atomic
+def place_order(data: Dict[str, Any], user=None) -> Order:
+    """
+    Create an Order and its OrderItems from validated OrderCreateSerializer data.
+    """
+    lines = parse_items(data['items'])
+    products = Product.objects.filter(available=True).only('id', 'name', 'price', 'category_id').in_bulk(
+        {product_id for product_id, _ in lines}
+    )
+    for product_id, _ in lines:
+        if product_id not in products:
+            raise OrderError(f"Product {product_id} not found or unavailable")
+
+    try:
+        quote = pricing.rules().price(
+            [(products[product_id].category_id, products[product_id].price, quantity)
+             for product_id, quantity in lines],
+            coupon=data.get('coupon'),
+        )
+    except pricing.PricingError as exc:
+        raise OrderError(str(exc)) from exc
+    order = Order.objects.create(
+        user=user,
+        full_name=data['full_name'],
+        phone=data['phone'],
+        address=data['address'],
+        delivery_charge=quote.delivery_charge,
+        subtotal=quote.subtotal,
+        discount=quote.discount,
+        coupon_code=quote.coupon,
+        total=quote.total,
+        is_paid=False,
+        payment_method="UPI"
+    )
+    try:
+        inventory.reserve(order, lines)
+    except inventory.OutOfStock as exc:
+        raise OrderError(str(exc)) from exc
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product_name=products[product_id].name,
+            price=products[product_id].price,
+            quantity=quantity
+        )
+        for product_id, quantity in lines
+    ])
+    return order
@@ -0,0 +1,80 @@
+# Filename: shop/pagination.py
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+from . import search
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Opt-in keyset pagination for the product list.
+    Only applies when the client sends `cursor` or `page_size`, so existing
+    callers keep receiving the plain list. Ordered by the primary key, which
+    is indexed and immutable, so pages stay stable while products are added.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def _get_position_from_instance(self, instance, ordering):
+        # Fast-path rows are values_list() tuples with the id in column 0.
+        if isinstance(instance, tuple):
+            return str(instance[0])
+        return super()._get_position_from_instance(instance, ordering)
+
+
+class SearchCursorPagination(ProductCursorPagination):
+    """
+    Keyset pagination for `?q=` results, in rank order. The cursor holds
+    the (corrected, score, id) of the last row shown (see
+    search.ranked_rows()), so the next page continues right after it and
+    every match is reachable. Forward only: there is no previous link.
+    """
+    def paginate_search(self, rows, query, request):
+        """One page of `rows` matching `query`; None when the search index is unavailable."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        page = search.ranked_rows(rows, query, limit=self.page_size, after=self.decode_position(request))
+        if page is None:
+            return None
+        self.next_position = page.next
+        return page.rows
+
+    def decode_position(self, request):
+        cursor = self.decode_cursor(request)
+        if cursor is None:
+            return None
+        try:
+            corrected, score, pk = cursor.position.split('|')
+            return corrected == '1', float(score), int(pk)
+        except (AttributeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        corrected, score, pk = self.next_position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=f'{int(corrected)}|{score!r}|{pk}'))
+
+    def get_previous_link(self):
+        return None
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Keyset pagination for order history, newest first. Pages are read
+    through the Order (user, created_at) / (is_paid, created_at) indexes
+    and stay stable while new orders come in.
+    """
+    ordering = '-created_at'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,197 @@
+# Filename: shop/pricing.py
+"""
+Basket pricing: discounts and the delivery charge, from the DeliveryRule
+and Discount rows (edited in the admin).
+
+The rows are compiled into a RuleTable held in process memory: delivery
+thresholds as a sorted list for bisection, category discounts as a dict
+by category, basket-wide discounts as a list, coupons by code. A table is
+rebuilt (two queries) when the rules change -- every save or delete
+bumps a version in the default cache (shop/signals.py), checked on each
+rules() call -- or when a discount's start or end time passes. Every
+process must see the same version, or it keeps pricing with the rules it
+compiled last: with several processes the cache must be shared
+(REDIS_URL); gunicorn.conf.py will not fork several workers on a
+per-process one.
+
+RuleTable.price() then evaluates a basket in one pass over its lines:
+- each line gets the best category discount for its category (automatic,
+  or the coupon's when it targets that category);
+- the basket gets the single best basket-wide discount it qualifies for
+  (by subtotal before discounts), applied after the line discounts;
+- the delivery charge is the rule with the highest threshold the basket
+  reaches after discounts.
+Discounts never stack on the same line, and never exceed the subtotal.
+"""
+import threading
+import time
+from bisect import bisect_right
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.core.cache import caches
+from django.utils import timezone
+
+VERSION_KEY = 'pricing:version'
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+
+class PricingError(Exception):
+    """Raised for a coupon that cannot be used; the message is safe to return to the client."""
+
+
+class Quote(NamedTuple):
+    subtotal: Decimal
+    discount: Decimal
+    delivery_charge: Decimal
+    total: Decimal
+    line_discounts: List[Decimal]
+    coupon: str
+
+
+class BasketRule(NamedTuple):
+    min_subtotal: Decimal
+    percent_off: Decimal
+    amount_off: Decimal
+
+
+class Coupon(NamedTuple):
+    category_id: Optional[int]
+    rule: BasketRule
+
+
+def _percent(amount: Decimal, percent: Decimal) -> Decimal:
+    return (amount * percent / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _basket_discount(rule: BasketRule, subtotal: Decimal) -> Decimal:
+    return max(_percent(subtotal, rule.percent_off), rule.amount_off)
+
+
+class RuleTable:
+    def __init__(self, version: int, delivery: List[Tuple[Decimal, Decimal]],
+                 category_percent: Dict[int, Decimal], basket_rules: List[BasketRule],
+                 coupons: Dict[str, Coupon], valid_until: Optional[float]):
+        self.version = version
+        self.valid_until = valid_until  # time.time() of the next start/end
+        self.thresholds = [threshold for threshold, _ in delivery]
+        self.charges = [charge for _, charge in delivery]
+        self.category_percent = category_percent
+        self.basket_rules = basket_rules
+        self.coupons = coupons
+
+    def delivery_charge(self, subtotal: Decimal) -> Decimal:
+        index = bisect_right(self.thresholds, subtotal) - 1
+        return self.charges[index] if index >= 0 else ZERO
+
+    def price(self, lines: Iterable[Tuple[Optional[int], Decimal, int]], coupon: Optional[str] = None) -> Quote:
+        """Price (category_id, unit price, quantity) lines, optionally with a coupon code."""
+        code = (coupon or '').strip().upper()
+        applied = None
+        if code:
+            applied = self.coupons.get(code)
+            if applied is None:
+                raise PricingError(f"Coupon {code} is not valid")
+
+        category_percent = self.category_percent
+        if applied is not None and applied.category_id is not None:
+            category_percent = dict(category_percent)
+            category_percent[applied.category_id] = max(
+                category_percent.get(applied.category_id, ZERO), applied.rule.percent_off)
+
+        subtotal = ZERO
+        line_discount_total = ZERO
+        line_discounts = []
+        for category_id, price, quantity in lines:
+            line_total = price * quantity
+            subtotal += line_total
+            percent = category_percent.get(category_id)
+            line_discount = _percent(line_total, percent) if percent else ZERO
+            line_discounts.append(line_discount)
+            line_discount_total += line_discount
+
+        candidates = [rule for rule in self.basket_rules if subtotal >= rule.min_subtotal]
+        if applied is not None:
+            if subtotal < applied.rule.min_subtotal:
+                raise PricingError(f"Coupon {code} needs a subtotal of at least {applied.rule.min_subtotal}")
+            if applied.category_id is None:
+                candidates.append(applied.rule)
+        remaining = subtotal - line_discount_total
+        basket_discount = max((_basket_discount(rule, remaining) for rule in candidates), default=ZERO)
+
+        discount = min(subtotal, line_discount_total + basket_discount)
+        delivery_charge = self.delivery_charge(subtotal - discount) if subtotal else ZERO
+        return Quote(subtotal, discount, delivery_charge, subtotal - discount + delivery_charge,
+                     line_discounts, code if applied is not None else '')
+
+
+def compile_rules(version: int) -> RuleTable:
+    from .models import DeliveryRule, Discount
+
+    delivery = list(DeliveryRule.objects.filter(active=True).order_by('min_subtotal')
+                    .values_list('min_subtotal', 'charge'))
+    now = timezone.now()
+    category_percent: Dict[int, Decimal] = {}
+    basket_rules: List[BasketRule] = []
+    coupons: Dict[str, Coupon] = {}
+    boundaries = []
+    for row in Discount.objects.filter(active=True).values_list(
+            'code', 'category_id', 'percent_off', 'amount_off', 'min_subtotal', 'starts_at', 'ends_at'):
+        code, category_id, percent_off, amount_off, min_subtotal, starts_at, ends_at = row
+        boundaries += [moment for moment in (starts_at, ends_at) if moment is not None and moment > now]
+        if (starts_at is not None and starts_at > now) or (ends_at is not None and ends_at <= now):
+            continue
+        rule = BasketRule(min_subtotal, percent_off, amount_off)
+        if code:
+            code = code.strip().upper()
+            current = coupons.get(code)
+            # two live coupons with one code: keep the better one
+            if current is None or (rule.percent_off, rule.amount_off) > (current.rule.percent_off, current.rule.amount_off):
+                coupons[code] = Coupon(category_id, rule)
+        elif category_id is not None:
+            category_percent[category_id] = max(category_percent.get(category_id, ZERO), percent_off)
+        else:
+            basket_rules.append(rule)
+    valid_until = min(boundaries).timestamp() if boundaries else None
+    return RuleTable(version, delivery, category_percent, basket_rules, coupons, valid_until)
+
+
+def get_version() -> int:
+    """The rules version, shared by every process; a millisecond timestamp, like catalog_cache's."""
+    cache = caches['default']
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(VERSION_KEY, version, timeout=None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def bump_version() -> None:
+    cache = caches['default']
+    cache.set(VERSION_KEY, max(int(time.time() * 1000), (cache.get(VERSION_KEY) or 0) + 1), timeout=None)
+
+
+_lock = threading.Lock()
+_table: Optional[RuleTable] = None
+
+
+def _stale(table: Optional[RuleTable], version: int) -> bool:
+    return (table is None or table.version != version
+            or (table.valid_until is not None and time.time() >= table.valid_until))
+
+
+def rules() -> RuleTable:
+    """The compiled rule table for the current rules version."""
+    global _table
+    version = get_version()
+    if _stale(_table, version):
+        with _lock:
+            if _stale(_table, version):
+                _table = compile_rules(version)
+    return _table
+
+
+def delivery_charge(subtotal: Decimal) -> Decimal:
+    return rules().delivery_charge(subtotal)
@@ -0,0 +1,209 @@
+# Filename: shop/request_metrics.py
+"""
+Per-request instrumentation: SQL query count and time, serialization,
+render and password hashing time, and total time.
+
+RequestMetricsMiddleware wraps each request in an execute_wrapper on every
+database connection and keeps the running numbers in a context variable,
+so code deeper down can add to them (see timed()). Each response gets a
+Server-Timing header and one structured log line on the `shop.requests`
+logger; requests over REQUEST_QUERY_BUDGET queries or
+REQUEST_LATENCY_BUDGET_MS are logged at WARNING, the others at INFO (shown
+only with REQUEST_LOG_LEVEL=INFO).
+
+Totals are also kept per URL name (the names in shop/urls.py) in bounded
+sample windows of REQUEST_METRICS_SAMPLES, for the percentiles served at
+/api/metrics/requests/. Everything is in-process: with several workers,
+each reports its own traffic.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('shop.requests')
+
+
+class Measurement:
+    __slots__ = ('queries', 'db_ms', 'serialize_ms', 'render_ms', 'hash_ms')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.serialize_ms = 0.0
+        self.render_ms = 0.0
+        self.hash_ms = 0.0
+
+
+_current: ContextVar[Optional[Measurement]] = ContextVar('request_metrics', default=None)
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 of a list of millisecond samples."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0}
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+    return {'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+
+@contextmanager
+def timed(phase: str):
+    """Add the time spent in the block to the current request's `<phase>_ms`."""
+    measurement = _current.get()
+    if measurement is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        attr = f'{phase}_ms'
+        setattr(measurement, attr, getattr(measurement, attr) + (time.perf_counter() - start) * 1000)
+
+
+class _Aggregate:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, Deque[tuple]] = {}  # url name -> (total_ms, queries)
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def add(self, name: str, total_ms: float, queries: int, over_budget: bool) -> None:
+        size = getattr(settings, 'REQUEST_METRICS_SAMPLES', 1000)
+        with self.lock:
+            window = self.samples.get(name)
+            if window is None:
+                window = self.samples[name] = deque(maxlen=size)
+                self.counts[name] = {'requests': 0, 'over_budget': 0}
+            window.append((total_ms, queries))
+            self.counts[name]['requests'] += 1
+            self.counts[name]['over_budget'] += over_budget
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            snapshot = {name: (list(window), dict(self.counts[name])) for name, window in self.samples.items()}
+        data = {}
+        for name, (window, counts) in sorted(snapshot.items()):
+            queries = [q for _, q in window]
+            data[name] = {
+                **counts,
+                **percentiles([ms for ms, _ in window]),
+                'avg_queries': round(sum(queries) / len(queries), 2),
+                'max_queries': max(queries),
+            }
+        return data
+
+    def reset(self) -> None:
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+
+
+aggregate = _Aggregate()
+
+
+def stats() -> Dict[str, Any]:
+    return aggregate.stats()
+
+
+def reset_stats() -> None:
+    aggregate.reset()
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        measurement, token, start = self.start()
+        try:
+            with self.wrap_connections(measurement):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, measurement, (time.perf_counter() - start) * 1000)
+        return response
+
+    async def __acall__(self, request):
+        measurement, token, start = self.start()
+        try:
+            with self.wrap_connections(measurement):
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, measurement, (time.perf_counter() - start) * 1000)
+        return response
+
+    @staticmethod
+    def start():
+        measurement = Measurement()
+        return measurement, _current.set(measurement), time.perf_counter()
+
+    @staticmethod
+    def wrap_connections(measurement: Measurement) -> ExitStack:
+        def wrapper(execute, sql, params, many, context):
+            query_start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                measurement.queries += 1
+                measurement.db_ms += (time.perf_counter() - query_start) * 1000
+
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(wrapper))
+        return stack
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that too
+        render = response.render
+
+        def timed_render():
+            with timed('render'):
+                return render()
+        response.render = timed_render
+        return response
+
+    def report(self, request, response, m: Measurement, total_ms: float) -> None:
+        match = getattr(request, 'resolver_match', None)
+        name = (match.url_name if match else None) or 'unresolved'
+        over = []
+        if m.queries > getattr(settings, 'REQUEST_QUERY_BUDGET', 20):
+            over.append('queries')
+        if total_ms > getattr(settings, 'REQUEST_LATENCY_BUDGET_MS', 500):
+            over.append('latency')
+        aggregate.add(name, total_ms, m.queries, bool(over))
+
+        timings = [
+            f'db;dur={m.db_ms:.1f};desc="{m.queries} queries"',
+            f'serialize;dur={m.serialize_ms:.1f}',
+            f'render;dur={m.render_ms:.1f}',
+        ]
+        if m.hash_ms:
+            timings.append(f'hash;dur={m.hash_ms:.1f}')
+        timings.append(f'total;dur={total_ms:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+        record = {
+            'method': request.method, 'path': request.path, 'url_name': name,
+            'status': response.status_code, 'queries': m.queries, 'db_ms': round(m.db_ms, 2),
+            'serialize_ms': round(m.serialize_ms, 2), 'render_ms': round(m.render_ms, 2),
+            'hash_ms': round(m.hash_ms, 2), 'total_ms': round(total_ms, 2), 'over_budget': over,
+        }
+        logger.log(logging.WARNING if over else logging.INFO, json.dumps(record), extra={'metrics': record})
@@ -0,0 +1,139 @@
+# Filename: shop/routers.py
+"""
+Catalog reads from read replicas.
+
+DATABASE_REPLICAS (aliases built from REPLICA_DATABASE_URLS in settings)
+take the catalog read endpoints' queries off the primary. ReplicaRouter
+sends a read to a replica, round-robin, only when all of these hold:
+- it is a Product or Category read inside replica_reads(), which the
+  catalog list/detail views (ReplicaReadMixin, and their async versions)
+  wrap around themselves. Anything else -- auth, orders, stock, admin,
+  management commands -- reads the primary;
+- the primary is not in a transaction (atomic() reads what it wrote);
+- the client is not pinned. A request that writes anything is pinned for
+  the rest of the request, and ReplicaPinMiddleware sets a cookie that
+  pins that client's next REPLICA_LAG_SECONDS of requests, so it reads
+  its own writes;
+- neither the catalog nor stock has changed for REPLICA_LAG_SECONDS.
+  Otherwise a replica that is behind would fill the catalog cache with
+  old rows under the new version. That is only known when the versions
+  live in a cache every process shares (catalog_cache.shared()); with a
+  per-process cache, reads stay on the primary.
+
+Writes and migrations only go to the primary. To try it locally with two
+SQLite files: cp db.sqlite3 replica.sqlite3 and start the server with
+REPLICA_DATABASE_URLS=sqlite:///replica.sqlite3. A product added after
+the copy only shows up for the client that added it.
+"""
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import catalog_cache
+
+PIN_COOKIE = 'primary_pin'
+CATALOG_MODELS = {'shop.category', 'shop.product'}
+
+
+class RequestState:
+    def __init__(self, pinned: bool = False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state: ContextVar[Optional[RequestState]] = ContextVar('replica_request_state', default=None)
+_replica_reads: ContextVar[bool] = ContextVar('replica_reads', default=False)
+_next = itertools.count()
+
+
+@contextmanager
+def replica_reads():
+    """Catalog reads inside may go to a replica."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaReadMixin:
+    """For the catalog read views: their Product/Category queries may go to a replica."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or not _replica_reads.get() or model._meta.label_lower not in CATALOG_MODELS:
+            return None
+        if not catalog_cache.shared():
+            return None
+        state = _state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if time.time() * 1000 - max(catalog_cache.current()) < settings.REPLICA_LAG_SECONDS * 1000:
+            return None
+        return replicas[next(_next) % len(replicas)]
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # the replicas hold the same data
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaPinMiddleware:
+    """Tracks writes per request and pins the client that made them to the primary for a while."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
+
+    @staticmethod
+    def start(request):
+        state = RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        return state, _state.set(state)
+
+    @staticmethod
+    def finish(state: RequestState, response):
+        if state.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_LAG_SECONDS, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,250 @@
+# Filename: shop/search.py
+"""
+Full-text product search.
+
+SQLite: an FTS5 virtual table (shop_product_fts, rowid = product id) that
+signals keep in sync on Product save/delete, ranked with bm25().
+PostgreSQL: a GIN expression index over to_tsvector(name || description),
+which the database maintains itself, ranked with ts_rank().
+
+Both rank name matches above description matches, treat every term as a
+prefix ("appl" finds "apple"), and when nothing matches retry with terms
+corrected against the index vocabulary ("aple" finds "apple"). The
+vocabulary is the fts5vocab table on SQLite; on PostgreSQL it is read with
+ts_stat() once per catalog version and kept in memory, since ts_stat()
+scans every product.
+
+ranked_rows() returns every match, or one keyset page of them ordered by
+(score, id) so later pages continue exactly where the previous one ended.
+It returns None when the index is not installed so callers can fall back
+to the old name__icontains filter.
+"""
+import difflib
+import re
+import threading
+from bisect import bisect_left
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models.expressions import RawSQL
+
+from . import catalog_cache
+
+FTS_TABLE = 'shop_product_fts'
+VOCAB_TABLE = 'shop_product_fts_vocab'
+PG_INDEX = 'shop_product_search_idx'
+PG_DOCUMENT = "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"
+PG_RANKED_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+)
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+_available = {}
+
+# (catalog version, sorted words) of the PostgreSQL index
+_pg_vocabulary: Tuple[Optional[int], List[str]] = (None, [])
+_pg_vocabulary_lock = threading.Lock()
+
+# (corrected, score, id) of the last row of a page; scores sort ascending, best first
+Position = Tuple[bool, float, int]
+
+
+class Page(NamedTuple):
+    rows: list  # rows of the queryset passed to ranked_rows(), best match first
+    next: Optional[Position]  # where the next page starts; None after the last one
+
+
+def terms(query: str) -> List[str]:
+    """Lower-cased word tokens of a search string (punctuation is dropped)."""
+    return [t.lower() for t in TERM_RE.findall(query or '')][:8]
+
+
+def index_available(conn=connection) -> bool:
+    """True when the search index exists on this database (cached per process)."""
+    if conn.alias not in _available:
+        with conn.cursor() as cursor:
+            if conn.vendor == 'sqlite':
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            elif conn.vendor == 'postgresql':
+                cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [PG_INDEX])
+            else:
+                _available[conn.alias] = False
+                return False
+            _available[conn.alias] = cursor.fetchone() is not None
+    return _available[conn.alias]
+
+
+# --- index DDL (used by the migration) -------------------------------------
+
+def create_index(schema_editor) -> None:
+    conn = schema_editor.connection
+    if conn.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "name, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+        except DatabaseError:
+            return  # SQLite built without FTS5: search falls back to icontains
+        schema_editor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {VOCAB_TABLE} USING fts5vocab({FTS_TABLE}, 'row')")
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description) SELECT id, name, description FROM shop_product"
+        )
+    elif conn.vendor == 'postgresql':
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON shop_product USING GIN ({PG_DOCUMENT})")
+    _available.pop(conn.alias, None)
+
+
+def drop_index(schema_editor) -> None:
+    conn = schema_editor.connection
+    if conn.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {VOCAB_TABLE}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif conn.vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+    _available.pop(conn.alias, None)
+
+
+# --- keeping SQLite in sync ------------------------------------------------
+
+def index_products(products: Iterable) -> None:
+    """(Re)index the given Product instances. No-op outside SQLite."""
+    if connection.vendor != 'sqlite' or not index_available():
+        return
+    rows = [(p.pk, p.name, p.description or '') for p in products]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(f"INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (%s, %s, %s)", rows)
+
+
+def remove_products(product_ids: Iterable[int]) -> None:
+    if connection.vendor != 'sqlite' or not index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in product_ids])
+
+
+def reindex_all() -> None:
+    """Rebuild the SQLite index from shop_product (after bulk imports)."""
+    if connection.vendor != 'sqlite' or not index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}(rowid, name, description) SELECT id, name, description FROM shop_product")
+
+
+# --- querying ---------------------------------------------------------------
+
+def _match_expression(words: List[str], vendor: str, any_term: bool = False) -> str:
+    if vendor == 'sqlite':
+        joiner = ' OR ' if any_term else ' '
+        return joiner.join(f'"{w}"*' for w in words)
+    joiner = ' | ' if any_term else ' & '
+    return joiner.join(f'{w}:*' for w in words)
+
+
+def _matches(conn, expression: str) -> RawSQL:
+    """Ids of every product matching `expression`, as a subquery."""
+    if conn.vendor == 'sqlite':
+        return RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [expression])
+    return RawSQL(f"SELECT id FROM shop_product WHERE {PG_DOCUMENT} @@ to_tsquery('simple', %s)", [expression])
+
+
+def _ranked_ids(conn, rows, expression: str, after: Optional[Position], limit: Optional[int]) -> List[Tuple[float, int]]:
+    """(score, id) of the matches among `rows`, best first, after `after`; at most `limit`."""
+    scope, scope_params = rows.order_by().values('id').query.get_compiler(using=conn.alias).as_sql()
+    if conn.vendor == 'sqlite':
+        # +rowid: a plain rowid IN (...) makes FTS5 run the MATCH once per id in scope
+        ranked = (f"SELECT rowid AS id, bm25({FTS_TABLE}, 10.0, 1.0) AS score FROM {FTS_TABLE} "
+                  f"WHERE {FTS_TABLE} MATCH %s AND +rowid IN ({scope})")
+        params = [expression, *scope_params]
+    else:
+        # float8, so the score survives the round trip through the cursor exactly
+        ranked = (f"SELECT id, (-ts_rank({PG_RANKED_DOCUMENT}, to_tsquery('simple', %s)))::float8 AS score "
+                  f"FROM shop_product WHERE {PG_DOCUMENT} @@ to_tsquery('simple', %s) AND id IN ({scope})")
+        params = [expression, expression, *scope_params]
+    sql = f"SELECT score, id FROM ({ranked}) ranked"
+    if after is not None:
+        sql += " WHERE score > %s OR (score = %s AND id > %s)"
+        params += [after[1], after[1], after[2]]
+    sql += " ORDER BY score, id"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    with conn.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(score, pk) for score, pk in cursor.fetchall()]
+
+
+def _pg_words(conn) -> List[str]:
+    """Every word in the PostgreSQL index, sorted: read once per catalog version."""
+    global _pg_vocabulary
+    version = catalog_cache.get_version()
+    with _pg_vocabulary_lock:
+        if _pg_vocabulary[0] != version:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT word FROM ts_stat(%s)", [f"SELECT {PG_DOCUMENT} FROM shop_product"])
+                _pg_vocabulary = (version, sorted(row[0] for row in cursor.fetchall()))
+        return _pg_vocabulary[1]
+
+
+def _vocabulary(conn, prefix: str) -> List[str]:
+    """Indexed terms starting with `prefix` (typos rarely change the first letter)."""
+    if conn.vendor == 'sqlite':
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT term FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s", [prefix, prefix + '\uffff'])
+            return [row[0] for row in cursor.fetchall()]
+    words = _pg_words(conn)
+    return words[bisect_left(words, prefix):bisect_left(words, prefix + '\uffff')]
+
+
+def _corrected(conn, words: List[str]) -> List[str]:
+    corrected = []
+    for word in words:
+        candidates = _vocabulary(conn, word[0])
+        corrected.extend(difflib.get_close_matches(word, candidates, n=3, cutoff=0.75) or [word])
+    return corrected
+
+
+def ranked_rows(rows, query: str, limit: Optional[int] = None, after: Optional[Position] = None) -> Optional[Page]:
+    """
+    The rows of `rows` (a product_values() / values_list() queryset, id
+    first) matching `query`, best match first. Without `limit`, all of
+    them; with it, one page starting after the position `after` that the
+    previous page returned. Returns None when the search index is
+    unavailable (caller should fall back).
+    """
+    words = terms(query)
+    if not words:
+        return Page([], None)
+    conn = connections[rows.db]
+    if not index_available(conn):
+        return None
+    rows = rows.using(conn.alias)
+    corrected = after is not None and after[0]
+    # one more than the page, to know whether there is a next one
+    fetch = None if limit is None else limit + 1
+    try:
+        with transaction.atomic(using=conn.alias):
+            expression = _match_expression(words, conn.vendor)
+            hits = [] if corrected else _ranked_ids(conn, rows, expression, after, fetch)
+            if corrected or (not hits and after is None):
+                corrected = True
+                expression = _match_expression(_corrected(conn, words), conn.vendor, any_term=True)
+                hits = _ranked_ids(conn, rows, expression, after, fetch)
+            if not hits:
+                return Page([], None)
+            hits, more = hits[:limit], limit is not None and len(hits) > limit
+            if limit is None:
+                found = rows.filter(id__in=_matches(conn, expression))  # no id list, however many hits
+            else:
+                found = rows.filter(id__in=[pk for _, pk in hits])
+            by_id = {row[0]: row for row in found}
+    except DatabaseError:
+        return None
+    next_position = (corrected, *hits[-1]) if more else None
+    return Page([by_id[pk] for _, pk in hits if pk in by_id], next_position)
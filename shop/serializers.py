@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from . import hashing, images
 from .models import Category, Product, Order, OrderItem
 
 class UserSerializer(serializers.ModelSerializer):
@@ -14,28 +15,67 @@ class RegisterSerializer(serializers.ModelSerializer):
         model = User
         fields = ['username', 'email', 'password', 'first_name', 'last_name']
         
-    def create(self, validated_data):
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data.get('email', ''),
-            password=validated_data['password'],
+    @staticmethod
+    def build_user(validated_data, password_hash):
+        """The unsaved user create_user() would make, with an already hashed password."""
+        return User(
+            username=User.normalize_username(validated_data['username']),
+            email=User.objects.normalize_email(validated_data.get('email', '')),
+            password=password_hash,
             first_name=validated_data.get('first_name', ''),
             last_name=validated_data.get('last_name', '')
         )
+
+    def create(self, validated_data):
+        user = self.build_user(validated_data, hashing.hash_password(validated_data['password']))
+        user.save()
         return user
 
+class DynamicFieldsMixin:
+    """
+    Lets callers restrict output to a subset of fields:
+    ProductSerializer(qs, many=True, fields=['id', 'name'])
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise serializers.ValidationError(
+                    {'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"}
+                )
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class ThumbnailsField(serializers.Field):
+    """URLs of an image's thumbnails by format and width (shop/images.py), null until rendered."""
+
+    def __init__(self, **kwargs):
+        super().__init__(source='image_derivatives', read_only=True, **kwargs)
+        self.urls = None
+
+    def to_representation(self, value):
+        if self.urls is None:  # once per serializer, not per row
+            request = self.context.get('request')
+            self.urls = images.thumbnail_urls(request.build_absolute_uri if request is not None else None)
+        return self.urls(value)
+
 class CategorySerializer(serializers.ModelSerializer):
+    thumbnails = ThumbnailsField()
+
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'image_url', 'image']
+        fields = ['id', 'name', 'slug', 'image_url', 'image', 'thumbnails']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     category_slug = serializers.CharField(source='category.slug', read_only=True)
+    thumbnails = ThumbnailsField()
     
     class Meta:
         model = Product
         fields = ['id', 'category', 'category_slug', 'name', 'slug', 'description', 
-                  'price', 'stock', 'image_url', 'image', 'available']
+                  'price', 'stock', 'image_url', 'image', 'thumbnails', 'available']
 
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
@@ -48,9 +88,10 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['id', 'user', 'full_name', 'phone', 'address', 'created_at', 
-                  'delivery_charge', 'subtotal', 'total', 'is_paid', 
+                  'delivery_charge', 'subtotal', 'discount', 'coupon_code', 'total', 'is_paid', 
                   'payment_txn_id', 'payment_method', 'items']
-        read_only_fields = ['user', 'created_at', 'delivery_charge', 'subtotal', 'total', 'is_paid']
+        read_only_fields = ['user', 'created_at', 'delivery_charge', 'subtotal', 'discount', 'coupon_code',
+                            'total', 'is_paid']
 
 class OrderCreateSerializer(serializers.Serializer):
     """
@@ -63,11 +104,40 @@ class OrderCreateSerializer(serializers.Serializer):
         "items": [
             {"product_id": 1, "quantity": 2},
             ...
-        ]
+        ],
+        "coupon": "..."  (optional)
     }
     """
     full_name = serializers.CharField(max_length=200)
     phone = serializers.CharField(max_length=20)
     address = serializers.CharField()
     items = serializers.ListField(child=serializers.DictField())
+    coupon = serializers.CharField(max_length=40, required=False, allow_blank=True)
+
+class CartChangeSerializer(serializers.Serializer):
+    """
+    A change to a signed cart (shop/cart.py SignedCart):
+    {"token": "<previous token, if any>", "product_id": 1, "quantity": 2, "override_quantity": false}
+    """
+    token = serializers.CharField(required=False, allow_blank=True)
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(default=1)
+    override_quantity = serializers.BooleanField(default=False)
+
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+class CartQuoteSerializer(serializers.Serializer):
+    """
+    A basket to price: {"items": [{"product_id": 1, "quantity": 2}, ...], "coupon": "..."}.
+    Repeated products are added together; the coupon is optional.
+    """
+    items = serializers.ListField(child=CartLineSerializer())
+    coupon = serializers.CharField(max_length=40, required=False, allow_blank=True)
 
+    def validate_items(self, items):
+        quantities = {}
+        for line in items:
+            quantities[line['product_id']] = quantities.get(line['product_id'], 0) + line['quantity']
+        return quantities
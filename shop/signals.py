@@ -0,0 +1,106 @@
+# Filename: shop/signals.py
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication, catalog_cache, images, pricing, search
+from .models import Category, DeliveryRule, Discount, Product, ProductTombstone
+from .suggest import index as suggest_index
+
+
+def bump_catalog(committed=None):
+    """
+    Move the catalog to a new version now and again once the transaction
+    commits: a reader between the two may have cached the pre-commit rows
+    under the first. `committed(previous, version)` runs after the second
+    bump, with `previous` None if another write bumped the version while
+    the transaction was open.
+    """
+    previous = catalog_cache.get_version()
+    during = catalog_cache.bump_version()
+
+    def on_commit():
+        unchanged = catalog_cache.get_version() == during
+        version = catalog_cache.bump_version()
+        if committed is not None:
+            committed(previous if unchanged else None, version)
+
+    transaction.on_commit(on_commit)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog(sender, **kwargs):
+    """Any catalog write (API, admin, shell) moves the catalog to a new version."""
+    bump_catalog()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        bump_catalog()
+        return
+    search.index_products([instance])
+    bump_catalog(lambda previous, version: suggest_index.apply(instance.pk, instance, previous, version))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+    ProductTombstone.objects.create(product_id=instance.pk)
+    pk = instance.pk  # cleared on the instance once the delete completes
+    bump_catalog(lambda previous, version: suggest_index.apply(pk, None, previous, version))
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=Product)
+def image_changing(sender, instance, raw=False, **kwargs):
+    """Thumbnails belong to one image; a new upload has none until they are rendered."""
+    image = instance.image
+    if not raw and instance.image_derivatives and (
+            not image or not image._committed or not images.made_from(image.name, instance.image_derivatives)):
+        instance.image_derivatives = ''
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+def image_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not instance.image or instance.image_derivatives:
+        return
+    if update_fields is None or 'image' in update_fields:
+        transaction.on_commit(lambda: images.schedule(instance))
+
+
+@receiver(post_save, sender=DeliveryRule)
+@receiver(post_delete, sender=DeliveryRule)
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def invalidate_pricing(sender, **kwargs):
+    """Recompile the pricing rules; again after commit, in case the old rows were compiled in between."""
+    pricing.bump_version()
+    transaction.on_commit(pricing.bump_version)
+
+
+@receiver(post_save, sender=Token)
+def token_saved(sender, instance, created=False, **kwargs):
+    if not created:
+        authentication.revoke(key=instance.key)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    authentication.revoke(key=instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    """Deactivation, password and staff changes must not be served from the auth cache."""
+    if not created and update_fields != frozenset({'last_login'}):
+        authentication.revoke(user_id=instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(sender, instance, **kwargs):
+    authentication.revoke(user_id=instance.pk)
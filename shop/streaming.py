@@ -0,0 +1,107 @@
+# Filename: shop/streaming.py
+"""
+Row encoders shared by the bulk import/export commands and streaming
+endpoints. Everything here is a generator: rows are encoded one at a time
+so memory stays flat however many are produced.
+"""
+import csv
+import io
+import itertools
+import json
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+FORMATS = ('csv', 'jsonl')
+
+
+class InvalidRow(dict):
+    """An empty row standing in for a JSONL line that is not a JSON object; `error` says why."""
+    def __init__(self, error: str):
+        super().__init__()
+        self.error = error
+
+
+def row_error(raw: Any) -> Optional[str]:
+    """Why `raw` cannot be read as an input row, or None when it is a dict."""
+    if isinstance(raw, InvalidRow):
+        return raw.error
+    if not isinstance(raw, dict):
+        return "not a JSON object"
+    return None
+
+
+def guess_format(path: str, default: str = 'csv') -> str:
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else default
+
+
+def _json_default(value: Any):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def csv_lines(header: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[str]:
+    """Yield the CSV header then one encoded line per row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in itertools.chain([header], rows):
+        writer.writerow(values)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def jsonl_lines(header: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[str]:
+    """Yield one JSON object per row, keyed by header."""
+    for values in rows:
+        yield json.dumps(dict(zip(header, values)), default=_json_default, separators=(',', ':')) + '\n'
+
+
+def encode(fmt: str, header: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[str]:
+    return csv_lines(header, rows) if fmt == 'csv' else jsonl_lines(header, rows)
+
+
+def batches(iterable: Iterable, size: int) -> Iterator[List]:
+    """Lists of up to `size` items, read lazily from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def chunked(lines: Iterable[str], size: int = 65536) -> Iterator[str]:
+    """Join encoded lines into chunks of about `size` characters: one write per chunk, not per row."""
+    parts, length = [], 0
+    for line in lines:
+        parts.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(parts)
+            parts, length = [], 0
+    if parts:
+        yield ''.join(parts)
+
+
+def read_rows(fh, fmt: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield dicts from an open CSV or JSONL file, one line at a time. A JSONL
+    line that does not hold a JSON object yields an InvalidRow, so the
+    caller can report it with the other bad rows.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(fh)
+        return
+    for line in fh:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield InvalidRow(f"invalid JSON: {exc}")
+            continue
+        yield row if isinstance(row, dict) else InvalidRow("not a JSON object")
@@ -0,0 +1,183 @@
+# Filename: shop/suggest.py
+"""
+In-process prefix index for the product typeahead (/api/products/suggest/).
+
+Normalized product names (and the tails starting at each later word, so
+"jui" finds "Apple Juice") are kept in one sorted list; a lookup is a
+bisect plus a short scan, with no database or cache round trip.
+
+The index follows the catalog version from shop/catalog_cache.py: writes
+made in this process are applied incrementally by the Product signals,
+and writes made by other processes (workers, import_catalog) are noticed
+within SUGGEST_REFRESH_SECONDS and applied incrementally too, from the
+products updated and the tombstones written since the last refresh (the
+data behind /api/products/changes/, re-read CATALOG_CHANGES_LAG seconds
+back for late commits). Only a change of more than MAX_INCREMENTAL
+products rebuilds the index. Either way one thread refreshes, off the
+lookup lock, while the others keep answering from the current index.
+Noticing requires the version to live in a shared cache (REDIS_URL);
+gunicorn.conf.py refuses several workers on the per-process LocMemCache.
+Without it, writes from a separate process (e.g. import_catalog next to
+runserver) show up only after a restart.
+Under gunicorn, gunicorn.conf.py builds the index once in the master
+(preload_app) so forked workers start with it already in memory.
+"""
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import catalog_cache
+
+NON_ALNUM = re.compile(r'[^0-9a-z]+')
+MAX_KEY_LENGTH = 64
+MAX_WORD_ENTRIES = 4
+MAX_INCREMENTAL = 1000  # changed products applied in place; more rebuild the index
+
+
+def normalize(text: str) -> str:
+    """Lower-case, strip accents and collapse punctuation: 'Crème Brûlée!' -> 'creme brulee'."""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii')
+    return NON_ALNUM.sub(' ', text.lower()).strip()
+
+
+def keys_for(name: str) -> List[Tuple[str, int]]:
+    """(key, word position) pairs for a product name: the full name, then tails from later words."""
+    words = normalize(name).split()
+    return [(' '.join(words[i:])[:MAX_KEY_LENGTH], i) for i in range(min(len(words), MAX_WORD_ENTRIES))]
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.refreshing = threading.Lock()                 # held by the one thread catching up
+        self.entries: List[Tuple[str, int, int]] = []     # (key, word position, product id), sorted
+        self.products: Dict[int, Tuple[str, str]] = {}    # id -> (name, price)
+        self.version: Optional[int] = None
+        self.synced_at: Optional[datetime] = None          # database changes before this are in
+        self.checked_at = 0.0
+
+    @property
+    def max_products(self) -> int:
+        return getattr(settings, 'SUGGEST_MAX_PRODUCTS', 50000)
+
+    def build(self) -> None:
+        """Load every available product (up to SUGGEST_MAX_PRODUCTS) into a fresh index."""
+        from .models import Product
+
+        version, synced_at = catalog_cache.get_version(), timezone.now()
+        rows = Product.objects.filter(available=True).order_by('id').values_list('id', 'name', 'price')
+        entries, products = [], {}
+        for pk, name, price in rows[:self.max_products]:
+            products[pk] = (name, f'{price:f}')
+            entries.extend((key, pos, pk) for key, pos in keys_for(name))
+        entries.sort()
+        with self.lock:
+            self.entries, self.products = entries, products
+            self.version, self.synced_at, self.checked_at = version, synced_at, time.monotonic()
+
+    def _catch_up(self, version: int) -> bool:
+        """
+        Apply the products updated and deleted since the last refresh.
+        False when there are more than MAX_INCREMENTAL (the caller rebuilds).
+        """
+        from .models import Product, ProductTombstone
+
+        since = self.synced_at - timedelta(seconds=getattr(settings, 'CATALOG_CHANGES_LAG', 5))
+        synced_at = timezone.now()
+        updated = list(Product.objects.filter(updated_at__gte=since).values_list(
+            'id', 'name', 'price', 'available')[:MAX_INCREMENTAL + 1])
+        deleted = list(ProductTombstone.objects.filter(deleted_at__gte=since).values_list(
+            'product_id', flat=True)[:MAX_INCREMENTAL + 1])
+        if len(updated) + len(deleted) > MAX_INCREMENTAL:
+            return False
+        with self.lock:
+            for pk, name, price, available in updated:
+                self._put(pk, name, price, available)
+            for pk in deleted:
+                self._remove(pk)
+            self.version, self.synced_at, self.checked_at = version, synced_at, time.monotonic()
+        return True
+
+    def _remove(self, pk: int) -> None:
+        name = self.products.pop(pk, (None,))[0]
+        if name is None:
+            return
+        for key, pos in keys_for(name):
+            i = bisect_left(self.entries, (key, pos, pk))
+            if i < len(self.entries) and self.entries[i] == (key, pos, pk):
+                del self.entries[i]
+
+    def _put(self, pk: int, name: str, price, available: bool) -> None:
+        self._remove(pk)
+        if available and len(self.products) < self.max_products:
+            self.products[pk] = (name, f'{price:f}')
+            for key, pos in keys_for(name):
+                insort(self.entries, (key, pos, pk))
+
+    def apply(self, pk: int, product, previous_version: int, new_version: int) -> None:
+        """
+        Apply one Product write made in this process (product=None for a
+        delete). If the index was not current before the write (another
+        worker changed the catalog), leave it stale so the next lookup
+        rebuilds it.
+        """
+        with self.lock:
+            if self.version is None or self.version != previous_version:
+                return
+            if product is None:
+                self._remove(pk)
+            else:
+                self._put(pk, product.name, product.price, product.available)
+            self.version = new_version
+
+    def ensure_current(self) -> None:
+        now = time.monotonic()
+        if self.version is not None and now - self.checked_at < getattr(settings, 'SUGGEST_REFRESH_SECONDS', 2):
+            return
+        # only the first lookup waits for an index; later ones keep the current one while another thread refreshes
+        if not self.refreshing.acquire(blocking=self.version is None):
+            return
+        try:
+            version = catalog_cache.get_version()
+            if self.version is not None and version == self.version:
+                self.checked_at = now
+            elif self.version is None or not self._catch_up(version):
+                self.build()
+        finally:
+            self.refreshing.release()
+
+    def lookup(self, prefix: str, limit: int = 8) -> List[Dict]:
+        """
+        Up to `limit` products whose name (or a later word of it) starts with
+        `prefix`: whole-name matches first, then alphabetical.
+        """
+        prefix = normalize(prefix)[:MAX_KEY_LENGTH]
+        if not prefix:
+            return []
+        self.ensure_current()
+        matches, seen = [], set()
+        with self.lock:
+            entries, products = self.entries, self.products
+            i = bisect_left(entries, (prefix,))
+            scan_limit = i + limit * 20
+            while i < len(entries) and i < scan_limit and entries[i][0].startswith(prefix):
+                key, pos, pk = entries[i]
+                if pk not in seen:
+                    seen.add(pk)
+                    matches.append((pos > 0, key, pk))
+                i += 1
+            matches.sort()
+            return [
+                {'id': pk, 'name': products[pk][0], 'price': products[pk][1]}
+                for _, _, pk in matches[:limit]
+            ]
+
+
+index = PrefixIndex()
@@ -1,3 +1,1500 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import (
+    async_endpoints, authentication, catalog_cache, checks, hashing, idempotency, images, inventory, media,
+    payments, pricing, request_metrics, routers, search,
+)
+from .fast_serializers import product_values, serialize_categories, serialize_products
+from .cart import CART_TOKEN_SALT
+from .models import Category, DeliveryRule, Discount, IdempotencyKey, Order, Product, StockReservation
+from .orders import OrderError, place_order
+from .serializers import CategorySerializer, ProductSerializer
+from .suggest import index as suggest_index
+
+
+class CatalogFixtureMixin:
+    def setUp(self):
+        cache.clear()
+        catalog_cache.reset_stats()
+        pricing.rules()  # compiled once per rules version, so query counts below leave it out
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Fruits', slug='fruits')
+        self.apple = Product.objects.create(
+            category=self.category, name='Apple', slug='apple',
+            description='Fresh red apples', price=Decimal('120.00'), stock=50,
+        )
+
+
+class SharedCacheMixin:
+    """
+    Run on a cache every process sees (files here, Redis in production), as
+    the catalog validators and replica reads require.
+    """
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        shared = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        })
+        shared.enable()
+        self.addCleanup(shared.disable)
+        super().setUp()
+
+
+class CatalogCacheTests(CatalogFixtureMixin, TestCase):
+    def test_second_request_is_served_from_cache(self):
+        first = self.client.get('/api/products/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/products/')
+        self.assertEqual(first.json(), second.json())
+        stats = catalog_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_query_params_are_part_of_the_key(self):
+        self.client.get('/api/products/?q=apple')
+        response = self.client.get('/api/products/?q=banana')
+        self.assertEqual(response.json(), [])
+
+    def test_product_save_invalidates(self):
+        self.client.get('/api/products/')
+        self.apple.price = Decimal('99.00')
+        self.apple.save()
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.json()[0]['price'], '99.00')
+        self.assertEqual(catalog_cache.stats()['evictions'], 1)
+
+    def test_version_bumped_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.apple.save()
+            during = catalog_cache.get_version()
+        self.assertGreater(catalog_cache.get_version(), during)
+
+    def test_category_delete_invalidates(self):
+        self.assertEqual(len(self.client.get('/api/categories/').json()), 1)
+        self.category.delete()
+        self.assertEqual(self.client.get('/api/categories/').json(), [])
+        self.assertEqual(self.client.get('/api/products/').json(), [])
+
+    def test_deploy_check_warns_on_a_per_process_cache(self):
+        self.assertEqual([w.id for w in checks.check_shared_cache(None)], ['shop.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                                   'LOCATION': tempfile.gettempdir()}}):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+
+class RequestMetricsTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        request_metrics.reset_stats()
+
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs('shop.requests', 'INFO') as logs:
+            response = self.client.get('/api/products/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries", serialize;dur=[\d.]+, '
+                                                     r'render;dur=[\d.]+, total;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['url_name'], record['status'], record['queries']), ('api_products', 200, 1))
+        self.assertEqual(record['over_budget'], [])
+
+    @override_settings(REQUEST_QUERY_BUDGET=0)
+    def test_over_budget_requests_are_warnings(self):
+        with self.assertLogs('shop.requests', 'WARNING') as logs:
+            self.client.get('/api/categories/')
+        self.assertEqual(json.loads(logs.records[0].getMessage())['over_budget'], ['queries'])
+
+    def test_percentiles_per_url_name(self):
+        with self.assertLogs('shop.requests'):
+            for _ in range(3):
+                self.client.get('/api/products/')
+            self.client.get(f'/api/products/{self.apple.id}/')
+        stats = request_metrics.stats()
+        self.assertEqual(stats['api_products']['requests'], 3)
+        self.assertEqual(stats['api_products']['max_queries'], 1)
+        self.assertEqual(stats['api_product_detail']['requests'], 1)
+        self.assertLessEqual(stats['api_products']['p50_ms'], stats['api_products']['p99_ms'])
+
+
+class OrderCreateTests(CatalogFixtureMixin, TestCase):
+    def basket(self, size):
+        products = Product.objects.bulk_create([
+            Product(category=self.category, name=f'Item {i}', slug=f'item-{i}', price=Decimal('10.00'), stock=10)
+            for i in range(size)
+        ])
+        return {
+            'full_name': 'Asha', 'phone': '9999999999', 'address': 'MG Road',
+            'items': [{'product_id': p.id, 'quantity': 2} for p in products],
+        }
+
+    def test_query_count_is_constant(self):
+        for size in (1, 10, 100):
+            payload = self.basket(size)
+            # savepoint, product lookup, order insert, stock update, reservations insert,
+            # items insert, release, items read for the response
+            with self.subTest(size=size), self.assertNumQueries(8):
+                response = self.client.post('/api/orders/create/', payload, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.json()['items']), size)
+            self.assertEqual(response.json()['subtotal'], f'{20 * size}.00')
+            Product.objects.filter(slug__startswith='item-').delete()
+
+    def test_unknown_product_rolls_back(self):
+        payload = {
+            'full_name': 'Asha', 'phone': '9999999999', 'address': 'MG Road',
+            'items': [{'product_id': self.apple.id, 'quantity': 1}, {'product_id': 999999, 'quantity': 1}],
+        }
+        response = self.client.post('/api/orders/create/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class AsyncUrls:
+    """ROOT_URLCONF with the async views, as if ASYNC_VIEWS were on."""
+    urlpatterns = [
+        path('api/products/', async_endpoints.product_list, name='api_products'),
+        path('api/products/<int:id>/', async_endpoints.product_detail, name='api_product_detail'),
+        path('api/orders/create/', async_endpoints.order_create, name='api_order_create'),
+        path('api/register/', async_endpoints.register, name='api_register'),
+        path('api/login/', async_endpoints.login, name='api_login'),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncEndpointTests(SharedCacheMixin, CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+
+    async def test_catalog_matches_sync_views_and_shares_cache(self):
+        for url in ('/api/products/', '/api/products/?fields=id,name', f'/api/products/{self.apple.id}/'):
+            with override_settings(ROOT_URLCONF='grocery.urls'):
+                expected = await self.async_client.get(url)
+            response = await self.async_client.get(url)
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response['ETag'], expected['ETag'])
+            self.assertIn('desc="0 queries"', response['Server-Timing'])
+
+        response = await self.async_client.get('/api/products/999999/')
+        self.assertEqual((response.status_code, response.json()), (404, {'detail': 'Not found.'}))
+        self.assertEqual((await self.async_client.get('/api/products/?fields=secret')).status_code, 400)
+
+    async def test_cache_miss_reads_through_async_orm(self):
+        response = await self.async_client.get('/api/products/?category=fruits')
+        self.assertEqual([p['name'] for p in response.json()], ['Apple'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        etag = response['ETag']
+        response = await self.async_client.get('/api/products/?category=fruits', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_order_create(self):
+        user = await User.objects.acreate(username='asha')
+        token = await Token.objects.acreate(user=user)
+        payload = {
+            'full_name': 'Asha', 'phone': '9999999999', 'address': 'MG Road',
+            'items': [{'product_id': self.apple.id, 'quantity': 2}],
+        }
+        response = await self.async_client.post('/api/orders/create/', payload, content_type='application/json',
+                                                headers={'Authorization': f'Token {token.key}'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['user'], response.json()['subtotal']), (user.id, '240.00'))
+        for _ in range(2):
+            retry = await self.async_client.post('/api/orders/create/', payload, content_type='application/json',
+                                                 headers={'Authorization': f'Token {token.key}',
+                                                          'Idempotency-Key': 'k1'})
+        self.assertEqual((retry.status_code, retry['Idempotent-Replayed']), (201, 'true'))
+        self.assertEqual(await Order.objects.acount(), 2)
+
+        response = await self.async_client.post('/api/orders/create/', payload, content_type='application/json',
+                                                headers={'Authorization': 'Token nope'})
+        self.assertEqual(response.status_code, 401)
+        payload['items'][0]['quantity'] = 1000
+        response = await self.async_client.post('/api/orders/create/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(await Order.objects.acount(), 2)
+
+    @override_settings(PASSWORD_HASH_WORKERS=0)
+    async def test_register_and_login(self):
+        credentials = {'username': 'asha', 'password': 'secret-pw'}
+        response = await self.async_client.post('/api/register/', credentials, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        token = response.json()['token']
+        self.assertIn('hash;dur=', response['Server-Timing'])
+
+        response = await self.async_client.post('/api/login/', credentials, content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['token']), (200, token))
+        response = await self.async_client.post('/api/login/', {**credentials, 'password': 'wrong'},
+                                                content_type='application/json')
+        self.assertEqual(response.json(), {'non_field_errors': ['Unable to log in with provided credentials.']})
+        response = await self.async_client.post('/api/register/', credentials, content_type='application/json')
+        self.assertIn('username', response.json())
+
+        with override_settings(PASSWORD_HASH_QUEUE=0):
+            response = await self.async_client.post('/api/login/', credentials, content_type='application/json')
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+
+
+class SignedCartTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mango = Product.objects.create(category=self.category, name='Mango', slug='mango',
+                                            price=Decimal('80.00'), stock=5)
+
+    def change(self, token, product, quantity=1, **extra):
+        return self.client.post('/api/cart/', {'token': token, 'product_id': product.id,
+                                               'quantity': quantity, **extra}, format='json')
+
+    def test_changes_run_one_select_and_no_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            first = self.change('', self.apple, 2).json()
+            second = self.change(first['token'], self.mango).json()
+            third = self.change(second['token'], self.apple, 1).json()
+        self.assertEqual(len(queries), 3)
+        self.assertTrue(all(q['sql'].startswith('SELECT') for q in queries.captured_queries))
+        self.assertNotIn('sessionid', self.client.cookies)
+        self.assertEqual([(l['name'], l['quantity'], l['line_total']) for l in third['items']],
+                         [('Apple', 3, '360.00'), ('Mango', 1, '80.00')])
+        self.assertEqual(third['subtotal'], '440.00')
+
+        token = self.change(third['token'], self.apple, 0, override_quantity=True).json()['token']
+        self.assertEqual([l['product_id'] for l in self.client.get('/api/cart/', {'token': token}).json()['items']],
+                         [self.mango.id])
+
+    def test_reprices_against_the_catalog(self):
+        token = self.change('', self.mango, 2).json()['token']
+        Product.objects.filter(id=self.mango.id).update(price=Decimal('90.00'))
+        self.assertEqual(self.client.get('/api/cart/', {'token': token}).json()['subtotal'], '180.00')
+        Product.objects.filter(id=self.mango.id).update(available=False)
+        data = self.client.get('/api/cart/', {'token': token}).json()
+        self.assertEqual((data['items'][0]['available'], data['subtotal']), (False, '0.00'))
+        self.assertEqual(self.change(token, self.mango).status_code, 400)
+
+    def test_rejects_bad_tokens(self):
+        token = self.change('', self.apple).json()['token']
+        self.assertEqual(self.client.get('/api/cart/', {'token': token[:-1] + 'x'}).json(),
+                         {'error': 'Invalid cart token'})
+        old_version = signing.dumps([0, self.apple.id, 1], salt=CART_TOKEN_SALT, compress=True)
+        self.assertEqual(self.client.get('/api/cart/', {'token': old_version}).status_code, 400)
+        with override_settings(CART_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.client.get('/api/cart/', {'token': token}).json(),
+                             {'error': 'Cart token expired'})
+
+    @override_settings(CART_MAX_ITEMS=1, CART_MAX_QUANTITY=3)
+    def test_size_limits(self):
+        token = self.change('', self.apple, 3).json()['token']
+        self.assertEqual(self.change(token, self.apple).status_code, 400)
+        self.assertEqual(self.change(token, self.mango).status_code, 400)
+        forged = signing.dumps([1, self.apple.id, 1, self.mango.id, 1], salt=CART_TOKEN_SALT, compress=True)
+        self.assertEqual(self.client.get('/api/cart/', {'token': forged}).status_code, 400)
+        with override_settings(CART_TOKEN_MAX_LENGTH=10):
+            self.assertEqual(self.client.get('/api/cart/', {'token': token}).json(),
+                             {'error': 'Cart token too long'})
+
+
+class CartQuoteTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mango = Product.objects.create(category=self.category, name='Mango', slug='mango',
+                                            price=Decimal('80.00'), stock=5)
+        self.hidden = Product.objects.create(category=self.category, name='Kiwi', slug='kiwi',
+                                             price=Decimal('30.00'), stock=5, available=False)
+
+    def quote(self, *lines):
+        return self.client.post('/api/cart/quote/', {'items': [{'product_id': pk, 'quantity': qty}
+                                                               for pk, qty in lines]}, format='json')
+
+    def test_one_query_for_the_whole_basket(self):
+        with self.assertNumQueries(1):
+            data = self.quote((self.apple.id, 2), (self.mango.id, 1), (self.apple.id, 1)).json()
+        self.assertEqual([(l['product_id'], l['quantity'], l['line_total'], l['shortfall']) for l in data['items']],
+                         [(self.apple.id, 3, '360.00', 0), (self.mango.id, 1, '80.00', 0)])
+        self.assertEqual((data['subtotal'], data['delivery_charge'], data['total'], data['orderable']),
+                         ('440.00', '40.00', '480.00', True))
+        self.assertEqual(self.quote((self.apple.id, 5)).json()['delivery_charge'], '0.00')
+
+    def test_flags_unavailable_items_and_shortfalls(self):
+        data = self.quote((self.mango.id, 8), (self.hidden.id, 1), (999999, 1)).json()
+        self.assertEqual([(l['available'], l['shortfall']) for l in data['items']],
+                         [(True, 3), (False, 0), (False, 0)])
+        self.assertEqual((data['subtotal'], data['orderable']), ('640.00', False))
+
+    def test_validation(self):
+        self.assertEqual(self.quote((self.apple.id, 0)).status_code, 400)
+        self.assertEqual(self.client.post('/api/cart/quote/', {}, format='json').status_code, 400)
+        empty = self.quote().json()
+        self.assertEqual((empty['total'], empty['orderable']), ('0.00', False))
+
+    @override_settings(CART_MAX_ITEMS=1, CART_MAX_QUANTITY=1)
+    def test_signed_cart_limits_do_not_apply(self):
+        # checkout takes baskets over the signed-cart limits, so the quote must too
+        response = self.quote((self.apple.id, 2), (self.mango.id, 1))
+        self.assertEqual((response.status_code, response.json()['orderable']), (200, True))
+
+
+class PricingRuleTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.veg = Category.objects.create(name='Vegetables', slug='vegetables')
+        self.onion = Product.objects.create(category=self.veg, name='Onion', slug='onion',
+                                            price=Decimal('50.00'), stock=100)
+
+    def tearDown(self):
+        pricing.bump_version()  # the rolled-back rules must not outlive the test
+
+    def quote(self, lines, coupon=None):
+        payload = {'items': [{'product_id': p.id, 'quantity': qty} for p, qty in lines]}
+        if coupon is not None:
+            payload['coupon'] = coupon
+        return self.client.post('/api/cart/quote/', payload, format='json')
+
+    def totals(self, lines, coupon=None):
+        data = self.quote(lines, coupon).json()
+        return data['subtotal'], data['discount'], data['delivery_charge'], data['total']
+
+    def test_delivery_thresholds_come_from_the_database(self):
+        self.assertEqual(self.totals([(self.onion, 9)]), ('450.00', '0.00', '40.00', '490.00'))
+        self.assertEqual(self.totals([(self.apple, 5)])[2], '0.00')
+        DeliveryRule.objects.filter(min_subtotal=Decimal('499.00')).update(min_subtotal=Decimal('450.00'))
+        pricing.bump_version()  # .update() sends no signal
+        self.assertEqual(self.totals([(self.onion, 9)]), ('450.00', '0.00', '0.00', '450.00'))
+
+    def test_discounts_do_not_stack(self):
+        Discount.objects.create(name='Veg week', category=self.veg, percent_off=Decimal('10'))
+        Discount.objects.create(name='Veg fest', category=self.veg, percent_off=Decimal('20'))
+        Discount.objects.create(name='Big basket', min_subtotal=Decimal('500'), amount_off=Decimal('25'))
+        Discount.objects.create(name='Bigger basket', min_subtotal=Decimal('500'), percent_off=Decimal('5'))
+        # onions 500 - 20% = 400, apples 120; basket 5% of 520 = 26 beats 25 off
+        data = self.quote([(self.onion, 10), (self.apple, 1)]).json()
+        self.assertEqual([line['discount'] for line in data['items']], ['100.00', '0.00'])
+        self.assertEqual((data['subtotal'], data['discount'], data['delivery_charge'], data['total']),
+                         ('620.00', '126.00', '40.00', '534.00'))
+
+    def test_discount_bounds(self):
+        for field, value in (('percent_off', '100.01'), ('percent_off', '-1'), ('amount_off', '-1'),
+                             ('min_subtotal', '-1')):
+            with self.assertRaises(ValidationError):
+                Discount(name='Bad', **{field: Decimal(value)}).full_clean()
+        Discount(name='Free veg', category=self.veg, percent_off=Decimal('100')).full_clean()
+
+    def test_coupons(self):
+        Discount.objects.create(name='Welcome', code='welcome', amount_off=Decimal('50'), min_subtotal=Decimal('200'))
+        Discount.objects.create(name='Fruit', code='FRUIT30', category=self.category, percent_off=Decimal('30'))
+        self.assertEqual(self.totals([(self.apple, 2)], 'Welcome'), ('240.00', '50.00', '40.00', '230.00'))
+        self.assertEqual(self.totals([(self.apple, 2)], 'fruit30'), ('240.00', '72.00', '40.00', '208.00'))
+        self.assertEqual(self.quote([(self.apple, 1)], 'WELCOME').json(),
+                         {'error': 'Coupon WELCOME needs a subtotal of at least 200.00'})
+        self.assertEqual(self.quote([(self.apple, 1)], 'nope').status_code, 400)
+        self.assertEqual(self.totals([(self.apple, 2)])[1], '0.00')  # coupons are never automatic
+
+        payload = {'full_name': 'Asha', 'phone': '9999999999', 'address': 'MG Road', 'coupon': 'welcome',
+                   'items': [{'product_id': self.apple.id, 'quantity': 2}]}
+        order = self.client.post('/api/orders/create/', payload, format='json').json()
+        self.assertEqual((order['discount'], order['coupon_code'], order['total']), ('50.00', 'WELCOME', '230.00'))
+        payload['coupon'] = 'nope'
+        self.assertEqual(self.client.post('/api/orders/create/', payload, format='json').status_code, 400)
+
+    def test_rules_recompile_on_change_and_schedule(self):
+        table = pricing.rules()
+        self.assertIs(pricing.rules(), table)
+        start = timezone.now() + timedelta(hours=1)
+        Discount.objects.create(name='Later', category=self.veg, percent_off=Decimal('10'), starts_at=start)
+        table = pricing.rules()
+        self.assertEqual(table.category_percent, {})
+        self.assertEqual(table.valid_until, start.timestamp())
+        with mock.patch('shop.pricing.time.time', return_value=start.timestamp() + 1), \
+                mock.patch('shop.pricing.timezone.now', return_value=start + timedelta(seconds=1)):
+            self.assertEqual(pricing.rules().category_percent, {self.veg.id: Decimal('10.00')})
+
+
+class OrderHistoryTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('asha', password='pw')
+        self.other = User.objects.create_user('ravi', password='pw')
+        now = timezone.now()
+        for i in range(5):
+            order = Order.objects.create(user=self.user if i < 4 else self.other, full_name='Asha',
+                                         phone='1', address='-', is_paid=i % 2 == 0)
+            Order.objects.filter(id=order.id).update(created_at=now - timedelta(days=i))
+            order.items.create(product_name='Apple', price=Decimal('120.00'), quantity=i + 1)
+
+    def test_user_sees_own_orders_newest_first_in_pages(self):
+        self.client.force_authenticate(self.user)
+        # one query for the page of orders, one for all of their items
+        with self.assertNumQueries(2):
+            first = self.client.get('/api/orders/?page_size=3').json()
+        self.assertEqual([len(o['items']) for o in first['results']], [1, 1, 1])
+        self.assertEqual([o['items'][0]['quantity'] for o in first['results']], [1, 2, 3])
+        second = self.client.get(first['next']).json()
+        self.assertEqual([o['items'][0]['quantity'] for o in second['results']], [4])
+        self.assertIsNone(second['next'])
+
+    def test_filters(self):
+        self.client.force_authenticate(self.user)
+        unpaid = self.client.get('/api/orders/?status=unpaid').json()['results']
+        self.assertEqual([o['is_paid'] for o in unpaid], [False, False])
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        recent = self.client.get(f'/api/orders/?created_after={since}').json()['results']
+        self.assertEqual(len(recent), 2)
+        self.assertEqual(self.client.get('/api/orders/?status=maybe').status_code, 400)
+        self.assertEqual(self.client.get('/api/orders/?created_before=soon').status_code, 400)
+
+    def test_staff_sees_everyone(self):
+        self.client.force_authenticate(User.objects.create_user('admin', password='pw', is_staff=True))
+        self.assertEqual(len(self.client.get('/api/orders/').json()['results']), 5)
+        only_ravi = self.client.get(f'/api/orders/?user={self.other.id}').json()['results']
+        self.assertEqual([o['user'] for o in only_ravi], [self.other.id])
+
+
+class OrderExportTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('asha', password='pw')
+        now = timezone.now()
+        for i in range(3):
+            order = Order.objects.create(user=self.user, full_name='Asha', phone='1', address='-',
+                                         is_paid=i != 1, total=Decimal('240.00'))
+            Order.objects.filter(id=order.id).update(created_at=now - timedelta(days=3 - i))
+            order.items.create(product_name='Apple', price=Decimal('120.00'), quantity=i + 1)
+        order.items.create(product_name='Pear', price=Decimal('60.00'), quantity=2)
+        self.client.force_authenticate(User.objects.create_user('admin', password='pw', is_staff=True))
+
+    def export(self, **params):
+        response = self.client.get('/api/orders/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_streams_one_row_per_item_oldest_first(self):
+        with self.assertNumQueries(1):
+            rows = list(csv.DictReader(io.StringIO(self.export())))
+        self.assertEqual([(row['product_name'], row['quantity']) for row in rows],
+                         [('Apple', '1'), ('Apple', '2'), ('Apple', '3'), ('Pear', '2')])
+        self.assertEqual(rows[3]['order_id'], rows[2]['order_id'])
+        self.assertEqual((rows[0]['total'], rows[0]['is_paid']), ('240.00', 'True'))
+
+    def test_filters_and_jsonl(self):
+        since = (timezone.now() - timedelta(days=2)).date().isoformat()
+        lines = [json.loads(line) for line in self.export(output='jsonl', status='paid',
+                                                          created_after=since).splitlines()]
+        self.assertEqual([(line['product_name'], line['price']) for line in lines],
+                         [('Apple', '120.00'), ('Pear', '60.00')])
+        self.assertEqual(self.client.get('/api/orders/export/', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/orders/export/', {'created_before': 'soon'}).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/orders/export/').status_code, 403)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_orders', '--status', 'unpaid', stdout=out)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual([(row['product_name'], row['is_paid']) for row in rows], [('Apple', 'False')])
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        authentication.token_cache.clear()
+        authentication.token_cache.reset_stats()
+        self.user = User.objects.create_user('asha', password='pw')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def auth_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/orders/')
+        return response.status_code, sum('authtoken_token' in q['sql'] for q in queries.captured_queries)
+
+    def test_warm_cache_runs_no_auth_query(self):
+        self.assertEqual(self.auth_queries(), (200, 1))
+        self.assertEqual(self.auth_queries(), (200, 0))
+        self.assertEqual(self.auth_queries(), (200, 0))
+        stats = authentication.token_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (2, 1, 0.6667))
+
+    def test_deactivated_user_is_rejected(self):
+        self.auth_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/orders/').status_code, 401)
+
+    def test_deleted_and_rotated_tokens_are_rejected(self):
+        self.auth_queries()
+        self.token.delete()
+        new = Token.objects.create(user=self.user)
+        self.assertEqual(self.client.get('/api/orders/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {new.key}')
+        self.assertEqual(self.client.get('/api/orders/').status_code, 200)
+
+    @override_settings(AUTH_CACHE_MAX_ENTRIES=2, AUTH_CACHE_TTL=0)
+    def test_lru_bound_and_ttl(self):
+        users = [User.objects.create_user(f'u{i}', password='pw') for i in range(3)]
+        authentication.token_cache.ensure_current()
+        for user in users:
+            authentication.token_cache.put(f'k{user.pk}', user, None)
+        self.assertEqual(authentication.token_cache.stats()['evictions'], 1)
+        self.assertIsNone(authentication.token_cache.get(f'k{users[-1].pk}'))
+        self.assertEqual(authentication.token_cache.stats()['expired'], 1)
+
+
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        hashing.pool.reset_stats()
+        self.client = APIClient()
+
+    @override_settings(PASSWORD_HASH_WORKERS=1)
+    def test_register_and_login_through_pool(self):
+        credentials = {'username': 'asha', 'password': 'secret-pw'}
+        response = self.client.post('/api/register/', credentials, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('hash;dur=', response['Server-Timing'])
+        self.assertTrue(User.objects.get(username='asha').check_password('secret-pw'))
+
+        response = self.client.post('/api/login/', credentials, format='json')
+        self.assertEqual(response.json()['token'], Token.objects.get(user__username='asha').key)
+        self.assertEqual(self.client.post('/api/login/', {**credentials, 'password': 'no'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/login/', {**credentials, 'username': 'nobody'}).status_code, 400)
+        stats = hashing.pool.stats()
+        self.assertEqual((stats['completed'], stats['rejected'], stats['in_flight']), (4, 0, 0))
+
+    @override_settings(PASSWORD_HASH_QUEUE=0)
+    def test_saturated_pool_fails_fast(self):
+        User.objects.create_user('asha', password='secret-pw')
+        response = self.client.post('/api/login/', {'username': 'asha', 'password': 'secret-pw'}, format='json')
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+        response = self.client.post('/api/register/', {'username': 'ravi', 'password': 'pw'}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(User.objects.filter(username='ravi').exists())
+        self.assertEqual(hashing.pool.stats()['rejected'], 2)
+
+    @override_settings(PASSWORD_HASH_WORKERS=0)
+    def test_outdated_hash_is_upgraded_on_login(self):
+        user = User.objects.create_user('asha')
+        user.password = PBKDF2PasswordHasher().encode('secret-pw', 'somesalt', iterations=1000)
+        user.save()
+        response = self.client.post('/api/login/', {'username': 'asha', 'password': 'secret-pw'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        self.assertFalse(PBKDF2PasswordHasher().must_update(user.password))
+        self.assertTrue(user.check_password('secret-pw'))
+
+
+class StockReservationTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('asha', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def order(self, quantity):
+        payload = {
+            'full_name': 'Asha', 'phone': '9999999999', 'address': 'MG Road',
+            'items': [{'product_id': self.apple.id, 'quantity': quantity}],
+        }
+        return self.client.post('/api/orders/create/', payload, format='json')
+
+    def expire_holds(self):
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_oversell_is_rejected_and_rolled_back(self):
+        self.assertEqual(self.order(30).status_code, 201)
+        self.assertEqual(self.order(30).status_code, 400)
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.stock, 20)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(StockReservation.objects.get().quantity, 30)
+
+    def test_expired_holds_return_to_stock(self):
+        self.order(30)
+        self.assertEqual(inventory.release_expired(), 0)
+        self.expire_holds()
+        self.assertEqual(inventory.release_expired(), 1)
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.stock, 50)
+        self.assertEqual(StockReservation.objects.get().status, StockReservation.RELEASED)
+
+    def test_payment_consumes_hold(self):
+        order_id = self.order(30).json()['id']
+        response = self.client.post(f'/api/orders/{order_id}/pay/', {'txn_id': 'T1'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StockReservation.objects.get().status, StockReservation.CONSUMED)
+        self.expire_holds()
+        self.assertEqual(inventory.release_expired(), 0)
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.stock, 20)
+
+    def test_payment_after_release_retakes_stock_or_conflicts(self):
+        first = self.order(30).json()['id']
+        self.expire_holds()
+        inventory.release_expired()
+        second = self.order(40).json()['id']
+        response = self.client.post(f'/api/orders/{first}/pay/', {'txn_id': 'T1'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.get(id=first).is_paid)
+        response = self.client.post(f'/api/orders/{second}/pay/', {'txn_id': 'T2'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.stock, 10)
+
+    @override_settings(CATALOG_STOCK_INTERVAL=0)
+    def test_stock_moves_invalidate_cached_listings(self):
+        self.client.get('/api/products/')
+        version = catalog_cache.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order(30)
+        self.assertEqual(self.client.get('/api/products/').json()[0]['stock'], 20)
+        self.assertEqual(catalog_cache.get_version(), version)  # the typeahead index stays current
+        self.expire_holds()
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.release_expired()
+        self.assertEqual(self.client.get('/api/products/').json()[0]['stock'], 50)
+
+    @override_settings(CATALOG_STOCK_INTERVAL=60)
+    def test_stock_moves_refresh_listings_once_per_interval(self):
+        window = (catalog_cache._now_ms() // 60000 + 1) * 60000
+        with mock.patch.object(catalog_cache, '_now_ms', return_value=window + 1000):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.order(1)
+            self.client.get('/api/products/')
+            catalog_cache.reset_stats()
+            for _ in range(20):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.order(1)
+                self.assertEqual(self.client.get('/api/products/').json()[0]['stock'], 49)
+            self.assertEqual(catalog_cache.stats()['hit_rate'], 1.0)
+        with mock.patch.object(catalog_cache, '_now_ms', return_value=window + 60000):
+            self.assertEqual(self.client.get('/api/products/').json()[0]['stock'], 29)
+            self.assertEqual(catalog_cache.stats()['misses'], 1)
+
+
+class PaymentReconciliationTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.orders = [place_order({'full_name': 'Asha', 'phone': '1', 'address': '-',
+                                    'items': [{'product_id': self.apple.id, 'quantity': n}]}) for n in (1, 2, 3)]
+        self.client.force_authenticate(User.objects.create_user('admin', password='pw', is_staff=True))
+
+    def record(self, order, txn_id, amount=None):
+        return {'order_id': order.id, 'txn_id': txn_id, 'amount': str(order.total if amount is None else amount)}
+
+    def test_pays_matches_in_bulk_and_reports_the_rest(self):
+        first, second, third = self.orders
+        Order.objects.filter(id=third.id).update(is_paid=True, payment_txn_id='T3')
+        before = first.updated_at
+        records = [
+            self.record(first, 'T1'),
+            self.record(second, 'T2', second.total + 1),
+            {'order_id': 999999, 'txn_id': 'T4', 'amount': '10'},
+            self.record(first, 'T5'),
+            self.record(third, 'T3'),
+            {'order_id': 'x', 'txn_id': 'T6', 'amount': '10'},
+        ]
+        response = self.client.post('/api/payments/reconcile/', {'records': records}, format='json')
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        self.assertEqual((stats['rows'], stats['paid'], stats['reconciled'], stats['mismatched']), (6, 1, 1, 4))
+        self.assertEqual([(m['row'], m['reason']) for m in stats['mismatches']],
+                         [(2, 'amount_mismatch'), (3, 'not_found'), (4, 'duplicate'), (6, 'invalid')])
+
+        first.refresh_from_db()
+        self.assertEqual((first.is_paid, first.payment_txn_id), (True, 'T1'))
+        self.assertGreater(first.updated_at, before)
+        self.assertEqual(first.reservations.get().status, StockReservation.CONSUMED)
+        self.assertFalse(Order.objects.get(id=second.id).is_paid)
+        self.assertEqual(Order.objects.get(id=second.id).reservations.get().status, StockReservation.HELD)
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def queries(orders, prefix):
+            with CaptureQueriesContext(connection) as captured:
+                payments.Reconciler().run([self.record(order, f'{prefix}{order.id}') for order in orders])
+            return len(captured)
+
+        more = [place_order({'full_name': 'Asha', 'phone': '1', 'address': '-',
+                             'items': [{'product_id': self.apple.id, 'quantity': 1}]}) for _ in range(5)]
+        self.assertEqual(queries(self.orders[:1], 'A'), queries(more, 'B'))
+        self.assertEqual(Order.objects.filter(is_paid=True).count(), 6)
+
+    def test_expired_hold_without_stock_is_a_mismatch(self):
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        inventory.release_expired()
+        Product.objects.filter(id=self.apple.id).update(stock=1)
+        stats = payments.Reconciler().run([self.record(self.orders[0], 'T1'), self.record(self.orders[1], 'T2')])
+        self.assertEqual((stats['paid'], stats['reasons']['out_of_stock']), (1, 1))
+        self.assertEqual(Order.objects.filter(is_paid=True).get().id, self.orders[0].id)
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.stock, 0)
+
+    def test_records_that_are_not_objects_are_invalid(self):
+        records = [self.record(self.orders[0], 'T1'), [1, 2], 'x']
+        stats = self.client.post('/api/payments/reconcile/', {'records': records}, format='json').json()
+        self.assertEqual((stats['paid'], stats['reasons']['invalid']), (1, 2))
+
+        upload = SimpleUploadedFile('settlement.jsonl', (json.dumps(self.record(self.orders[1], 'T2')) + '\n'
+                                                         '[1, 2]\n{"order_id": 1\n').encode())
+        response = self.client.post('/api/payments/reconcile/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(m['row'], m['reason']) for m in response.json()['mismatches']],
+                         [(2, 'invalid'), (3, 'invalid')])
+        self.assertEqual(response.json()['paid'], 1)
+
+    def test_file_upload_command_and_staff_only(self):
+        upload = SimpleUploadedFile('settlement.csv', f'order_id,txn_id,amount\n{self.orders[0].id},T1,'
+                                                      f'{self.orders[0].total}\n'.encode())
+        stats = self.client.post('/api/payments/reconcile/', {'file': upload}, format='multipart').json()
+        self.assertEqual(stats['paid'], 1)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settlement, report = os.path.join(directory, 'settlement.jsonl'), os.path.join(directory, 'report.csv')
+        with open(settlement, 'w') as fh:
+            fh.writelines(json.dumps(self.record(order, f'T{n}', amount)) + '\n'
+                          for n, (order, amount) in enumerate([(self.orders[1], None), (self.orders[2], 1)], 2))
+        out = io.StringIO()
+        call_command('reconcile_payments', settlement, '--report', report, stdout=out)
+        self.assertIn('1 paid, 0 already reconciled, 1 mismatched (1 amount_mismatch)', out.getvalue())
+        with open(report) as fh:
+            self.assertEqual([row['reason'] for row in csv.DictReader(fh)], ['amount_mismatch'])
+
+        self.client.force_authenticate(User.objects.create_user('asha', password='pw'))
+        self.assertEqual(self.client.post('/api/payments/reconcile/', {'records': []}, format='json').status_code, 403)
+
+
+class IdempotencyTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.payload = {'full_name': 'Asha', 'phone': '1', 'address': '-',
+                        'items': [{'product_id': self.apple.id, 'quantity': 2}]}
+
+    def create(self, key, payload=None):
+        return self.client.post('/api/orders/create/', payload or self.payload, format='json',
+                                headers={'Idempotency-Key': key})
+
+    def test_retried_order_is_answered_from_the_store(self):
+        first = self.create('k1')
+        with self.assertNumQueries(1):
+            retry = self.create('k1')
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(Order.objects.count(), 1)
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.stock, 48)
+
+        self.assertEqual(self.create('k2').status_code, 201)
+        self.assertEqual(self.client.post('/api/orders/create/', self.payload, format='json').status_code, 201)
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual(self.create('k1', {**self.payload, 'phone': '2'}).status_code, 422)
+        self.assertEqual(self.create('x' * 256).status_code, 400)
+
+    def test_payment_retries_are_scoped_to_the_user(self):
+        asha, ravi = User.objects.create_user('asha'), User.objects.create_user('ravi')
+        orders = {}
+        for user in (asha, ravi):
+            self.client.force_authenticate(user)
+            orders[user] = self.create('checkout').json()['id']
+        self.assertEqual(Order.objects.count(), 2)
+
+        pay = f'/api/orders/{orders[ravi]}/pay/'
+        first = self.client.post(pay, {'txn_id': 'T1'}, format='json', headers={'Idempotency-Key': 'pay'})
+        with self.assertNumQueries(1):
+            retry = self.client.post(pay, {'txn_id': 'T1'}, format='json', headers={'Idempotency-Key': 'pay'})
+        self.assertEqual((first.status_code, retry.status_code, retry.json()), (200, 200, first.json()))
+        self.assertEqual(Order.objects.get(id=orders[ravi]).payment_txn_id, 'T1')
+
+    def test_errors_are_not_stored(self):
+        with mock.patch('shop.endpoints.place_order', side_effect=[OrderError('out of stock'), RuntimeError]):
+            self.assertEqual(self.create('k1').status_code, 400)
+            with self.assertRaises(RuntimeError):
+                self.create('k2')
+        retry = self.create('k1')  # e.g. once the stock is back
+        self.assertEqual(retry.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', retry)
+        self.assertEqual(self.create('k2').status_code, 201)
+
+    def test_replays_the_headers_the_view_set(self):
+        calls = []
+
+        class View:
+            @idempotency.idempotent
+            def post(self, request):
+                calls.append(request)
+                return Response({'id': 7}, status=201, headers={'Location': '/api/orders/7/', 'Retry-After': '5'})
+
+        def post():
+            request = APIRequestFactory().post('/api/things/', {'a': 1}, format='json',
+                                               headers={'Idempotency-Key': 'k1'})
+            return View().post(Request(request))
+
+        first, retry = post(), post()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((retry.status_code, retry.data, retry['Idempotent-Replayed']), (201, {'id': 7}, 'true'))
+        self.assertEqual((retry['Location'], retry['Retry-After']), (first['Location'], first['Retry-After']))
+
+    def test_duplicate_committed_meanwhile_is_replayed(self):
+        first = self.create('k1')
+        # as if a concurrent request had committed between the lookup and the insert
+        with mock.patch.object(IdempotencyKey.objects, 'filter', return_value=IdempotencyKey.objects.none()):
+            retry = self.create('k1')
+        self.assertEqual((retry.status_code, retry.json(), retry['Idempotent-Replayed']), (201, first.json(), 'true'))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_keys_are_replaced_and_purged(self):
+        self.create('k1')
+        self.create('k2')
+        IdempotencyKey.objects.filter(key='k1').update(created_at=timezone.now() - timedelta(days=2))
+        response = self.create('k1')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.count(), 3)
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(idempotency.purge_expired(), 2)
+
+
+class ProductListPaginationTests(CatalogFixtureMixin, TestCase):
+    def test_unpaginated_by_default(self):
+        self.assertIsInstance(self.client.get('/api/products/').json(), list)
+
+    def test_cursor_pages_are_stable_under_inserts(self):
+        for i in range(4):
+            Product.objects.create(category=self.category, name=f'Pear {i}', slug=f'pear-{i}', price=Decimal('10.00'))
+        first = self.client.get('/api/products/?page_size=2').json()
+        self.assertEqual([p['name'] for p in first['results']], ['Apple', 'Pear 0'])
+        Product.objects.create(category=self.category, name='Plum', slug='plum', price=Decimal('10.00'))
+        second = self.client.get(first['next']).json()
+        self.assertEqual([p['name'] for p in second['results']], ['Pear 1', 'Pear 2'])
+
+    def test_field_projection(self):
+        response = self.client.get('/api/products/?fields=id,name,price,image_url')
+        self.assertEqual(list(response.json()[0]), ['id', 'name', 'price', 'image_url'])
+        self.assertEqual(self.client.get('/api/products/?fields=id,secret').status_code, 400)
+
+
+class FastSerializerTests(CatalogFixtureMixin, TestCase):
+    def test_matches_drf_serializers_byte_for_byte(self):
+        Product.objects.create(
+            category=self.category, name='Mango', slug='mango', price=Decimal('75.5'),
+            image='products/mango.jpg', image_url='https://cdn.example.com/mango.jpg', available=True,
+        )
+        Product.objects.filter(slug='mango').update(image_derivatives=images.derivatives_root('products/mango.jpg'))
+        self.category.image = 'categories/fruits.png'
+        self.category.save()
+        Category.objects.update(image_derivatives=images.derivatives_root('categories/fruits.png'))
+        request = APIRequestFactory().get('/api/products/')
+        renderer = JSONRenderer()
+        queryset = Product.objects.order_by('id')
+
+        expected = ProductSerializer(queryset, many=True, context={'request': Request(request)}).data
+        actual = serialize_products(product_values(queryset), request)
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+        fields = ['id', 'name', 'price', 'image_url']
+        expected = ProductSerializer(queryset, many=True, fields=fields).data
+        actual = serialize_products(product_values(queryset, fields), fields=fields)
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+        expected = CategorySerializer(Category.objects.all(), many=True, context={'request': Request(request)}).data
+        actual = serialize_categories(Category.objects.all(), request)
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+    def test_product_list_is_one_query(self):
+        Product.objects.create(category=self.category, name='Mango', slug='mango', price=Decimal('75.00'))
+        with self.assertNumQueries(1):
+            self.client.get('/api/products/')
+
+
+def image_upload(name, size, mode='RGB'):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 40, 40, 128) if mode == 'RGBA' else (200, 40, 40)).save(
+        buffer, 'PNG' if mode == 'RGBA' else 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@override_settings(IMAGE_WORKERS=0, IMAGE_THUMBNAIL_WIDTHS=[160, 320, 640])
+class ImageThumbnailTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_root = override_settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def test_upload_renders_thumbnails_after_commit(self):
+        from PIL import Image
+
+        self.apple.image = image_upload('apple.jpg', (800, 400))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.apple.save()
+        self.apple.refresh_from_db()
+        derivatives = self.apple.image_derivatives
+        self.assertTrue(images.is_current(self.apple.image.name, derivatives))
+        for width, fmt in [(640, 'webp'), (320, 'jpeg'), (160, 'webp')]:
+            with default_storage.open(images.derivative_name(derivatives, width, fmt)) as fh:
+                self.assertEqual(Image.open(fh).size, (width, width // 2))
+
+        thumbnails = self.client.get(f'/api/products/{self.apple.pk}/').json()['thumbnails']
+        self.assertEqual(thumbnails['webp']['320'], f'http://testserver/media/derivatives/{derivatives}-320w.webp')
+        self.assertTrue(media.UNIQUE_NAME.search(thumbnails['webp']['320']))
+        self.assertEqual(list(thumbnails['jpeg']), ['160', '320', '640'])
+
+        # a new image has no thumbnails until its own are rendered
+        self.apple.image = image_upload('apple-2.png', (100, 100), 'RGBA')
+        self.apple.save()
+        self.assertEqual(self.apple.image_derivatives, '')
+        self.assertIsNone(self.client.get(f'/api/products/{self.apple.pk}/').json()['thumbnails'])
+
+    def test_small_and_transparent_images_are_not_upscaled(self):
+        from PIL import Image
+
+        self.category.image = image_upload('fruits.png', (200, 100), 'RGBA')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.category.refresh_from_db()
+        derivatives = self.category.image_derivatives
+        with default_storage.open(images.derivative_name(derivatives, 640, 'jpeg')) as fh:
+            self.assertEqual((Image.open(fh).size, Image.open(fh).mode), ((200, 100), 'RGB'))
+        with default_storage.open(images.derivative_name(derivatives, 160, 'webp')) as fh:
+            self.assertEqual(Image.open(fh).size, (160, 80))
+        self.assertIsNotNone(self.client.get('/api/categories/').json()[0]['thumbnails'])
+
+    def test_backfill_command(self):
+        names = [default_storage.save(f'products/p{i}.jpg', image_upload(f'p{i}.jpg', (400, 300))) for i in range(3)]
+        Product.objects.filter(pk=self.apple.pk).update(image=names[0])
+        for i, name in enumerate(names[1:], 1):
+            Product.objects.create(category=self.category, name=f'P{i}', slug=f'p{i}', price=Decimal('1.00'))
+            Product.objects.filter(slug=f'p{i}').update(image=name)
+        Product.objects.create(category=self.category, name='Lost', slug='lost', price=Decimal('1.00'))
+        Product.objects.filter(slug='lost').update(image='products/missing.jpg')
+
+        out, err = io.StringIO(), io.StringIO()
+        # threads stand in for the process pool, which would not see the test MEDIA_ROOT
+        with mock.patch.object(images, '_pool', lambda workers=None: ThreadPoolExecutor(workers)):
+            call_command('generate_thumbnails', '--workers', '2', stdout=out, stderr=err)
+            self.assertIn('4 images', out.getvalue())
+            self.assertIn('3 rendered, 1 failed', out.getvalue())
+            self.assertIn('products/missing.jpg', err.getvalue())
+            self.assertEqual(Product.objects.exclude(image_derivatives='').count(), 3)
+
+            out = io.StringIO()
+            call_command('generate_thumbnails', stdout=out, stderr=io.StringIO())
+            self.assertIn('1 images', out.getvalue())
+
+    def test_rerendering_never_reuses_a_name(self):
+        self.apple.image = image_upload('apple.jpg', (800, 400))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.apple.save()
+        self.apple.refresh_from_db()
+        first = self.apple.image_derivatives
+        old = images.derivative_name(first, 320, 'webp')
+        with default_storage.open(old) as fh:
+            before = fh.read()
+
+        with mock.patch.object(images, '_pool', lambda workers=None: ThreadPoolExecutor(workers)):
+            call_command('generate_thumbnails', '--force', stdout=io.StringIO(), stderr=io.StringIO())
+            self.apple.refresh_from_db()
+            second = self.apple.image_derivatives
+            self.assertNotEqual(second, first)
+            self.assertTrue(default_storage.exists(images.derivative_name(second, 320, 'webp')))
+            with default_storage.open(old) as fh:
+                self.assertEqual(fh.read(), before)
+
+            # other settings: no thumbnails until they are rendered again, under new names
+            with override_settings(IMAGE_THUMBNAIL_WIDTHS=[160, 320, 640, 1280]):
+                self.assertIsNone(self.client.get(f'/api/products/{self.apple.pk}/').json()['thumbnails'])
+                out = io.StringIO()
+                call_command('generate_thumbnails', stdout=out, stderr=io.StringIO())
+                self.assertIn('1 rendered', out.getvalue())
+                thumbnails = self.client.get(f'/api/products/{self.apple.pk}/').json()['thumbnails']
+                self.assertEqual(list(thumbnails['webp']), ['160', '320', '640', '1280'])
+                self.assertNotIn(second, thumbnails['webp']['320'])
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        media_root = override_settings(MEDIA_ROOT=self.root, MEDIA_ACCEL='')
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        os.makedirs(os.path.join(self.root, 'products'))
+        self.body = bytes(range(256)) * 4
+        for name in ['products/apple.0123456789ab.jpg', 'products/legacy.jpg']:
+            with open(os.path.join(self.root, name), 'wb') as fh:
+                fh.write(self.body)
+
+    def get(self, path, **headers):
+        response = self.client.get(f'/media/{path}', headers=headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def test_caching_headers_and_revalidation(self):
+        response, content = self.get('products/apple.0123456789ab.jpg')
+        self.assertEqual((response.status_code, content, response['Content-Type']), (200, self.body, 'image/jpeg'))
+        self.assertEqual(response['Cache-Control'], media.IMMUTABLE)
+        self.assertEqual(response['Content-Length'], str(len(self.body)))
+        self.assertEqual(self.get('products/legacy.jpg')[0]['Cache-Control'], 'public, max-age=3600')
+
+        revalidated, content = self.get('products/apple.0123456789ab.jpg', if_none_match=response['ETag'])
+        self.assertEqual((revalidated.status_code, content, revalidated['ETag']), (304, b'', response['ETag']))
+        revalidated, _ = self.get('products/apple.0123456789ab.jpg', if_modified_since=response['Last-Modified'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        self.assertEqual(self.get('products/missing.jpg')[0].status_code, 404)
+        self.assertEqual(self.get('products')[0].status_code, 404)
+        self.assertEqual(self.get('../products/legacy.jpg')[0].status_code, 404)
+        self.assertEqual(self.client.post('/media/products/legacy.jpg').status_code, 405)
+
+    def test_byte_ranges(self):
+        response, content = self.get('products/legacy.jpg', range='bytes=2-5')
+        self.assertEqual((response.status_code, content, response['Content-Range']), (206, self.body[2:6], 'bytes 2-5/1024'))
+        response, content = self.get('products/legacy.jpg', range='bytes=-10')
+        self.assertEqual((response.status_code, content, response['Content-Length']), (206, self.body[-10:], '10'))
+        response, content = self.get('products/legacy.jpg', range='bytes=1000-')
+        self.assertEqual(content, self.body[1000:])
+        response, _ = self.get('products/legacy.jpg', range='bytes=2000-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1024'))
+        # several ranges, or a stale If-Range: the whole file
+        self.assertEqual(self.get('products/legacy.jpg', range='bytes=0-1,5-6')[1], self.body)
+        self.assertEqual(self.get('products/legacy.jpg', range='bytes=0-1', if_range='"stale"')[1], self.body)
+
+    def test_precompressed_variant(self):
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg">' + b' ' * 500 + b'</svg>'
+        with open(os.path.join(self.root, 'logo.svg'), 'wb') as fh:
+            fh.write(svg)
+        with open(os.path.join(self.root, 'logo.svg.gz'), 'wb') as fh:
+            fh.write(gzip.compress(svg))
+        response, content = self.get('logo.svg', accept_encoding='gzip, deflate')
+        self.assertEqual((response['Content-Encoding'], response['Content-Type']), ('gzip', 'image/svg+xml'))
+        self.assertEqual(gzip.decompress(content), svg)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        plain, content = self.get('logo.svg')
+        self.assertEqual(content, svg)
+        self.assertNotEqual(plain['ETag'], response['ETag'])
+
+    def test_proxy_hand_off(self):
+        with override_settings(MEDIA_ACCEL='x-accel-redirect'):
+            response, content = self.get('products/legacy.jpg')
+            self.assertEqual((response['X-Accel-Redirect'], content), ('/protected-media/products/legacy.jpg', b''))
+            self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        with override_settings(MEDIA_ACCEL='x-sendfile'):
+            response, _ = self.get('products/legacy.jpg')
+            self.assertEqual(response['X-Sendfile'], os.path.join(self.root, 'products', 'legacy.jpg'))
+
+    def test_uploads_get_unique_immutable_names(self):
+        upload_to = Product._meta.get_field('image').upload_to
+        first, second = upload_to(None, 'Mango.JPG'), upload_to(None, 'Mango.JPG')
+        self.assertNotEqual(first, second)
+        self.assertRegex(first, r'^products/Mango\.[0-9a-f]{12}\.jpg$')
+        self.assertEqual(media.cache_control(first), media.IMMUTABLE)
+        self.assertEqual(media.cache_control(images.derivative_name(first, 160, 'webp')), media.IMMUTABLE)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_LAG_SECONDS=5)
+class ReplicaRouterTests(SharedCacheMixin, TransactionTestCase):
+    """The replica is a copy of the test database in a second SQLite file, taken in setUp and never updated."""
+    databases = '__all__'  # resolved in setUpClass, once replica1 exists
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        connections.settings['replica1'] = {**connection.settings_dict,
+                                            'NAME': os.path.join(cls.directory, 'replica.sqlite3')}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica1'].close()
+        del connections['replica1']
+        del connections.settings['replica1']
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Fruits', slug='fruits')
+        self.apple = Product.objects.create(category=self.category, name='Apple', slug='apple',
+                                            price=Decimal('120.00'), stock=50)
+        connections['replica1'].close()
+        connection.ensure_connection()
+        replica = sqlite3.connect(connections['replica1'].settings_dict['NAME'])
+        connection.connection.backup(replica)
+        replica.close()
+
+        # written after the copy, without a signal: only the primary has it
+        Product.objects.bulk_create([Product(category=self.category, name='Pear', slug='pear',
+                                             price=Decimal('60.00'), stock=5)])
+        self.age_catalog(60)
+        self.client = APIClient()
+
+    @staticmethod
+    def age_catalog(seconds):
+        """Last catalog and stock change `seconds` ago; a new version, so payloads are built again."""
+        version = int(time.time() * 1000) - seconds * 1000
+        cache.set_many({catalog_cache.VERSION_KEY: version, catalog_cache.STOCK_VERSION_KEY: version}, timeout=None)
+
+    def names(self, client=None):
+        return [p['name'] for p in (client or self.client).get('/api/products/').json()]
+
+    def test_catalog_reads_go_to_the_replica(self):
+        self.assertEqual(self.names(), ['Apple'])
+        self.assertEqual(self.client.get(f'/api/products/{Product.objects.get(slug="pear").pk}/').status_code, 404)
+        self.assertEqual([c['name'] for c in self.client.get('/api/categories/').json()], ['Fruits'])
+        # outside the catalog views, and for other models, reads stay on the primary
+        self.assertEqual(Product.objects.count(), 2)
+        with routers.replica_reads():
+            self.assertIsNone(routers.ReplicaRouter().db_for_read(Order))
+            self.assertEqual(routers.ReplicaRouter().db_for_read(Product), 'replica1')
+            with transaction.atomic():
+                self.assertIsNone(routers.ReplicaRouter().db_for_read(Product))
+
+    def test_writers_are_pinned_to_the_primary(self):
+        response = self.client.post('/api/orders/create/', {
+            'full_name': 'Asha', 'phone': '9999999999', 'address': 'MG Road',
+            'items': [{'product_id': self.apple.pk, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], 5)
+        self.age_catalog(60)
+        self.assertEqual(self.names(APIClient()), ['Apple'])
+        self.age_catalog(61)
+        self.assertEqual(self.names(), ['Apple', 'Pear'])  # the cookie came back
+
+    @override_settings(CATALOG_STOCK_INTERVAL=0)
+    def test_fresh_catalog_changes_are_read_from_the_primary(self):
+        catalog_cache.bump_version()
+        self.assertEqual(self.names(), ['Apple', 'Pear'])
+        self.age_catalog(60)
+        catalog_cache.bump_stock_version()
+        self.assertEqual(self.names(), ['Apple', 'Pear'])
+
+    def test_no_replica_reads_on_a_per_process_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.age_catalog(60)
+            self.assertEqual(self.names(), ['Apple', 'Pear'])
+
+
+class ProductSearchTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(category=self.category, name='Apple Juice', slug='apple-juice', price=Decimal('90.00'))
+        Product.objects.create(
+            category=self.category, name='Fruit Basket', slug='fruit-basket', price=Decimal('300.00'),
+            description='Seasonal fruit with a green apple or two',
+        )
+
+    def names(self, query):
+        return [p['name'] for p in self.client.get('/api/products/', {'q': query}).json()]
+
+    def test_ranks_name_matches_above_description(self):
+        self.assertEqual(self.names('apple')[-1], 'Fruit Basket')
+        self.assertEqual(len(self.names('apple')), 3)
+
+    def test_prefix_and_typo_matching(self):
+        self.assertEqual(self.names('juic'), ['Apple Juice'])
+        self.assertEqual(self.names('baskt'), ['Fruit Basket'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.apple.name = 'Banana'
+        self.apple.description = 'Ripe and yellow'
+        self.apple.save()
+        self.assertNotIn('Banana', self.names('apple'))
+        self.assertEqual(self.names('banana'), ['Banana'])
+        self.apple.delete()
+        self.assertEqual(self.names('banana'), [])
+
+    def test_falls_back_to_icontains_without_index(self):
+        with mock.patch.object(search, 'index_available', return_value=False):
+            self.assertEqual(self.names('juice'), ['Apple Juice'])
+
+    def test_pages_follow_rank_order_without_truncation(self):
+        Product.objects.bulk_create([
+            Product(category=self.category, name=f'Basket {n}', slug=f'basket-{n}', price=Decimal('10.00'),
+                    description='apple ' * (n % 3 + 1)) for n in range(250)
+        ])
+        search.reindex_all()
+        ranked = self.names('apple')
+        self.assertEqual(len(ranked), 253)
+        self.assertEqual(sorted(ranked[:2]), ['Apple', 'Apple Juice'])  # name matches first
+
+        paged, url = [], '/api/products/?q=apple&page_size=40'
+        while url:
+            body = self.client.get(url).json()
+            self.assertIsNone(body['previous'])
+            paged += [p['name'] for p in body['results']]
+            url = body['next']
+        self.assertEqual(paged, ranked)
+
+        typo = self.client.get('/api/products/', {'q': 'baskt', 'page_size': 200}).json()
+        self.assertEqual(len(typo['results']) + len(self.client.get(typo['next']).json()['results']), 251)
+
+
+@override_settings(SUGGEST_REFRESH_SECONDS=0)
+class ProductSuggestTests(CatalogFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(category=self.category, name='Crème Apple Juice', slug='apple-juice', price=Decimal('90.00'))
+        Product.objects.create(category=self.category, name='Pineapple', slug='pineapple', price=Decimal('60.00'))
+        suggest_index.build()
+
+    def suggest(self, q):
+        return self.client.get('/api/products/suggest/', {'q': q}).json()
+
+    def test_whole_name_matches_come_first(self):
+        self.assertEqual(
+            self.suggest('app'),
+            [{'id': self.apple.id, 'name': 'Apple', 'price': '120.00'},
+             {'id': self.apple.id + 1, 'name': 'Crème Apple Juice', 'price': '90.00'}],
+        )
+        self.assertEqual([p['name'] for p in self.suggest('creme')], ['Crème Apple Juice'])
+
+    def test_incremental_updates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.apple.name = 'Avocado'
+            self.apple.save()
+        version = suggest_index.version
+        self.assertEqual([p['name'] for p in self.suggest('avo')], ['Avocado'])
+        self.assertEqual(suggest_index.version, version)  # applied in place, no rebuild
+        with self.captureOnCommitCallbacks(execute=True):
+            self.apple.delete()
+        self.assertEqual(self.suggest('avo'), [])
+
+    def test_catches_up_with_writes_from_other_processes(self):
+        # as if another worker had written: the rows, tombstone and version change, but not this index
+        Product.objects.filter(pk=self.apple.pk).update(name='Apricot', updated_at=timezone.now())
+        Product.objects.get(slug='pineapple').delete()  # its on_commit index update never runs in a TestCase
+        catalog_cache.bump_version()
+        with mock.patch.object(suggest_index, 'build') as build:
+            self.assertEqual([p['name'] for p in self.suggest('apr')], ['Apricot'])
+            self.assertEqual(self.suggest('pine'), [])
+        build.assert_not_called()
+
+    def test_rebuilds_after_large_changes(self):
+        Product.objects.filter(pk=self.apple.pk).update(name='Apricot', updated_at=timezone.now())
+        catalog_cache.bump_version()
+        with mock.patch('shop.suggest.MAX_INCREMENTAL', 0), \
+                mock.patch.object(suggest_index, 'build', wraps=suggest_index.build) as build:
+            self.assertEqual([p['name'] for p in self.suggest('apr')], ['Apricot'])
+        build.assert_called_once()
+
+
+class ConditionalGetTests(SharedCacheMixin, CatalogFixtureMixin, TestCase):
+    def test_catalog_list_304_without_queries(self):
+        response = self.client.get('/api/products/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get('/api/products/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_params_and_writes(self):
+        etag = self.client.get('/api/products/')['ETag']
+        self.assertNotEqual(self.client.get('/api/products/?q=apple')['ETag'], etag)
+        self.apple.save()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(CATALOG_STOCK_INTERVAL=0)
+    def test_etag_changes_with_stock(self):
+        etag = self.client.get('/api/products/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            inventory.take_stock({self.apple.id: 5})
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()[0]['stock']), (200, 45))
+
+    def test_no_catalog_validators_on_a_per_process_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_order_detail(self):
+        user = User.objects.create_user('asha', password='pw')
+        order = Order.objects.create(user=user, full_name='Asha', phone='1', address='x')
+        self.client.force_authenticate(user)
+        etag = self.client.get(f'/api/orders/{order.id}/')['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/orders/{order.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        order.is_paid = True
+        order.save()
+        self.assertEqual(self.client.get(f'/api/orders/{order.id}/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/orders/999/', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+
+@override_settings(CATALOG_CHANGES_LAG=0, CATALOG_CHANGES_PAGE_SIZE=2)
+class ProductChangesTests(CatalogFixtureMixin, TestCase):
+    def sync(self, token=None):
+        params = {'since': token} if token else {}
+        response = self.client.get('/api/products/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_snapshot_then_deltas(self):
+        pear = Product.objects.create(category=self.category, name='Pear', slug='pear', price=Decimal('80.00'))
+        plum = Product.objects.create(category=self.category, name='Plum', slug='plum', price=Decimal('90.00'))
+
+        first = self.sync()
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['token'])
+        self.assertFalse(second['has_more'])
+        self.assertEqual([p['name'] for p in first['updated'] + second['updated']], ['Apple', 'Pear', 'Plum'])
+
+        self.assertEqual(self.sync(second['token'])['updated'], [])
+
+        pear.price = Decimal('85.00')
+        pear.save()
+        plum.available = False
+        plum.save()
+        self.apple.delete()
+        delta = self.sync(second['token'])
+        self.assertEqual([(p['name'], p['price']) for p in delta['updated']], [('Pear', '85.00')])
+        self.assertEqual(delta['deactivated'], [plum.id])
+        self.assertEqual(len(delta['deleted']), 1)
+
+    def test_bad_and_expired_tokens(self):
+        self.assertEqual(self.client.get('/api/products/changes/', {'since': 'nope'}).status_code, 400)
+        with override_settings(CATALOG_TOMBSTONE_DAYS=-1):
+            token = self.sync()['token']
+            self.assertEqual(self.client.get('/api/products/changes/', {'since': token}).status_code, 410)
+
+
+class CatalogImportExportTests(CatalogFixtureMixin, TestCase):
+    def test_import_upserts_by_slug_and_round_trips(self):
+        feed = io.StringIO(
+            'slug,name,category_slug,category_name,description,price,stock,image_url,available\n'
+            'apple,Apple Shimla,fruits,Fruits,,130.5,40,,true\n'
+            'milk,Toned Milk,dairy,Dairy,1L pouch,27,100,,1\n'
+            'broken,Broken,dairy,Dairy,,abc,1,,1\n'
+        )
+        out = io.StringIO()
+        with mock.patch('sys.stdin', feed):
+            call_command('import_catalog', '-', stdout=out, stderr=io.StringIO())
+        self.assertIn('1 created, 1 updated, 1 categories created, 0 categories updated, 1 skipped', out.getvalue())
+        self.apple.refresh_from_db()
+        self.assertEqual((self.apple.name, self.apple.price, self.apple.stock), ('Apple Shimla', Decimal('130.50'), 40))
+        self.assertEqual(Product.objects.get(slug='milk').category.slug, 'dairy')
+        self.assertEqual([p['name'] for p in self.client.get('/api/products/', {'q': 'toned'}).json()], ['Toned Milk'])
+
+        exported = io.StringIO()
+        call_command('export_catalog', '--format', 'jsonl', stdout=exported)
+        lines = [json.loads(line) for line in exported.getvalue().splitlines()]
+        self.assertEqual([line['slug'] for line in lines], ['apple', 'milk'])
+        self.assertEqual(lines[0]['price'], '130.50')
+
+    @override_settings(CATALOG_CHANGES_LAG=0)
+    def test_reimporting_the_same_feed_changes_nothing(self):
+        feed = ('slug,name,category_slug,category_name,description,price,stock,image_url,available\n'
+                'apple,Apple Shimla,fruits,Fruits,,130.5,40,,true\n'
+                'milk,Toned Milk,dairy,Dairy,1L pouch,27,100,,1\n')
+        with mock.patch('sys.stdin', io.StringIO(feed)):
+            call_command('import_catalog', '-', stdout=io.StringIO())
+        stamps = dict(Product.objects.values_list('slug', 'updated_at'))
+        token = self.client.get('/api/products/changes/').json()['token']
+        version = catalog_cache.get_version()
+
+        out = io.StringIO()
+        with mock.patch('sys.stdin', io.StringIO(feed)):
+            call_command('import_catalog', '-', stdout=out)
+        self.assertIn('0 created, 0 updated, 0 categories created, 0 categories updated, 0 skipped, 2 unchanged', out.getvalue())
+        self.assertEqual(dict(Product.objects.values_list('slug', 'updated_at')), stamps)
+        self.assertEqual(self.client.get('/api/products/changes/', {'since': token}).json()['updated'], [])
+        self.assertEqual(catalog_cache.get_version(), version)
+
+    def test_import_keeps_open_holds_out_of_stock(self):
+        place_order({'full_name': 'Asha', 'phone': '1', 'address': '-',
+                     'items': [{'product_id': self.apple.id, 'quantity': 30}]})
+        with mock.patch('sys.stdin', io.StringIO('slug,category_slug,price,stock\napple,fruits,120,40\n')):
+            call_command('import_catalog', '-', stdout=io.StringIO())
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.stock, 10)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        inventory.release_expired()
+        self.apple.refresh_from_db()
+        self.assertEqual(self.apple.stock, 40)
+
+    def test_import_renames_existing_categories(self):
+        feed = io.StringIO('slug,category_slug,category_name,price\n'
+                           'kiwi,fruits,Fresh Fruits,45\n'
+                           'pear,fruits,Fresh Fruits,60\n')
+        out = io.StringIO()
+        with mock.patch('sys.stdin', feed):
+            call_command('import_catalog', '-', '--batch-size', '1', stdout=out)
+        self.assertIn('0 categories created, 1 categories updated', out.getvalue())
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.name, 'Fresh Fruits')
+
+    def test_import_reports_malformed_jsonl_lines_per_row(self):
+        feed = io.StringIO(
+            '{"slug": "kiwi", "category_slug": "fruits", "price": "45"}\n'
+            '{"slug": "pear", "category_slug"\n'
+            '[1, 2]\n'
+            '"x"\n'
+        )
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch('sys.stdin', feed):
+            call_command('import_catalog', '-', '--format', 'jsonl', stdout=out, stderr=err)
+        self.assertIn('1 created', out.getvalue())
+        self.assertIn('3 skipped', out.getvalue())
+        self.assertIn('row 2: invalid JSON', err.getvalue())
+        self.assertIn('row 3: not a JSON object', err.getvalue())
+        self.assertIn('row 4: not a JSON object', err.getvalue())
+
+    def test_import_reports_out_of_range_prices_per_row(self):
+        feed = io.StringIO(
+            'slug,category_slug,price\n'
+            'kiwi,fruits,45\n'
+            'gold,fruits,1000000\n'
+            'rounded,fruits,999999.999\n'
+            'huge,fruits,1e40\n'
+            'nan,fruits,NaN\n'
+        )
+        out = io.StringIO()
+        with mock.patch('sys.stdin', feed):
+            call_command('import_catalog', '-', stdout=out, stderr=io.StringIO())
+        self.assertIn('1 created, 0 updated, 0 categories created, 0 categories updated, 4 skipped', out.getvalue())
+        self.assertEqual(Product.objects.get(slug='kiwi').price, Decimal('45.00'))
+
+    def test_import_invalidates_catalog_cache_once(self):
+        self.client.get('/api/products/')
+        feed = io.StringIO('{"slug": "kiwi", "name": "Kiwi", "category_slug": "fruits", "price": "45"}\n')
+        with mock.patch('sys.stdin', feed), mock.patch.object(catalog_cache, 'bump_version', wraps=catalog_cache.bump_version) as bump:
+            call_command('import_catalog', '-', '--format', 'jsonl', stdout=io.StringIO())
+        self.assertEqual(bump.call_count, 1)
+        self.assertEqual(len(self.client.get('/api/products/').json()), 2)
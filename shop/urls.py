@@ -1,9 +1,24 @@
 # Filename: shop/urls.py
+from django.conf import settings
 from django.urls import path
 from . import views
 from . import views
 from . import endpoints as api_views
 
+if settings.ASYNC_VIEWS:
+    from . import async_endpoints
+    product_list = async_endpoints.product_list
+    product_detail = async_endpoints.product_detail
+    order_create = async_endpoints.order_create
+    register = async_endpoints.register
+    login = async_endpoints.login
+else:
+    product_list = api_views.ProductListAPI.as_view()
+    product_detail = api_views.ProductDetailAPI.as_view()
+    order_create = api_views.OrderCreateAPI.as_view()
+    register = api_views.RegisterAPI.as_view()
+    login = api_views.LoginAPI.as_view()
+
 app_name = "shop"
 
 urlpatterns = [
@@ -11,16 +26,27 @@ urlpatterns = [
     path("", views.home, name="home"),
 
     # API Endpoints
-    path("api/register/", api_views.RegisterAPI.as_view(), name="api_register"),
-    path("api/login/", api_views.LoginAPI.as_view(), name="api_login"),
+    path("api/register/", register, name="api_register"),
+    path("api/login/", login, name="api_login"),
+    path("api/auth/cache-stats/", api_views.AuthCacheStatsAPI.as_view(), name="api_auth_cache_stats"),
     path("api/categories/", api_views.CategoryListAPI.as_view(), name="api_categories"),
     path("api/categories/create/", api_views.CategoryCreateAPI.as_view(), name="api_category_create"),
     path("api/categories/<int:pk>/delete/", api_views.CategoryDeleteAPI.as_view(), name="api_category_delete"),
-    path("api/products/", api_views.ProductListAPI.as_view(), name="api_products"),
+    path("api/products/", product_list, name="api_products"),
+    path("api/products/suggest/", api_views.ProductSuggestAPI.as_view(), name="api_product_suggest"),
+    path("api/products/changes/", api_views.ProductChangesAPI.as_view(), name="api_product_changes"),
     path("api/products/create/", api_views.ProductCreateAPI.as_view(), name="api_product_create"),
     path("api/products/<int:pk>/delete/", api_views.ProductDeleteAPI.as_view(), name="api_product_delete"),
-    path("api/products/<int:id>/", api_views.ProductDetailAPI.as_view(), name="api_product_detail"),
-    path("api/orders/create/", api_views.OrderCreateAPI.as_view(), name="api_order_create"),
+    path("api/products/<int:id>/", product_detail, name="api_product_detail"),
+    path("api/catalog/cache-stats/", api_views.CatalogCacheStatsAPI.as_view(), name="api_catalog_cache_stats"),
+    path("api/metrics/requests/", api_views.RequestMetricsAPI.as_view(), name="api_request_metrics"),
+    path("api/metrics/hashing/", api_views.HashingMetricsAPI.as_view(), name="api_hashing_metrics"),
+    path("api/cart/", api_views.CartAPI.as_view(), name="api_cart"),
+    path("api/cart/quote/", api_views.CartQuoteAPI.as_view(), name="api_cart_quote"),
+    path("api/orders/", api_views.OrderListAPI.as_view(), name="api_orders"),
+    path("api/orders/export/", api_views.OrderExportAPI.as_view(), name="api_order_export"),
+    path("api/orders/create/", order_create, name="api_order_create"),
     path("api/orders/<int:id>/", api_views.OrderDetailAPI.as_view(), name="api_order_detail"),
     path("api/orders/<int:order_id>/pay/", api_views.ConfirmPaymentAPI.as_view(), name="api_order_pay"),
+    path("api/payments/reconcile/", api_views.PaymentReconcileAPI.as_view(), name="api_payment_reconcile"),
 ]
\ No newline at end of file